@@ -0,0 +1,52 @@
+"""
+Compare the cost of the passthrough mode against deep copying the inbound measurements,
+which is what every message paid for before passthrough reused the inbound objects.
+
+    python benchmarks/bench_passthrough.py --measurements 100000
+"""
+import argparse
+import os
+import sys
+import time
+from copy import deepcopy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sensors import Sensors  # noqa: E402
+from sensors.sinks import NullSink  # noqa: E402
+from sensors.synthetic import SyntheticFeeder  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--measurements", type=int, default=100000)
+    parser.add_argument("--sensors", type=int, default=1000,
+                        help="Number of the measurements that are configured as sensors.")
+    parser.add_argument("--timesteps", type=int, default=20)
+    opts = parser.parse_args()
+
+    feeder = SyntheticFeeder(measurements=opts.measurements)
+    user_options = {"sensors-config": {mrid: {} for mrid in feeder.mrids[:opts.sensors]},
+                    "passthrough-if-not-specified": True}
+    sensors = Sensors(NullSink(), "read", "write", user_options)
+    messages = list(feeder.messages(opts.timesteps))
+
+    start = time.perf_counter()
+    for message in messages:
+        deepcopy(message['message']['measurements'])
+    copy_time = (time.perf_counter() - start) / len(messages)
+
+    start = time.perf_counter()
+    for message in messages:
+        sensors.on_simulation_message({}, message)
+    process_time = (time.perf_counter() - start) / len(messages)
+    sensors.close()
+
+    print(f"measurements: {opts.measurements} sensors: {opts.sensors}")
+    print(f"deepcopy of inbound measurements: {copy_time * 1000:.2f} ms/message")
+    print(f"on_simulation_message (passthrough): {process_time * 1000:.2f} ms/message")
+    print(f"previous per message cost (estimate): {(copy_time + process_time) * 1000:.2f} ms/message")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+"""
+Compare two benchmark result files written by benchmarks/run.py.
+
+    python benchmarks/compare.py base.json results.json --threshold 0.10
+
+Exits with a non zero status when a scenario's throughput drops, or its p99 latency or
+peak RSS grows, by more than the threshold.
+"""
+import argparse
+import json
+import sys
+
+# metric name and whether a larger value is better
+METRICS = (("messages_per_second", True), ("p50_ms", False), ("p99_ms", False), ("peak_rss_mb", False))
+GATED = ("messages_per_second", "p99_ms", "peak_rss_mb")
+
+
+def compare(base, current, threshold):
+    regressions = []
+    for name, result in current["scenarios"].items():
+        previous = base["scenarios"].get(name)
+        if previous is None:
+            print(f"{name}: no baseline")
+            continue
+        print(f"{name}:")
+        for metric, larger_is_better in METRICS:
+            before = previous[metric]
+            after = result[metric]
+            change = (after - before) / before if before else 0.0
+            worse = -change if larger_is_better else change
+            flag = ""
+            if metric in GATED and worse > threshold:
+                flag = "  REGRESSION"
+                regressions.append((name, metric))
+            print(f"    {metric:22s} {before:12.2f} -> {after:12.2f} ({change:+.1%}){flag}")
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare benchmark results between commits.")
+    parser.add_argument("base")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="Relative change treated as a regression.")
+    opts = parser.parse_args()
+
+    with open(opts.base) as fp:
+        base = json.load(fp)
+    with open(opts.current) as fp:
+        current = json.load(fp)
+    print(f"base: {base.get('commit')}  current: {current.get('commit')}")
+    sys.exit(1 if compare(base, current, opts.threshold) else 0)
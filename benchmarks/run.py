@@ -0,0 +1,167 @@
+"""
+Benchmark suite for the sensor pipeline.
+
+Each scenario generates synthetic simulation output messages and measures the throughput,
+per message latency and peak memory of `Sensors.on_simulation_message` publishing to a
+`NullSink`.  Every scenario runs in its own process so the peak RSS belongs to it alone.
+
+    python benchmarks/run.py --output results.json
+    python benchmarks/run.py --quick --scenario measurements=50000 sensors=5000 interval=30
+    python benchmarks/compare.py base.json results.json
+"""
+import argparse
+from datetime import datetime, timezone
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sensors import Sensors  # noqa: E402
+from sensors.sinks import NullSink  # noqa: E402
+from sensors.player import PlayerFeeder  # noqa: E402
+from sensors.synthetic import SyntheticFeeder  # noqa: E402
+
+DEFAULT_SCENARIO = {
+    "measurements": 1000,
+    "sensors": 1000,
+    "angle-fraction": 0.75,
+    "value-fraction": 0.05,
+    "interval": 30,
+    "passthrough": False,
+    "timesteps": 120,
+    "players": [],
+    "user-options": {}
+}
+
+DEFAULT_SCENARIOS = {
+    "small-instantaneous": {"measurements": 1000, "sensors": 1000, "interval": 0},
+    "medium-30s": {"measurements": 10000, "sensors": 10000, "interval": 30},
+    "large-passthrough": {"measurements": 100000, "sensors": 10000, "interval": 30, "passthrough": True,
+                          "timesteps": 30},
+    "large-30s": {"measurements": 100000, "sensors": 100000, "interval": 30, "timesteps": 30}
+}
+
+QUICK_SCENARIOS = {
+    "small-instantaneous": {"measurements": 1000, "sensors": 1000, "interval": 0, "timesteps": 30},
+    "small-passthrough": {"measurements": 5000, "sensors": 500, "interval": 30, "passthrough": True,
+                          "timesteps": 30}
+}
+
+
+def build_scenario(overrides):
+    scenario = dict(DEFAULT_SCENARIO)
+    scenario.update(overrides)
+    return scenario
+
+
+def run_scenario(scenario):
+    """
+    Run one scenario and return its measurements.  Only the time spent in
+    on_simulation_message is measured, generating the messages is excluded.
+    """
+    if scenario['players']:
+        # GridLAB-D player files drive the values instead of the synthetic sine waves.
+        feeder = PlayerFeeder(scenario['players'], measurements=scenario['measurements'],
+                              angle_fraction=scenario['angle-fraction'])
+    else:
+        feeder = SyntheticFeeder(measurements=scenario['measurements'],
+                                 angle_fraction=scenario['angle-fraction'],
+                                 value_fraction=scenario['value-fraction'])
+    user_options = {"sensors-config": {mrid: {} for mrid in feeder.mrids[:scenario['sensors']]},
+                    "default-aggregation-interval": scenario['interval'],
+                    "passthrough-if-not-specified": scenario['passthrough']}
+    user_options.update(scenario['user-options'])
+
+    sink = NullSink()
+    start = time.perf_counter()
+    sensors = Sensors(sink, "read", "write", user_options)
+    startup = time.perf_counter() - start
+
+    latencies = np.empty(scenario['timesteps'])
+    for index, message in enumerate(feeder.messages(scenario['timesteps'])):
+        start = time.perf_counter()
+        sensors.on_simulation_message({}, message)
+        latencies[index] = time.perf_counter() - start
+    sensors.close()
+
+    total = latencies.sum()
+    return {
+        "startup_ms": startup * 1000,
+        "messages_per_second": len(latencies) / total if total > 0 else 0.0,
+        "measurements_per_second": len(latencies) * scenario['measurements'] / total if total > 0 else 0.0,
+        "p50_ms": float(np.percentile(latencies, 50) * 1000),
+        "p99_ms": float(np.percentile(latencies, 99) * 1000),
+        "mean_ms": float(latencies.mean() * 1000),
+        "published": sink.sent,
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_scenario(values):
+    overrides = {}
+    for value in values:
+        key, _, text = value.partition('=')
+        overrides[key] = json.loads(text)
+    return overrides
+
+
+def get_opts():
+    parser = argparse.ArgumentParser(description="Benchmark Sensors.on_simulation_message.")
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    parser.add_argument("--quick", action="store_true", help="Run the small scenarios only.")
+    parser.add_argument("--scenarios", help="JSON file mapping scenario names to overrides.")
+    parser.add_argument("--scenario", nargs='+', action='append', default=[],
+                        help="An extra scenario given as key=value overrides, e.g. measurements=5000 "
+                             "passthrough=true.")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    opts = get_opts()
+    if opts.scenarios:
+        with open(opts.scenarios) as fp:
+            scenarios = json.load(fp)
+    elif opts.quick or opts.scenario:
+        scenarios = dict(QUICK_SCENARIOS) if opts.quick else {}
+    else:
+        scenarios = dict(DEFAULT_SCENARIOS)
+    for index, values in enumerate(opts.scenario):
+        scenarios[f"custom-{index}"] = parse_scenario(values)
+
+    results = {
+        "commit": git_commit(),
+        "created": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "scenarios": {}
+    }
+    for name, overrides in scenarios.items():
+        scenario = build_scenario(overrides)
+        # A fresh process per scenario keeps the peak RSS of each scenario separate.
+        with multiprocessing.Pool(1, maxtasksperchild=1) as pool:
+            result = pool.apply(run_scenario, (scenario,))
+        results["scenarios"][name] = dict(config=scenario, **result)
+        print(f"{name:24s} {result['messages_per_second']:10.1f} msg/s  p50 {result['p50_ms']:8.2f} ms  "
+              f"p99 {result['p99_ms']:8.2f} ms  rss {result['peak_rss_mb']:8.1f} MB")
+
+    if opts.output:
+        with open(opts.output, 'w') as fp:
+            json.dump(results, fp, indent=2)
@@ -1,52 +1,85 @@
-import csv;
-import numpy as np;
-import matplotlib as mpl;
-import matplotlib.pyplot as plt;
+"""
+Plot the GridLAB-D recorder output of the one meter model and write the meter signals to Input.csv.
+
+    python plot_inputs.py --transformer Transformer.csv --meter TPM_B0.csv --points 2000
+"""
+import argparse
+
+import numpy as np
+import matplotlib.pyplot as plt
+
+from sensors.analysis import DOWNSAMPLE_METHODS, downsample, load_csv
+
+
+def get_opts():
+    parser = argparse.ArgumentParser(description="Plot the transformer and meter recorder output.")
+    parser.add_argument("--transformer", default="Transformer.csv",
+                        help="Transformer recorder output.")
+    parser.add_argument("--meter", default="TPM_B0.csv",
+                        help="Triplex meter recorder output.")
+    parser.add_argument("--save-input", default="Input.csv",
+                        help="File the meter signals are written to, empty to skip it.")
+    parser.add_argument("--points", type=int, default=2000,
+                        help="Points drawn for each line, about the width of the plot in pixels.")
+    parser.add_argument("--method", default="minmax", choices=DOWNSAMPLE_METHODS,
+                        help="How each line is reduced to the points drawn.")
+    parser.add_argument("--no-cache", action='store_true',
+                        help="Parse the recorder output even when a cached array is next to it.")
+    parser.add_argument("--figure",
+                        help="Save the plot to this file instead of showing it.")
+    return parser.parse_args()
+
 
 if __name__ == '__main__':
-    dxf = np.loadtxt('Transformer.csv', dtype=complex, skiprows=9, delimiter=',', usecols=[1,2,3,4,5,6])
-    dtm = np.loadtxt('TPM_B0.csv', dtype=float, skiprows=9, delimiter=',', usecols=[1,2,3,4,5,6])
+    opts = get_opts()
+    dxf = load_csv(opts.transformer, skiprows=9, usecols=[1, 2, 3, 4, 5, 6], dtype=complex, cache=not opts.no_cache)
+    dtm = load_csv(opts.meter, skiprows=9, usecols=[1, 2, 3, 4, 5, 6], cache=not opts.no_cache)
 
     n = dxf.shape[0]
     secs = np.linspace(0, n-1, n)
     hrs = secs / 3600.0
-    vmtr = np.array (np.sqrt (np.add (dtm[:,0]*dtm[:,0],dtm[:,1]*dtm[:,1])))
-    imtr = np.array (np.sqrt (np.add (dtm[:,2]*dtm[:,2],dtm[:,3]*dtm[:,3])))
-    pmtr = dtm[:,4]
-    qmtr = dtm[:,5]
-
-    fig, ax = plt.subplots(4, 1, sharex = 'col')
-    ax[0].plot(hrs, np.absolute(dxf[:,0])/60.0, color='red', label='Va')
-    ax[0].plot(hrs, np.absolute(dxf[:,2])/60.0, color='blue', label='Vb')
-    ax[0].plot(hrs, np.absolute(dxf[:,4])/60.0, color='green', label='Vc')
-    ax[0].plot(hrs, vmtr, color='magenta', label='Vmtr')
+    vmtr = np.hypot(dtm[:, 0], dtm[:, 1])
+    imtr = np.hypot(dtm[:, 2], dtm[:, 3])
+    pmtr = dtm[:, 4]
+    qmtr = dtm[:, 5]
+
+    def plot(axis, values, **kwargs):
+        axis.plot(*downsample(hrs, values, opts.points, opts.method), **kwargs)
+
+    fig, ax = plt.subplots(4, 1, sharex='col')
+    plot(ax[0], np.absolute(dxf[:, 0])/60.0, color='red', label='Va')
+    plot(ax[0], np.absolute(dxf[:, 2])/60.0, color='blue', label='Vb')
+    plot(ax[0], np.absolute(dxf[:, 4])/60.0, color='green', label='Vc')
+    plot(ax[0], vmtr, color='magenta', label='Vmtr')
     ax[0].grid()
     ax[0].legend()
-    ax[0].set_ylabel ('Voltage [120-V base]')
+    ax[0].set_ylabel('Voltage [120-V base]')
 
-    ax[1].plot(hrs, np.absolute(dxf[:,1])*0.001, color='red', label='Sa')
-    ax[1].plot(hrs, np.absolute(dxf[:,3])*0.001, color='blue', label='Sb')
-    ax[1].plot(hrs, np.absolute(dxf[:,5])*0.001, color='green', label='Sc')
+    plot(ax[1], np.absolute(dxf[:, 1])*0.001, color='red', label='Sa')
+    plot(ax[1], np.absolute(dxf[:, 3])*0.001, color='blue', label='Sb')
+    plot(ax[1], np.absolute(dxf[:, 5])*0.001, color='green', label='Sc')
     ax[1].grid()
     ax[1].legend()
-    ax[1].set_ylabel ('Substation Power [kVA]')
+    ax[1].set_ylabel('Substation Power [kVA]')
 
-    ax[2].plot(hrs, imtr, color='magenta', label='Imtr')
+    plot(ax[2], imtr, color='magenta', label='Imtr')
     ax[2].grid()
     ax[2].legend()
-    ax[2].set_ylabel ('Meter Current [A]')
+    ax[2].set_ylabel('Meter Current [A]')
 
-    ax[3].plot(hrs, pmtr*0.001, color='red', label='Pmtr')
-    ax[3].plot(hrs, qmtr*0.001, color='blue', label='Qmtr')
+    plot(ax[3], pmtr*0.001, color='red', label='Pmtr')
+    plot(ax[3], qmtr*0.001, color='blue', label='Qmtr')
     ax[3].grid()
     ax[3].legend()
-    ax[3].set_ylabel ('Meter Power [kVA]')
-
-    ax[3].set_xlabel ('Hours')
-    plt.show()
-
-    np.savetxt ('Input.csv', np.column_stack((secs, vmtr, imtr, pmtr, qmtr)),
-                fmt=['%d', '%.3f', '%.3f', '%.2f', '%.2f'], 
-                delimiter=',', header='t[s],v,i,p,q')
+    ax[3].set_ylabel('Meter Power [kVA]')
 
+    ax[3].set_xlabel('Hours')
+    if opts.figure:
+        fig.savefig(opts.figure)
+    else:
+        plt.show()
 
+    if opts.save_input:
+        np.savetxt(opts.save_input, np.column_stack((secs, vmtr, imtr, pmtr, qmtr)),
+                   fmt=['%d', '%.3f', '%.3f', '%.2f', '%.2f'],
+                   delimiter=',', header='t[s],v,i,p,q')
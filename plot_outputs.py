@@ -1,65 +1,85 @@
-import csv;
-import numpy as np;
-import matplotlib as mpl;
-import matplotlib.pyplot as plt;
+"""
+Plot the raw meter signals of Input.csv against the sensor output of Output.csv, or the
+inbound and published values of chosen sensors from a measurement-capture directory.
 
-if __name__ == '__main__':
-    d1 = np.loadtxt('Input.csv', dtype=float, skiprows=1, delimiter=',')
-    h1 = d1[:,0] / 3600.0
-    vraw = d1[:,1]
-    iraw = d1[:,2]
-    praw = d1[:,3]
-    qraw = d1[:,4]
+    python plot_outputs.py --input Input.csv --output Output.csv
+    python plot_outputs.py --capture /tmp/gridappsd_tmp/12345/capture --mrid _99db0dc7 _0031ff7c
+"""
+import argparse
+
+import numpy as np
+import matplotlib.pyplot as plt
+
+from sensors.analysis import DOWNSAMPLE_METHODS, downsample, load_csv
+from sensors.capture import CaptureReader
 
-    d2 = np.loadtxt('Output.csv', dtype=float, skiprows=1, delimiter=',')
-    h2 = d2[:,0] / 3600.0
-    vavg = d2[:,1]
-    vmin = d2[:,2]
-    vmax = d2[:,3]
-    iavg = d2[:,4]
-    imin = d2[:,5]
-    imax = d2[:,6]
-    pavg = d2[:,7]
-    pmin = d2[:,8]
-    pmax = d2[:,9]
-    qavg = d2[:,10]
-    qmin = d2[:,11]
-    qmax = d2[:,12]
 
-    fig, ax = plt.subplots(4, 1, sharex = 'col')
-    ax[0].plot(h1, vraw, color='black', label='Raw')
-    ax[0].step(h2, vavg, where='post', marker='o', linewidth=1, markersize=2, color='red', label='Avg')
-    ax[0].step(h2, vmin, where='post', marker='o', linewidth=1, markersize=2, color='blue', label='Min')
-    ax[0].step(h2, vmax, where='post', marker='o', linewidth=1, markersize=2, color='green', label='Max')
-    ax[0].grid()
-    ax[0].legend()
-    ax[0].set_ylabel ('Voltage [120-V base]')
+def get_opts():
+    parser = argparse.ArgumentParser(description="Plot sensor input against sensor output.")
+    parser.add_argument("--input", default="Input.csv",
+                        help="Raw meter signals written by plot_inputs.py.")
+    parser.add_argument("--output", default="Output.csv",
+                        help="Average, minimum and maximum of each signal per interval.")
+    parser.add_argument("--capture",
+                        help="measurement-capture directory of the service, plotted instead of the CSV files.")
+    parser.add_argument("--mrid", nargs='+', default=[],
+                        help="Sensors plotted from the capture, the first one by default.")
+    parser.add_argument("--points", type=int, default=2000,
+                        help="Points drawn for each line, about the width of the plot in pixels.")
+    parser.add_argument("--method", default="minmax", choices=DOWNSAMPLE_METHODS,
+                        help="How each line is reduced to the points drawn.")
+    parser.add_argument("--no-cache", action='store_true',
+                        help="Parse the CSV files even when a cached array is next to them.")
+    parser.add_argument("--figure",
+                        help="Save the plot to this file instead of showing it.")
+    return parser.parse_args()
 
-    ax[1].plot(h1, iraw, color='black', label='Raw')
-    ax[1].step(h2, iavg, where='post', marker='o', linewidth=1, markersize=2, color='red', label='Avg')
-    ax[1].step(h2, imin, where='post', marker='o', linewidth=1, markersize=2, color='blue', label='Min')
-    ax[1].step(h2, imax, where='post', marker='o', linewidth=1, markersize=2, color='green', label='Max')
-    ax[1].grid()
-    ax[1].legend()
-    ax[1].set_ylabel ('Current [A]')
 
-    ax[2].plot(h1, praw, color='black', label='Raw')
-    ax[2].step(h2, pavg, where='post', marker='o', linewidth=1, markersize=2, color='red', label='Avg')
-    ax[2].step(h2, pmin, where='post', marker='o', linewidth=1, markersize=2, color='blue', label='Min')
-    ax[2].step(h2, pmax, where='post', marker='o', linewidth=1, markersize=2, color='green', label='Max')
-    ax[2].grid()
-    ax[2].legend()
-    ax[2].set_ylabel ('Real Power [W]')
+def plot_files(opts):
+    d1 = load_csv(opts.input, skiprows=1, cache=not opts.no_cache)
+    h1 = d1[:, 0] / 3600.0
+    d2 = load_csv(opts.output, skiprows=1, cache=not opts.no_cache)
+    h2 = d2[:, 0] / 3600.0
 
-    ax[3].plot(h1, qraw, color='black', label='Raw')
-    ax[3].step(h2, qavg, where='post', marker='o', linewidth=1, markersize=2, color='red', label='Avg')
-    ax[3].step(h2, qmin, where='post', marker='o', linewidth=1, markersize=2, color='blue', label='Min')
-    ax[3].step(h2, qmax, where='post', marker='o', linewidth=1, markersize=2, color='green', label='Max')
-    ax[3].grid()
-    ax[3].legend()
-    ax[3].set_ylabel ('Reactive Power [VAR]')
+    fig, ax = plt.subplots(4, 1, sharex='col')
+    labels = ('Voltage [120-V base]', 'Current [A]', 'Real Power [W]', 'Reactive Power [VAR]')
+    for index, label in enumerate(labels):
+        ax[index].plot(*downsample(h1, d1[:, index + 1], opts.points, opts.method), color='black', label='Raw')
+        for offset, name, color in ((1, 'Avg', 'red'), (2, 'Min', 'blue'), (3, 'Max', 'green')):
+            ax[index].step(*downsample(h2, d2[:, 3 * index + offset], opts.points, opts.method), where='post',
+                           marker='o', linewidth=1, markersize=2, color=color, label=name)
+        ax[index].grid()
+        ax[index].legend()
+        ax[index].set_ylabel(label)
+    ax[-1].set_xlabel('Hours')
+    return fig
 
-    ax[3].set_xlabel ('Hours')
-    plt.show()
 
+def plot_capture(opts):
+    reader = CaptureReader(opts.capture)
+    mrids = opts.mrid or reader.mrids[:1]
+    fig, ax = plt.subplots(len(mrids), 1, sharex='col', squeeze=False)
+    start = None
+    for axis, mrid in zip(ax[:, 0], mrids):
+        series = reader.series(mrid)
+        if start is None and len(series['timestamp']):
+            start = series['timestamp'][0]
+        hours = (series['timestamp'] - (start or 0)) / 3600.0
+        axis.plot(*downsample(hours, series['magnitude'], opts.points, opts.method), color='black', label='Raw')
+        published = ~np.isnan(series['value'])
+        axis.step(*downsample(hours[published], series['value'][published], opts.points, opts.method),
+                  where='post', marker='o', linewidth=1, markersize=2, color='red', label='Published')
+        axis.grid()
+        axis.legend()
+        axis.set_ylabel(mrid)
+    ax[-1, 0].set_xlabel('Hours')
+    return fig
 
+
+if __name__ == '__main__':
+    opts = get_opts()
+    fig = plot_capture(opts) if opts.capture else plot_files(opts)
+    if opts.figure:
+        fig.savefig(opts.figure)
+    else:
+        plt.show()
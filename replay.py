@@ -0,0 +1,114 @@
+"""
+Replay a recorded measurement capture through the sensor simulator without a running
+GridAPPS-D platform.
+
+    python replay.py measurement.infile.txt noisy.jsonl --options user_options.json
+
+Messages can also be generated from GridLAB-D player files instead of read from a capture:
+
+    python replay.py --players phase_A.player phase_B.player phase_C.player --measurements 10000 - noisy.jsonl
+"""
+import argparse
+import json
+import logging
+import os
+
+from sensors.player import INTERPOLATIONS, PlayerFeeder
+from sensors.replay import read_lines, read_messages, replay
+from sensors.sharded import sharded_replay
+from sensors.sinks import JsonlSink, open_text
+
+_log = logging.getLogger(__name__)
+
+
+def load_user_options(value):
+    """
+    Load user options from a JSON string or file.  A full GridAPPS-D request is also accepted,
+    in which case the options of the sensor simulator service config are used.
+    """
+    if value is None:
+        return {}
+    if os.path.exists(value):
+        with open(value) as fp:
+            options = json.load(fp)
+    else:
+        options = json.loads(value)
+
+    for config in options.get('service_configs', []):
+        if config.get('id') == "gridappsd-sensor-simulator":
+            return config.get('user_options', {})
+    return options
+
+
+def get_opts():
+    parser = argparse.ArgumentParser(description="Replay a JSONL measurement capture through the sensor simulator.")
+    parser.add_argument("input",
+                        help="Capture with one simulation output message per line (.gz is supported), "
+                             "ignored with --players.")
+    parser.add_argument("output",
+                        help="File the sensor output messages are written to (.gz is supported).")
+    parser.add_argument("-o", "--options",
+                        help="User options (or a full request) as a JSON string or file.")
+    parser.add_argument("-s", "--simulation-id", default="replay",
+                        help="Simulation id used for diagnostics output paths.")
+    parser.add_argument("--progress", type=int, default=0,
+                        help="Report the rate every N messages.")
+    parser.add_argument("-w", "--workers", type=int, default=1,
+                        help="Split the sensors across N processes (0 uses every CPU).  The publishing, "
+                             "diagnostics and checkpoint options need a single process.")
+    parser.add_argument("--players", nargs='+',
+                        help="Generate the messages from these GridLAB-D player files.")
+    parser.add_argument("--measurements", type=int, default=1000,
+                        help="Measurement mrids generated from the players.")
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help="Factor applied to the player values.")
+    parser.add_argument("--step", type=int, default=1,
+                        help="Seconds between the generated messages.")
+    parser.add_argument("--timesteps", type=int,
+                        help="Messages generated, by default until the players end.")
+    parser.add_argument("--interpolation", default="linear", choices=INTERPOLATIONS,
+                        help="How the player values are filled in between their rows.")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Seed of the scale and angles of the generated measurements.")
+    parser.add_argument("--generate-only", action='store_true',
+                        help="Write the generated messages to the output instead of the sensor output.")
+    return parser.parse_args()
+
+
+def player_messages(opts):
+    feeder = PlayerFeeder(opts.players, measurements=opts.measurements, scale=opts.scale,
+                          interpolation=opts.interpolation, seed=opts.seed, simulation_id=opts.simulation_id)
+    return feeder.messages(opts.timesteps, opts.step)
+
+
+if __name__ == '__main__':
+    opts = get_opts()
+    logging.basicConfig(level=logging.INFO if opts.progress else logging.WARNING)
+
+    user_options = load_user_options(opts.options)
+    if opts.players and opts.generate_only:
+        sink = JsonlSink(opts.output)
+        try:
+            for message in player_messages(opts):
+                sink.send(None, message)
+        finally:
+            sink.close()
+        print(f"Generated {sink.sent} messages")
+    else:
+        if opts.workers == 1:
+            messages = player_messages(opts) if opts.players else read_messages(opts.input)
+            sink = JsonlSink(opts.output)
+            try:
+                stats = replay(messages, sink, user_options,
+                               simulation_id=opts.simulation_id, progress=opts.progress)
+            finally:
+                sink.close()
+        else:
+            lines = (json.dumps(m) for m in player_messages(opts)) if opts.players else read_lines(opts.input)
+            with open_text(opts.output, 'w') as fp:
+                stats = sharded_replay(lines, fp, user_options, workers=opts.workers or None,
+                                       simulation_id=opts.simulation_id, progress=opts.progress)
+
+        rate = stats.messages / stats.seconds if stats.seconds > 0 else 0.0
+        print(f"Replayed {stats.messages} messages, published {stats.published} in {stats.seconds:.2f} s "
+              f"({rate:.1f} msg/s)")
@@ -1,38 +1,149 @@
 from __future__ import absolute_import, print_function
 
 import argparse
-import calendar
-import csv
 import json
 import logging
-import time
-from datetime import datetime
+import signal
 
 from gridappsd import GridAPPSD, utils
-from gridappsd.topics import service_output_topic, simulation_output_topic
+from gridappsd.topics import (service_input_topic, service_output_topic, simulation_input_topic,
+                              simulation_log_topic, simulation_output_topic)
 
 from sensors import Sensors
+from sensors.batch import run_batch
+from sensors.host import SensorHost
+from sensors.logs import configure_logging
+from sensors.rules import SensorRules
 
 _log = logging.getLogger(__name__)
 _log.setLevel(logging.DEBUG)
 
+SERVICE_ID = "gridappsd-sensor-simulator"
+# Topic a host process receives {"command": "start"|"stop", "simulation_id": ..., "request": ...} on.
+HOST_TOPIC = service_input_topic(SERVICE_ID, "host")
+# Simulation id that runs the sensors over a signal table instead of a simulation.
+BATCH_SIMULATION_ID = "-9999"
+
+
+def stats_topic(simulation_id):
+    """
+    Topic the metrics of a simulation's sensors are published to.
+    """
+    return f"/topic/goss.gridappsd.simulation.{SERVICE_ID}.{simulation_id}.stats"
+
+
+MEASUREMENT_INFO_QUERY = """
+PREFIX r: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>
+PREFIX c: <http://iec.ch/TC57/CIM100#>
+SELECT ?mid ?type ?phases WHERE {
+ VALUES ?fdrid {"%s"}
+ ?fdr c:IdentifiedObject.mRID ?fdrid.
+ ?eq c:Equipment.EquipmentContainer ?fdr.
+ ?m c:Measurement.PowerSystemResource ?eq.
+ ?m c:IdentifiedObject.mRID ?mid.
+ ?m c:Measurement.measurementType ?type.
+ OPTIONAL {?m c:Measurement.phases ?phsraw.
+   bind(strafter(str(?phsraw),"PhaseCode.") as ?phases)}
+}
+"""
+
+
+def query_measurement_info(gapp, model_id):
+    """
+    Query the type and phases of every measurement in a model, used by sensor-rules that
+    select measurements by type or phase.
+
+    :return: mapping of measurement mrid to {"type": ..., "phases": ...}
+    """
+    response = gapp.query_data(MEASUREMENT_INFO_QUERY % model_id)
+    info = {}
+    for binding in response['data']['results']['bindings']:
+        info[binding['mid']['value']] = {"type": binding['type']['value'],
+                                         "phases": binding.get('phases', {}).get('value', '')}
+    return info
+
+
+def simulation_args(gapp, simulation_id, request):
+    """
+    Build the keyword arguments of the `Sensors` of a simulation from its request.
+    """
+    user_options = request['service_configs'][0]['user_options']
+    measurement_info = None
+    if SensorRules(rules=user_options.get('sensor-rules')).needs_info:
+        model_id = request['power_system_config']['Line_name']
+        measurement_info = query_measurement_info(gapp, model_id)
+        _log.info(f"queried {len(measurement_info)} measurements of model {model_id}")
+    return dict(user_options=user_options,
+                read_topic=simulation_output_topic(simulation_id),
+                write_topic=service_output_topic(SERVICE_ID, simulation_id),
+                log_topic=simulation_log_topic(simulation_id),
+                control_topic=simulation_input_topic(simulation_id),
+                command_topic=service_input_topic(SERVICE_ID, simulation_id),
+                stats_topic=stats_topic(simulation_id),
+                measurement_info=measurement_info)
+
+
+def run_host(gapp, workers):
+    """
+    Host the sensors of every simulation started on the host topic in this process.
+    """
+    host = SensorHost(gapp, workers=workers)
+
+    def on_host_message(headers, message):
+        if isinstance(message, str):
+            message = json.loads(message)
+        simulation_id = str(message['simulation_id'])
+        try:
+            if message.get('command', 'start') == 'start':
+                request = message['request']
+                if isinstance(request, str):
+                    request = json.loads(request)
+                host.add_simulation(simulation_id, **simulation_args(gapp, simulation_id, request))
+            elif message['command'] == 'stop':
+                host.remove_simulation(simulation_id)
+        except Exception:
+            _log.exception(f"Unable to handle host command for simulation {simulation_id}")
+
+    def stop(signum, frame):
+        host.stop()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    gapp.subscribe(HOST_TOPIC, on_host_message)
+    _log.info(f"Hosting sensors with {workers} workers, send simulations to {HOST_TOPIC}")
+    host.main_loop()
+
 
 def get_opts():
     parser = argparse.ArgumentParser()
 
-    parser.add_argument("simulation_id",
+    parser.add_argument("simulation_id", nargs='?',
                         help="Simulation id to use for responses on the message bus.")
-    parser.add_argument("request",
+    parser.add_argument("request", nargs='?',
                         help="GRIDAPPSD based request that is sent from the client to start a simulation.")
-
-    # parser.add_argument("--nominal", type=float, default=100.0, nargs='+',
-    #                     help="Specify the nominal range of sensor measurements.")
-    # parser.add_argument("--perunit-confidence", type=float, default=0.01, nargs='+',
-    #                     help="Specify the 95% confidence interval, in +/- perunit of nominal range.")
-    # parser.add_argument("--perunit-dropping", type=float, default=0.01, nargs='+',
-    #                     help="Fraction of measurements that are not republished.")
-    # parser.add_argument("--interval", type=float, default=30.0,
-    #                     help="Interval in seconds for min, max, average aggregation.")
+    parser.add_argument("--host", action='store_true',
+                        help="Host the sensors of many simulations in this process, simulations are started "
+                             f"by messages on {HOST_TOPIC}.")
+    parser.add_argument("--workers", type=int, default=4,
+                        help="Number of worker threads processing measurements in host mode.")
+
+    parser.add_argument("--input", default="Input.csv",
+                        help="Signal table of the -9999 batch mode, a CSV file with a header row or a .npy file.")
+    parser.add_argument("--output", default="Output.csv",
+                        help="Average, minimum and maximum of each signal written by the -9999 batch mode, "
+                             "a .npy output is written as a binary array.")
+    parser.add_argument("--nominal", type=float, default=[100.0], nargs='+',
+                        help="Specify the nominal range of sensor measurements.")
+    parser.add_argument("--perunit-confidence", type=float, default=[0.01], nargs='+',
+                        help="Specify the 95%% confidence interval, in +/- perunit of nominal range.")
+    parser.add_argument("--perunit-dropping", type=float, default=[0.01], nargs='+',
+                        help="Fraction of measurements that are not republished.")
+    parser.add_argument("--interval", type=float, default=[30.0], nargs='+',
+                        help="Interval in seconds for min, max, average aggregation.")
+    parser.add_argument("--random-seed", type=int, default=0,
+                        help="Seed for the noise, drops and staggered starts of the batch mode.")
+    parser.add_argument("--chunk-rows", type=int, default=100000,
+                        help="Rows of the input table processed at once in batch mode.")
 
     parser.add_argument("-u", "--username", default=utils.get_gridappsd_user(),
                         help="The username to authenticate with the message bus.")
@@ -40,100 +151,75 @@ def get_opts():
                         help="The password to authenticate with the message bus.")
     parser.add_argument("-a", "--address", default=utils.get_gridappsd_address(),
                         help="The tcp://addr:port that gridappsd is located on.")
+    parser.add_argument("--log-level", default="INFO", choices=("DEBUG", "INFO", "WARNING", "ERROR"),
+                        help="Level of the records written to sensors.log.")
+    parser.add_argument("--log-ring-buffer", type=int, default=0,
+                        help="Number of recent records below the log level kept in memory and written to "
+                             "sensors.log before an error, 0 disables the buffer.")
     opts = parser.parse_args()
 
+    if opts.host or opts.simulation_id == BATCH_SIMULATION_ID:
+        return opts
+
     assert opts.request, "request must be passed."
 
     opts.request = json.loads(opts.request)
 
     return opts
-#
-# def run_test (iname, oname, opts):
-#     ip = open (iname, 'r', newline='')
-#
-#     # create a sensor for each input signal column
-#     rdr = csv.reader (ip, delimiter=',')
-#     colnames = next (rdr)
-#     colnames[0] = 't'
-#     ncol = len(colnames) - 1
-#     sensors = {}
-#     outnames = []
-#     outnames.append ('t')
-#     for i in range(ncol):
-#         column_name=colnames[i+1]
-#         sensors[i] = Sensor(None,
-#                             seed=opts.random_seed,
-#                             nominal=opts.nominal,
-#                             perunit_confidence95=opts.perunit_confidence,
-#                             perunit_dropping=opts.perunit_dropping,
-#                             interval=opts.interval,
-#                             output_topic=column_name)
-#         outnames.append (column_name + '_avg')
-#         outnames.append (column_name + '_min')
-#         outnames.append (column_name + '_max')
-#     for i in sensors:
-#         print ('Sensor', i, '=', sensors[i])
-#
-#     op = open (oname, 'w')
-#     wrt = csv.writer (op, delimiter=',')
-#     wrt.writerow (outnames)
-#
-#     # write average, minimum and maximum for each sensor
-#     outputs = [0.0] * (3 * ncol + 1)
-#     # loop through the input rows, add samples, write the outputs
-#     for row in rdr:
-#         t = int(row[0])
-#         outputs[0] = t
-#         have_output = False
-#         for i in sensors:
-#             val = float(row[i+1])
-#             sensors[i].add_sample(t, val)
-#             if sensors[i].ready_to_sample(t):
-#                 sample = sensors[i].take_range_sample(t)
-#                 if sample[0] is not None:
-#                     outputs[3*i + 1] = sample[0]
-#                     outputs[3*i + 2] = sample[1]
-#                     outputs[3*i + 3] = sample[2]
-#                 else:
-#                     outputs[3*i + 1] = 0.0
-#                     outputs[3*i + 2] = 0.0
-#                     outputs[3*i + 3] = 0.0
-#                 have_output = True
-#         if have_output:
-#             wrt.writerow (['{:.3f}'.format(x) for x in outputs])
-#
-#     ip.close()
-#     op.close()
+
+
+def run_test(opts):
+    """
+    Run every signal column of opts.input through its own range sensor and write the
+    noisy average, minimum and maximum of each to opts.output, see `sensors.batch.run_batch`.
+    The sensor options take one value for every signal or one value per signal.
+    """
+    config = {"normal-value": _per_signal(opts.nominal),
+              "perunit-confidence-band": _per_signal(opts.perunit_confidence),
+              "perunit-drop-rate": _per_signal(opts.perunit_dropping),
+              "aggregation-interval": _per_signal(opts.interval)}
+    stats = run_batch(opts.input, opts.output, config, random_seed=opts.random_seed, chunk_rows=opts.chunk_rows)
+    print(f"{stats.rows} rows of {opts.input} -> {stats.written} rows of {opts.output} in {stats.seconds:.2f} s")
+
+
+def _per_signal(values):
+    return values[0] if len(values) == 1 else values
 
 
 if __name__ == '__main__':
     import os
-    import shutil
 
-    sensors = dict()
     opts = get_opts()
 
-    if opts.simulation_id == '-9999':
+    if opts.simulation_id == BATCH_SIMULATION_ID:
+        run_test(opts)
         raise SystemExit
 
-    user_options = opts.request['service_configs'][0]['user_options']
-    service_id = "gridappsd-sensor-simulator"
-
     gapp = GridAPPSD(username=opts.username,
                      password=opts.password,
                      address=opts.address)
 
-    read_topic = simulation_output_topic(opts.simulation_id)
-    write_topic = service_output_topic(service_id, opts.simulation_id)
-
-    log_file = "/tmp/gridappsd_tmp/{}/sensors.log".format(opts.simulation_id)
+    if opts.host:
+        log_file = "/tmp/gridappsd_tmp/sensor-host/sensors.log"
+    else:
+        log_file = "/tmp/gridappsd_tmp/{}/sensors.log".format(opts.simulation_id)
     if not os.path.exists(os.path.dirname(log_file)):
         os.makedirs(os.path.dirname(log_file))
 
     with open(log_file, 'w') as fp:
-        logging.basicConfig(stream=fp, level=logging.INFO)
-        logging.getLogger().info(f"read topic: {read_topic}\nwrite topic: {write_topic}")
-        logging.getLogger().info(f"user options: {user_options}")
-        run_sensors = Sensors(gapp, read_topic=read_topic, write_topic=write_topic,
-                              user_options=user_options)
-        run_sensors.main_loop()
+        configure_logging(fp, opts.log_level, opts.log_ring_buffer)
+        if opts.host:
+            run_host(gapp, opts.workers)
+        else:
+            args = simulation_args(gapp, opts.simulation_id, opts.request)
+            logging.getLogger().info(f"read topic: {args['read_topic']}\nwrite topic: {args['write_topic']}")
+            logging.getLogger().info(f"user options: {args['user_options']}")
+            run_sensors = Sensors(gapp, simulation_id=opts.simulation_id, **args)
+
+            def stop(signum, frame):
+                run_sensors.simulation_complete()
+
+            signal.signal(signal.SIGTERM, stop)
+            signal.signal(signal.SIGINT, stop)
+            run_sensors.main_loop()
+        gapp.disconnect()
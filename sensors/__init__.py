@@ -1 +1,2 @@
+from .bank import SensorBank, BankSample
 from .sensor import Sensors, Sensor
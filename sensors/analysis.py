@@ -0,0 +1,146 @@
+import hashlib
+import itertools
+import logging
+import os
+import warnings
+
+import numpy as np
+
+_log = logging.getLogger(__file__)
+
+# Ways `downsample` reduces a series to the points that can be told apart on screen.
+DOWNSAMPLE_METHODS = ('minmax', 'lttb', 'none')
+
+
+def load_csv(path, skiprows=0, usecols=None, dtype=float, cache=True, chunk_rows=1000000):
+    """
+    Load a numeric CSV file, such as the recorder output of plot_inputs.py, as a 2-d array.
+
+    The file is parsed chunk_rows lines at a time.  With cache the parsed array is saved next
+    to the source as <path>.<key>.npy, where the key depends on the arguments, and later
+    loads memory map it for as long as it is newer than the source.
+
+    :param path: CSV file, lines starting with # are skipped.
+    :param skiprows: Lines skipped at the top of the file.
+    :param usecols: Columns loaded, all of them by default.
+    :param dtype: Type of the values, complex reads GridLAB-D's "+1.2-3.4j" values.
+    :param cache: Read and write the cached array.
+    :param chunk_rows: Lines parsed at once.
+    :return: (rows, columns) array.
+    """
+    cached = None
+    if cache:
+        key = repr((skiprows, None if usecols is None else list(usecols), np.dtype(dtype).str))
+        cached = f"{path}.{hashlib.sha1(key.encode()).hexdigest()[:8]}.npy"
+        if os.path.exists(cached) and os.path.getmtime(cached) >= os.path.getmtime(path):
+            return np.load(cached, mmap_mode='r', allow_pickle=False)
+
+    chunks = list(read_csv_chunks(path, skiprows, usecols, dtype, chunk_rows))
+    data = np.concatenate(chunks) if chunks else np.zeros((0, 0), dtype=dtype)
+
+    if cached is not None:
+        staging = f"{cached}.tmp"
+        with open(staging, 'wb') as fp:
+            np.save(fp, data, allow_pickle=False)
+        os.replace(staging, cached)
+        _log.info(f"Cached {data.shape} values of {path} to {cached}")
+    return data
+
+
+def read_csv_chunks(path, skiprows=0, usecols=None, dtype=float, chunk_rows=1000000):
+    """
+    Generate the values of a numeric CSV file as 2-d arrays of at most chunk_rows rows, see
+    `load_csv` for the parameters.
+    """
+    with open(path) as fp:
+        for _ in itertools.islice(fp, skiprows):
+            pass
+        while True:
+            lines = list(itertools.islice(fp, chunk_rows))
+            if not lines:
+                break
+            with warnings.catch_warnings():
+                # A chunk holding only comments is empty.
+                warnings.simplefilter('ignore', UserWarning)
+                chunk = np.loadtxt(lines, dtype=dtype, delimiter=',', usecols=usecols, ndmin=2)
+            if len(chunk):
+                yield chunk
+
+
+def downsample(x, y, points, method='minmax'):
+    """
+    Reduce a series to about points points that plot like the full series.
+
+    :param x: Increasing x values.
+    :param y: y values.
+    :param points: Number of points kept, about the width of the plot in pixels.
+    :param method: One of `DOWNSAMPLE_METHODS`.
+    :return: tuple of the x and y arrays kept.
+    """
+    if method == 'minmax':
+        return downsample_minmax(x, y, max(1, points // 2))
+    if method == 'lttb':
+        return downsample_lttb(x, y, points)
+    if method == 'none':
+        return x, y
+    raise ValueError(f"Invalid method {method}, expected one of {DOWNSAMPLE_METHODS}")
+
+
+def downsample_minmax(x, y, buckets):
+    """
+    Keep the smallest and largest value of each of buckets equal runs of the series, in
+    order, so every peak of the series is drawn.  NaN values are only kept when a whole
+    bucket is NaN, leaving a gap in the line.
+
+    :return: tuple of the x and y arrays kept, at most 2 * buckets long.
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    n = len(y)
+    if n <= 2 * buckets:
+        return x, y
+    size = -(-n // buckets)
+    buckets = -(-n // size)
+    padded = np.full(buckets * size, np.nan)
+    padded[:n] = y
+    padded = padded.reshape(buckets, size)
+    missing = np.isnan(padded)
+    low = np.where(missing, np.inf, padded).argmin(axis=1)
+    high = np.where(missing, -np.inf, padded).argmax(axis=1)
+    index = np.sort(np.stack((low, high), axis=1), axis=1) + np.arange(0, buckets * size, size)[:, np.newaxis]
+    index = np.unique(np.minimum(index.ravel(), n - 1))
+    return x[index], y[index]
+
+
+def downsample_lttb(x, y, threshold):
+    """
+    Keep threshold points with the largest triangle three buckets algorithm (Steinarsson,
+    "Downsampling Time Series for Visual Representation", 2013): the first and last point and
+    the point of each bucket making the largest triangle with the point kept before it and the
+    mean of the next bucket.  The y values must be finite.
+
+    :return: tuple of the x and y arrays kept.
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return x, y
+    xf = x.astype(np.float64)
+    yf = y.astype(np.float64)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    ends = np.append(edges[1:], n)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        following = slice(end, ends[bucket + 1])
+        mean_x = xf[following].mean()
+        mean_y = yf[following].mean()
+        area = np.abs((xf[previous] - mean_x) * (yf[start:end] - yf[previous]) -
+                      (xf[previous] - xf[start:end]) * (mean_y - yf[previous]))
+        previous = start + int(area.argmax())
+        selected[bucket + 1] = previous
+    return x[selected], y[selected]
@@ -0,0 +1,530 @@
+from collections import namedtuple
+import logging
+
+import numpy as np
+
+from . import quantiles
+from .schedule import TimingWheel
+from .streams import RandomStreams, STAGGER, DROP, NOISE
+
+_log = logging.getLogger(__file__)
+
+# Normal value used for the angle channel of every sensor (degrees).
+ANGLE_NORMAL_VALUE = 180
+
+MAGNITUDE = 0
+ANGLE = 1
+
+BankSample = namedtuple('BankSample', ['rows', 'emit', 'dropped', 'magnitude', 'angle',
+                                       'magnitude_min', 'magnitude_max', 'angle_min', 'angle_max', 'suppressed',
+                                       'magnitude_variance', 'angle_variance', 'magnitude_p5', 'magnitude_p95',
+                                       'angle_p5', 'angle_p95'])
+BankSample.__doc__ = """
+The result of a single `SensorBank.update` call.
+
+Only the sensors whose aggregation interval closed this timestep are described, every
+other field holds one entry for each of the rows.
+
+rows      - sorted indexes of the sensors whose interval closed
+emit      - boolean mask of the rows that published a value this timestep
+dropped   - boolean mask of the rows whose value was dropped
+magnitude - noisy magnitude of each row (only meaningful where emit is True)
+angle     - noisy angle of each row (only meaningful where emit is True)
+magnitude_min, magnitude_max, angle_min, angle_max
+          - noisy minimum and maximum of the interval for the sensors with range output
+            (NaN for the other sensors)
+suppressed - boolean mask of the rows whose value was within their deadband and not published
+magnitude_variance, angle_variance
+          - variance of the values received during the interval for the sensors with variance
+            output (NaN for the other sensors)
+magnitude_p5, magnitude_p95, angle_p5, angle_p95
+          - estimated 5th and 95th percentiles of the values received during the interval for
+            the sensors with percentile output (NaN for the other sensors)
+"""
+
+
+class SensorBank(object):
+    # Attributes holding one entry per sensor, in row order.  The sensors are the first axis
+    # except for the _COLUMN_ARRAYS, where they are the last.
+    _ROW_ARRAYS = ('_normal_value', '_perunit_confidence_band_95pct', '_stddev', '_interval', '_perunit_dropping',
+                   '_range_output', '_deadband', '_max_silence', '_variance_output', '_percentile_output', '_n',
+                   '_tstart', '_average', '_min', '_max', '_count', '_mean', '_m2', '_sketch_heights',
+                   '_sketch_positions',
+                   '_initialized', '_keys', '_last_sent', '_last_sent_t', '_sent', '_suppressed')
+    # The quantile sketches, stored marker major so every marker of every sketch is contiguous.
+    _COLUMN_ARRAYS = ('_sketch_heights', '_sketch_positions')
+
+    def __init__(self, normal_value, aggregation_interval, perunit_drop_rate, perunit_confidence_band,
+                 random_seed=0, keys=None, range_output=False, deadband=0, perunit_deadband=0,
+                 max_silence_interval=0, variance_output=False, percentile_output=False):
+        """
+        A struct-of-arrays container holding the state of many sensors.
+
+        Each row of the bank models the same quantities as a `Sensor` object, a magnitude
+        channel with the sensor's normal value and an angle channel with a normal value of
+        180, and produces the same statistics.  All of the sensors are updated at once
+        with one timestep's worth of values, the sensors whose interval closes are found
+        from a `TimingWheel` of their deadlines so only they are finalized and reported.
+
+        Every parameter may either be a scalar or an array with one entry per sensor.
+
+        :param normal_value: Nominal value of the quantity which the sensors are measuring.
+        :param aggregation_interval: Interval (seconds) for which measurements are collected
+            before aggregation is performed.
+        :param perunit_drop_rate: Number on interval [0, 1), indicating the chance
+            measurements will be dropped.
+        :param perunit_confidence_band: with a 95 % confidence interval, we are 95 % certain
+            that the true value lies within an interval this wide, centered on the measured value.
+        :param random_seed: Seed for the noise, drop and stagger draws.
+        :param keys: Optional array of 64 bit keys (see `streams.mrid_keys`) identifying each
+            sensor's random stream.  Defaults to the row index.
+        :param range_output: True for the sensors that report the minimum and maximum of each
+            interval along with the mean (see `Sensor.take_range_sample`).
+        :param deadband: Absolute magnitude change a value must exceed to be published.
+        :param perunit_deadband: Change a value must exceed to be published, per unit of the
+            normal value of each channel.  The larger of the two bands applies to the magnitude.
+        :param max_silence_interval: Seconds after which a value is published even when it is
+            inside the deadband, 0 never forces a value.
+        :param variance_output: True for the sensors that report the variance of the values
+            received during each interval.
+        :param percentile_output: True for the sensors that report the estimated 5th and 95th
+            percentiles of the values received during each interval.
+        """
+        normal_value = np.atleast_1d(np.asarray(normal_value, dtype=np.float64))
+        size = np.broadcast(normal_value, np.atleast_1d(aggregation_interval),
+                            np.atleast_1d(perunit_drop_rate), np.atleast_1d(perunit_confidence_band),
+                            np.atleast_1d(0 if keys is None else keys), np.atleast_1d(range_output),
+                            np.atleast_1d(deadband), np.atleast_1d(perunit_deadband),
+                            np.atleast_1d(max_silence_interval), np.atleast_1d(variance_output),
+                            np.atleast_1d(percentile_output)).size
+
+        self._normal_value = np.empty((size, 2), dtype=np.float64)
+        self._normal_value[:, MAGNITUDE] = normal_value
+        self._normal_value[:, ANGLE] = ANGLE_NORMAL_VALUE
+        self._perunit_confidence_band_95pct = np.broadcast_to(
+            np.asarray(perunit_confidence_band, dtype=np.float64), (size,)).copy()
+        # 3.92 = 1.96 * 2.0
+        self._stddev = self._normal_value * self._perunit_confidence_band_95pct[:, np.newaxis] / 3.92
+        self._interval = np.broadcast_to(np.asarray(aggregation_interval, dtype=np.float64), (size,)).copy()
+        self._perunit_dropping = np.broadcast_to(np.asarray(perunit_drop_rate, dtype=np.float64), (size,)).copy()
+        self._range_output = np.broadcast_to(np.asarray(range_output, dtype=bool), (size,)).copy()
+        # Report by exception, a channel with a zero band is not compared and a sensor with
+        # a zero magnitude band publishes every value.
+        self._deadband = self._normal_value * np.asarray(perunit_deadband, dtype=np.float64).reshape(-1, 1)
+        self._deadband[:, MAGNITUDE] = np.maximum(self._deadband[:, MAGNITUDE], deadband)
+        self._max_silence = np.broadcast_to(np.asarray(max_silence_interval, dtype=np.float64), (size,)).copy()
+        self._variance_output = np.broadcast_to(np.asarray(variance_output, dtype=bool), (size,)).copy()
+        self._percentile_output = np.broadcast_to(np.asarray(percentile_output, dtype=bool), (size,)).copy()
+
+        # Set default - Uninitialized values for internal properties.
+        self._n = np.zeros(size, dtype=np.int64)
+        self._tstart = np.zeros(size, dtype=np.float64)
+        self._average = np.zeros((size, 2), dtype=np.float64)
+        self._min = np.zeros((size, 2), dtype=np.float64)
+        self._max = np.zeros((size, 2), dtype=np.float64)
+        # The values received during the interval, the count, Welford mean and sum of squared
+        # differences from the mean and the P-square percentile sketch of each channel, all
+        # constant size however long the interval.  Unlike the average they start empty, the
+        # mean carried over from the previous interval is not a value the sensor received.
+        self._count = np.zeros(size, dtype=np.int64)
+        self._mean = np.zeros((size, 2), dtype=np.float64)
+        self._m2 = np.zeros((size, 2), dtype=np.float64)
+        self._sketch_heights = np.zeros((quantiles.MARKERS, 2, size), dtype=np.float64)
+        self._sketch_positions = np.zeros((quantiles.MARKERS, 2, size), dtype=np.float64)
+        self._initialized = np.zeros(size, dtype=bool)
+        self._last_sent = np.full((size, 2), np.nan)
+        self._last_sent_t = np.zeros(size, dtype=np.float64)
+        self._sent = np.zeros(size, dtype=np.int64)
+        self._suppressed = np.zeros(size, dtype=np.int64)
+
+        self._streams = RandomStreams(random_seed)
+        if keys is None:
+            keys = np.arange(size, dtype=np.uint64)
+        self._keys = np.broadcast_to(np.asarray(keys, dtype=np.uint64), (size,)).copy()
+        # Rows of the initialized sensors by the time their interval closes, built when first needed.
+        self._wheel = None
+
+    def __len__(self):
+        return len(self._n)
+
+    def __repr__(self):
+        return f"<SensorBank(sensors={len(self)})>"
+
+    @property
+    def random_seed(self):
+        return self._streams.seed
+
+    @property
+    def normal_value(self):
+        return self._normal_value[:, MAGNITUDE]
+
+    @property
+    def perunit_dropping(self):
+        return self._perunit_dropping
+
+    @property
+    def stddev(self):
+        return self._stddev[:, MAGNITUDE]
+
+    @property
+    def interval(self):
+        return self._interval
+
+    @property
+    def range_output(self):
+        return self._range_output
+
+    @property
+    def variance_output(self):
+        return self._variance_output
+
+    @property
+    def percentile_output(self):
+        return self._percentile_output
+
+    @property
+    def sent(self):
+        """
+        Number of values each sensor has published.
+        """
+        return self._sent
+
+    @property
+    def suppressed(self):
+        """
+        Number of values each sensor has suppressed because they were inside its deadband.
+        """
+        return self._suppressed
+
+    @property
+    def tstart(self):
+        return self._tstart
+
+    @property
+    def keys(self):
+        return self._keys
+
+    def subset(self, rows):
+        """
+        Return a new bank holding a copy of the configuration and state of the sensors at rows.
+
+        The sensors keep their random stream keys so they produce the same values in the
+        new bank as they would have in this one.
+        """
+        bank = object.__new__(type(self))
+        bank.__dict__.update(vars(self))
+        bank._wheel = None
+        for name in self._ROW_ARRAYS:
+            index = (Ellipsis, rows) if name in self._COLUMN_ARRAYS else rows
+            setattr(bank, name, getattr(self, name)[index].copy())
+        return bank
+
+    def extend(self, normal_value, aggregation_interval, perunit_drop_rate, perunit_confidence_band, **kwargs):
+        """
+        Append new, uninitialized sensors to the end of the bank.  The parameters are the
+        same as for the constructor, the random seed is always the bank's.
+        """
+        other = type(self)(normal_value, aggregation_interval, perunit_drop_rate, perunit_confidence_band,
+                           random_seed=self._streams.seed, **kwargs)
+        for name in self._ROW_ARRAYS:
+            axis = -1 if name in self._COLUMN_ARRAYS else 0
+            setattr(self, name, np.concatenate((getattr(self, name), getattr(other, name)), axis=axis))
+
+    def state(self):
+        """
+        Return the configuration and aggregation state of every sensor as a dictionary of
+        arrays, which `from_state` turns back into an identical bank.
+        """
+        return {name.lstrip('_'): getattr(self, name) for name in self._ROW_ARRAYS}
+
+    @classmethod
+    def from_state(cls, state, random_seed=0):
+        """
+        Create a bank from the arrays returned by `state`.  The arrays are used as is, so
+        copy on write memory maps of a checkpoint are only read from disk as they are used.
+
+        :param state: Dictionary of arrays from `state`.
+        :param random_seed: The seed of the bank the state was taken from.
+        """
+        bank = cls(normal_value=[], aggregation_interval=[], perunit_drop_rate=[], perunit_confidence_band=[],
+                   random_seed=random_seed, keys=[])
+        for name in cls._ROW_ARRAYS:
+            setattr(bank, name, state[name.lstrip('_')])
+        return bank
+
+    def describe(self, index):
+        """
+        Return the same description `str(Sensor)` gives for the sensor at index.
+        """
+        return "nominal: {}, stddev: {}, pu dropped: {}, agg interval: {}".format(
+            self._normal_value[index, MAGNITUDE], self._stddev[index, MAGNITUDE],
+            self._perunit_dropping[index], self._interval[index])
+
+    def initialize(self, t, values, rows):
+        """
+        Start the first aggregation interval of the sensors at rows.
+
+        Each sensor with a positive interval gets a staggered start so that the
+        sensors do not all report on the same timestep.
+
+        :param t: Timestamp of the first sample.
+        :param values: (n, 2) array of magnitude and angle values for the rows.
+        :param rows: Integer indexes of the sensors to initialize.
+        """
+        interval = self._interval[rows]
+        offset = np.zeros(len(rows), dtype=np.float64)
+        staggered = interval > 0.0
+        if staggered.any():
+            # each sensor needs a staggered start
+            offset[staggered] = self._streams.integers(STAGGER, self._keys[rows[staggered]], 0,
+                                                       np.floor(interval[staggered]))
+        self.reset_interval(t - offset, values, rows)
+        self._initialized[rows] = True
+
+    def reset_interval(self, t, values, rows):
+        self._n[rows] = 1
+        self._tstart[rows] = t
+        self._average[rows] = values
+        self._min[rows] = values
+        self._max[rows] = values
+        self._count[rows] = 0
+        self._mean[rows] = 0.0
+        self._m2[rows] = 0.0
+        if self._wheel is not None:
+            self._wheel.schedule(rows, self._tstart[rows] + self._interval[rows])
+
+    def add_samples(self, t, values, rows):
+        """
+        Add one sample to each sensor in rows, initializing sensors seen for the first time.
+
+        :param values: (n, 2) array of magnitude and angle values for the rows.
+        :param rows: Sorted integer indexes of the sensors.
+        """
+        new = ~self._initialized[rows]
+        if new.any():
+            self.initialize(t, values[new], rows[new])
+        inside = t - self._tstart[rows] <= self._interval[rows]
+        if len(rows) == len(self) and inside.all():
+            # Every sensor has a sample inside its interval, update the arrays in place.
+            np.minimum(self._min, values, out=self._min)
+            np.maximum(self._max, values, out=self._max)
+            self.add_statistics(values, rows)
+            self._average += values
+            self._n += 1
+            return
+        rows = rows[inside]
+        values = values[inside]
+        self._min[rows] = np.minimum(self._min[rows], values)
+        self._max[rows] = np.maximum(self._max[rows], values)
+        self.add_statistics(values, rows)
+        self._average[rows] += values
+        self._n[rows] += 1
+
+    def add_statistics(self, values, rows):
+        """
+        Count one sample of each sensor in rows and add it to the variance and percentile
+        accumulators of the sensors that report them.
+        """
+        self._count[slice(None) if len(rows) == len(self) else rows] += 1
+        variance = self._variance_output[rows]
+        if variance.any():
+            # Welford's update from the running mean before and after the sample.
+            target, x = self._selection(rows, variance, values)
+            delta = x - self._mean[target]
+            self._mean[target] += delta / self._count[target][:, np.newaxis]
+            self._m2[target] += delta * (x - self._mean[target])
+
+        percentile = self._percentile_output[rows]
+        if percentile.any():
+            # Both channels are updated at once, the magnitude sketches of all the sensors first.
+            target, x = self._selection(rows, percentile, values)
+            heights = self._sketch_heights[..., target].reshape(quantiles.MARKERS, -1)
+            positions = self._sketch_positions[..., target].reshape(quantiles.MARKERS, -1)
+            quantiles.insert(heights, positions, x.T.reshape(-1), np.tile(self._count[target], 2))
+            if not np.shares_memory(heights, self._sketch_heights):
+                self._sketch_heights[..., target] = heights.reshape(quantiles.MARKERS, 2, -1)
+                self._sketch_positions[..., target] = positions.reshape(quantiles.MARKERS, 2, -1)
+
+    def _selection(self, rows, mask, values):
+        """
+        Return the index and values of the rows selected by mask.  The index is a slice when
+        every sensor is selected, so the accumulators are updated in place instead of being
+        gathered and scattered.
+        """
+        if len(rows) == len(self) and mask.all():
+            return slice(None), values
+        return rows[mask], values[mask]
+
+    def take_variance(self, rows):
+        """
+        Return the (n, 2) sample variances of the values received during the current
+        interval of the sensors at rows, NaN for the sensors that received none.
+        """
+        count = self._count[rows]
+        variance = self._m2[rows] / np.maximum(count - 1, 1)[:, np.newaxis]
+        variance[count == 0] = np.nan
+        return variance
+
+    def take_percentiles(self, rows):
+        """
+        Return the estimated percentiles of the values received during the current interval
+        of the sensors at rows, NaN for the sensors that received none.
+
+        :return: (n, 2, 2) array of the 5th and 95th percentiles indexed by row and channel.
+        """
+        count = self._count[rows]
+        estimate = quantiles.estimate(self._sketch_heights[..., rows].reshape(quantiles.MARKERS, -1),
+                                      self._sketch_positions[..., rows].reshape(quantiles.MARKERS, -1),
+                                      np.tile(count, 2))
+        percentiles = estimate.reshape(len(quantiles.PERCENTILES), 2, len(rows)).transpose(2, 1, 0)
+        percentiles[count == 0] = np.nan
+        return percentiles
+
+    def ready_to_sample(self, t, rows):
+        """
+        Return the subset of rows whose aggregation interval has closed at time t.
+        """
+        return rows[t >= self._tstart[rows] + self._interval[rows]]
+
+    def take_due(self, t, present=None):
+        """
+        Return the rows whose aggregation interval has closed at time t, the same rows
+        `ready_to_sample` finds, from the timing wheel of interval deadlines.  Only the
+        sensors in the wheel's due slots are looked at.
+
+        The rows returned must have their interval reset, the wheel only holds them again
+        once it is.
+
+        :param present: Optional boolean mask of the sensors that have a value this timestep,
+            due sensors without a value stay due.
+        """
+        if self._wheel is None:
+            self._wheel = TimingWheel()
+            rows = np.flatnonzero(self._initialized)
+            self._wheel.schedule(rows, self._tstart[rows] + self._interval[rows])
+        candidates = self._wheel.pop_due(t)
+        deadline = self._tstart[candidates] + self._interval[candidates]
+        due = t >= deadline
+        if present is not None:
+            due &= np.asarray(present, dtype=bool)[candidates]
+        self._wheel.schedule(candidates[~due], deadline[~due])
+        return candidates[due]
+
+    def take_inst_samples(self, t, rows):
+        """
+        Finalize the interval of each sensor in rows.
+
+        :return: tuple of the (n, 2) noisy values and a boolean mask of the rows that
+            were dropped.
+        """
+        mean_val = self._average[rows] / np.maximum(self._n[rows], 1)[:, np.newaxis]
+        keys = self._keys[rows]
+        drop_rate = self._perunit_dropping[rows]
+        dropped = (drop_rate > 0.0) & (self._streams.uniform(DROP, keys, t) <= drop_rate)
+        noisy = mean_val + self._noise(t, keys, 0) * self._stddev[rows]
+        self.reset_interval(t, mean_val, rows)
+        return noisy, dropped
+
+    def take_range_samples(self, t, rows):
+        """
+        Finalize the interval of each sensor in rows, reporting its minimum and maximum
+        as well as its mean.
+
+        :return: tuple of the (n, 2) noisy means, minimums and maximums and a boolean mask
+            of the rows that were dropped.
+        """
+        keys = self._keys[rows]
+        stddev = self._stddev[rows]
+        minimum = self._min[rows] + self._noise(t, keys, 1) * stddev
+        maximum = self._max[rows] + self._noise(t, keys, 2) * stddev
+        noisy, dropped = self.take_inst_samples(t, rows)
+        return noisy, minimum, maximum, dropped
+
+    def _noise(self, t, keys, statistic):
+        # Noise index layout shared with Sensor: channel + 2 * statistic (mean, min, max).
+        return np.stack([self._streams.normal(NOISE, keys, t, channel + 2 * statistic)
+                         for channel in (MAGNITUDE, ANGLE)], axis=-1)
+
+    def apply_deadband(self, t, values, rows):
+        """
+        Decide which of the sensors at rows publish their values at time t.
+
+        A value is suppressed when every channel with a band is within the band of the last
+        value the sensor published, unless its maximum silence interval has passed.
+
+        :param values: (n, 2) array of the values about to be published.
+        :return: Boolean mask of the rows that are suppressed.
+        """
+        band = self._deadband[rows]
+        with np.errstate(invalid='ignore'):
+            inside = (np.abs(values - self._last_sent[rows]) <= band) | np.isnan(values) | (band == 0.0)
+        silence = self._max_silence[rows]
+        due = (silence > 0.0) & (t - self._last_sent_t[rows] >= silence)
+        suppress = inside.all(axis=1) & (band[:, MAGNITUDE] > 0.0) & ~due
+
+        sent = rows[~suppress]
+        self._last_sent[sent] = values[~suppress]
+        self._last_sent_t[sent] = t
+        self._sent[sent] += 1
+        self._suppressed[rows[suppress]] += 1
+        return suppress
+
+    def update(self, t, magnitude, angle=None, present=None):
+        """
+        Feed one timestep of values to every sensor in the bank.
+
+        :param t: Timestamp of the values.
+        :param magnitude: Array of magnitudes, one per sensor.
+        :param angle: Optional array of angles, one per sensor.
+        :param present: Optional boolean mask of the sensors that have a value this timestep.
+        :return: A `BankSample`.
+        """
+        size = len(self)
+        if present is None:
+            rows = np.arange(size)
+        else:
+            rows = np.flatnonzero(present)
+
+        values = np.empty((len(rows), 2), dtype=np.float64)
+        values[:, MAGNITUDE] = np.asarray(magnitude, dtype=np.float64)[rows]
+        values[:, ANGLE] = np.nan if angle is None else np.asarray(angle, dtype=np.float64)[rows]
+
+        self.add_samples(t, values, rows)
+        due = self.take_due(t, present)
+
+        count = len(due)
+        emit = np.zeros(count, dtype=bool)
+        dropped = np.zeros(count, dtype=bool)
+        suppressed = np.zeros(count, dtype=bool)
+        out = np.full((count, 2), np.nan)
+        out_min = np.full((count, 2), np.nan)
+        out_max = np.full((count, 2), np.nan)
+        out_variance = np.full((count, 2), np.nan)
+        out_percentiles = np.full((count, 2, len(quantiles.PERCENTILES)), np.nan)
+        if count:
+            # The statistics are taken before the intervals are closed.
+            measured = self._variance_output[due]
+            if measured.any():
+                out_variance[measured] = self.take_variance(due[measured])
+            measured = self._percentile_output[due]
+            if measured.any():
+                out_percentiles[measured] = self.take_percentiles(due[measured])
+            ranged = self._range_output[due]
+            inst = ~ranged
+            if inst.any():
+                out[inst], dropped[inst] = self.take_inst_samples(t, due[inst])
+            if ranged.any():
+                out[ranged], out_min[ranged], out_max[ranged], dropped[ranged] = \
+                    self.take_range_samples(t, due[ranged])
+
+            published = np.flatnonzero(~dropped)
+            suppress = published[self.apply_deadband(t, out[published], due[published])]
+            emit[published] = True
+            emit[suppress] = False
+            suppressed[suppress] = True
+
+        return BankSample(due, emit, dropped, out[:, MAGNITUDE], out[:, ANGLE], out_min[:, MAGNITUDE],
+                          out_max[:, MAGNITUDE], out_min[:, ANGLE], out_max[:, ANGLE], suppressed,
+                          out_variance[:, MAGNITUDE], out_variance[:, ANGLE], out_percentiles[:, MAGNITUDE, 0],
+                          out_percentiles[:, MAGNITUDE, 1], out_percentiles[:, ANGLE, 0],
+                          out_percentiles[:, ANGLE, 1])
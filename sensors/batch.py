@@ -0,0 +1,403 @@
+from collections import namedtuple
+import json
+import logging
+import os
+import time
+
+import numpy as np
+
+from .analysis import read_csv_chunks
+from .bank import MAGNITUDE
+from .streams import RandomStreams, STAGGER, DROP, NOISE, mrid_keys
+
+_log = logging.getLogger(__file__)
+
+DEFAULT_BATCH_CONFIG = {
+    'normal-value': 100.0,
+    'perunit-confidence-band': 0.01,
+    'perunit-drop-rate': 0.01,
+    'aggregation-interval': 30.0
+}
+
+# Windows of the running mean solved at once, small enough that the product of the window
+# weights stays far from underflow.
+_SCAN_BLOCK = 16
+# Values of the temporary array an output statistic is filled through, and the rows of it
+# transposed at once.
+_FILL_BLOCK = 1 << 22
+_FILL_TILE = 512
+
+BatchStats = namedtuple('BatchStats', ['rows', 'written', 'seconds'])
+
+
+class ColumnSensors(object):
+    def __init__(self, names, normal_value=100.0, perunit_confidence_band=0.01, perunit_drop_rate=0.01,
+                 aggregation_interval=30.0, random_seed=0):
+        """
+        Range sensors, one for each column of a table with a row per timestep, updated a block
+        of rows at a time.
+
+        Each column produces exactly the output of a `SensorBank` row with range output fed
+        the column one row at a time: an interval closes on the first row at or after its
+        deadline, only reaching the deadline exactly adds that row, and the next interval
+        starts with the mean of the one that closed.  Instead of stepping through the rows,
+        the closing rows of every distinct interval start are found together, the samples of
+        each interval are reduced with ufunc.reduceat and the running means are solved a
+        block of intervals at a time.  The noise and drops are drawn from the same counter
+        based streams, keyed by the column names, and only for the reports: the drops first,
+        then the noise of the reports that are kept.
+
+        2000 columns of 20000 rows take about 5 s, roughly 60 MB/s of input.  What remains is
+        the four Philox draws each report needs to match `SensorBank` exactly and filling the
+        output, which holds three statistics for every input value.
+
+        Every parameter may be a scalar or a sequence with one entry per column.
+
+        :param names: Name of each column.
+        """
+        size = len(names)
+        self._names = list(names)
+        self._keys = mrid_keys(self._names)
+        self._normal_value = np.broadcast_to(np.asarray(normal_value, dtype=np.float64), (size,)).copy()
+        band = np.broadcast_to(np.asarray(perunit_confidence_band, dtype=np.float64), (size,))
+        # 3.92 = 1.96 * 2.0
+        self._stddev = self._normal_value * band / 3.92
+        self._drop_rate = np.broadcast_to(np.asarray(perunit_drop_rate, dtype=np.float64), (size,)).copy()
+        self._interval = np.broadcast_to(np.asarray(aggregation_interval, dtype=np.float64), (size,)).copy()
+        self._streams = RandomStreams(random_seed)
+
+        self._initialized = False
+        self._tstart = np.zeros(size)
+        self._n = np.zeros(size)
+        self._total = np.zeros(size)
+        self._min = np.zeros(size)
+        self._max = np.zeros(size)
+        # The latest output of each column, repeated on the rows where only other columns report.
+        self._last = np.zeros((3, size))
+
+    def __len__(self):
+        return len(self._names)
+
+    @property
+    def names(self):
+        return self._names
+
+    def process(self, t, values):
+        """
+        Add a block of rows.
+
+        :param t: (rows,) increasing timestamps.
+        :param values: (rows, columns) array of the samples.
+        :return: (output rows, 1 + 3 * columns) array with a row for each row where at least one
+            interval closed: its timestamp followed by the noisy mean, minimum and maximum of each
+            column.  A column whose interval did not close on a row repeats its previous output, a
+            dropped value is 0, as the original CSV test mode wrote it.
+        """
+        t = np.asarray(t, dtype=np.float64)
+        values = np.asarray(values, dtype=np.float64)
+        rows = len(t)
+        if rows == 0:
+            return np.zeros((0, 1 + 3 * len(self)))
+        if not self._initialized:
+            offset = np.zeros(len(self))
+            staggered = self._interval > 0.0
+            if staggered.any():
+                # each sensor needs a staggered start
+                offset[staggered] = self._streams.integers(STAGGER, self._keys[staggered], 0,
+                                                           np.floor(self._interval[staggered]))
+            self._tstart = t[0] - offset
+            self._n[:] = 1.0
+            self._total[:] = values[0]
+            self._min[:] = values[0]
+            self._max[:] = values[0]
+            self._initialized = True
+
+        # The columns with the same interval and start close on the same rows.
+        starts, group = np.unique(np.stack((self._tstart, self._interval)), axis=1, return_inverse=True)
+        group = group.reshape(-1)
+        closes = self._close_rows(t, starts[0], starts[1])
+        close_rows = closes[:, group]
+        valid = close_rows < rows
+        deadline = np.concatenate(((self._tstart + self._interval)[np.newaxis],
+                                   t[np.minimum(close_rows[:-1], rows - 1)] + self._interval))[:len(close_rows)]
+        clipped = np.minimum(close_rows, rows - 1)
+        included = valid & (t[clipped] == deadline)
+
+        # Samples of each interval, from the row after the previous close to the closing row
+        # when it is on the deadline, and the trailing rows of the interval still open.  Like
+        # the bank, the first row is added again on top of starting the first interval.
+        windows = len(close_rows)
+        first = np.empty((windows + 1, len(self)), dtype=np.int64)
+        first[0] = 0
+        first[1:] = np.where(valid, close_rows + 1, rows)
+        last = np.empty((windows + 1, len(self)), dtype=np.int64)
+        last[:-1] = np.where(valid, np.where(included, close_rows, close_rows - 1), rows - 1)
+        last[-1] = rows - 1
+        # After the last close every row belongs to the open interval.
+        closed = valid.sum(axis=0)
+        first[closed, np.arange(len(self))] = np.where(closed > 0, first[closed, np.arange(len(self))], 0)
+        last[closed, np.arange(len(self))] = rows - 1
+        counts, sums, minimums, maximums = _segments(values, first, last, group, len(starts[0]))
+
+        # The mean of interval k is (m[k - 1] + sum[k]) / (1 + count[k]), the first interval
+        # continues from the state left by the previous block.
+        weight = np.where(valid, 1.0, 0.0)
+        weight[:1] = np.where(valid[:1], self._n, 0.0)
+        means = np.empty((windows, len(self)))
+        mean = self._total.copy()
+        for block in range(0, windows, _SCAN_BLOCK):
+            part = slice(block, min(block + _SCAN_BLOCK, windows))
+            a = np.divide(1.0, weight[part] + counts[part], out=np.ones(weight[part].shape), where=valid[part])
+            b = np.where(valid[part], sums[part] * a, 0.0)
+            product = np.cumprod(a, axis=0)
+            means[part] = product * (mean + np.cumsum(b / product, axis=0))
+            mean = means[part][-1]
+        previous_min = np.concatenate((self._min[np.newaxis], means[:-1]))[:windows]
+        previous_max = np.concatenate((self._max[np.newaxis], means[:-1]))[:windows]
+        low = np.minimum(previous_min, minimums[:windows])
+        high = np.maximum(previous_max, maximums[:windows])
+
+        # The state of the interval still open at the end of the block.
+        columns = np.arange(len(self))
+        reset = closed > 0
+        if windows:
+            final = means[np.maximum(closed - 1, 0), columns]
+            self._tstart = np.where(reset, t[clipped[np.maximum(closed - 1, 0), columns]], self._tstart)
+        else:
+            final = self._total
+        self._n = np.where(reset, 1.0, self._n) + counts[closed, columns]
+        self._total = np.where(reset, final, self._total) + sums[closed, columns]
+        self._min = np.minimum(np.where(reset, final, self._min), minimums[closed, columns])
+        self._max = np.maximum(np.where(reset, final, self._max), maximums[closed, columns])
+
+        # The reports ordered by column and then by row, the order np.repeat fills a column in.
+        column, window = np.nonzero(valid.T)
+        close = close_rows[window, column]
+        reporting = np.zeros(rows, dtype=bool)
+        reporting[close] = True
+        output_rows = np.flatnonzero(reporting)
+        table = np.empty((len(output_rows), 1 + 3 * len(self)))
+        table[:, 0] = t[output_rows]
+        if not len(output_rows):
+            return table
+
+        # Only the reports that are published draw their noise, a dropped value is written as 0.
+        close_t = t[close]
+        reported = np.zeros((3, len(close)))
+        rate = self._drop_rate[column]
+        kept = np.flatnonzero(~((rate > 0.0) & (self._streams.uniform(DROP, self._keys[column], close_t) <= rate)))
+        for statistic, value in enumerate((means, low, high)):
+            reported[statistic, kept] = value[window[kept], column[kept]]
+        noisy = kept[self._stddev[column[kept]] > 0.0]
+        if len(noisy):
+            keys = self._keys[column[noisy]]
+            stddev = self._stddev[column[noisy]]
+            for statistic in range(3):
+                reported[statistic, noisy] += self._streams.normal(NOISE, keys, close_t[noisy],
+                                                                   MAGNITUDE + 2 * statistic) * stddev
+        self._fill(table, (np.cumsum(reporting) - 1)[close], column, reported)
+        return table
+
+    def _fill(self, table, position, column, reported):
+        """
+        Write the reports into the output rows of table, each column holding its latest report
+        until the next one and its previous output before its first.
+
+        :param position: Output row of each report, ordered by column and then by row.
+        :param column: Column of each report.
+        :param reported: (3, reports) array of the reported mean, minimum and maximum.
+        """
+        rows = len(table)
+        size = len(self)
+        # Each column is a run of its previous output followed by a run of each report.
+        counts = np.bincount(column, minlength=size)
+        first = np.cumsum(counts) - counts
+        lead = first + np.arange(size)
+        slot = np.arange(len(column)) + column + 1
+        lengths = np.empty(len(column) + size, dtype=np.int64)
+        following = np.append(position[1:], rows)
+        following[(first + counts - 1)[counts > 0]] = rows
+        lengths[slot] = following - position
+        lengths[lead] = np.where(counts > 0, position[np.minimum(first, len(position) - 1)], rows)
+
+        output = table[:, 1:].reshape(rows, size, 3)
+        runs = np.empty(len(lengths))
+        block = max(1, _FILL_BLOCK // rows)
+        for statistic in range(3):
+            runs[slot] = reported[statistic]
+            runs[lead] = self._last[statistic]
+            # A few columns at a time bounds the temporary array, which is transposed into
+            # the output in tiles of rows to stay in cache.
+            for lo in range(0, size, block):
+                hi = min(lo + block, size)
+                part = slice(lead[lo], lead[hi] if hi < size else len(runs))
+                filled = np.repeat(runs[part], lengths[part]).reshape(hi - lo, rows)
+                for tile in range(0, rows, _FILL_TILE):
+                    output[tile:tile + _FILL_TILE, lo:hi, statistic] = filled[:, tile:tile + _FILL_TILE].T
+        self._last = output[-1].T.copy()
+
+    @staticmethod
+    def _close_rows(t, tstart, interval):
+        """
+        Return the (windows, groups) rows on which the intervals of each group close, padded
+        with len(t).
+        """
+        rows = len(t)
+        current = np.searchsorted(t, tstart + interval, 'left')
+        # The first row at or after each row's deadline, never the row itself, for each interval.
+        intervals, kind = np.unique(interval, return_inverse=True)
+        following = np.maximum(np.searchsorted(t, t + intervals[:, np.newaxis], 'left'), np.arange(1, rows + 1))
+        if (following == np.arange(1, rows + 1)).all():
+            # Intervals no longer than the timestep close on every row.
+            windows = rows - current.min() if len(current) else 0
+            return np.minimum(current + np.arange(max(windows, 0))[:, np.newaxis], rows)
+        closes = []
+        while (current < rows).any():
+            closes.append(current)
+            current = np.where(current < rows, following[kind, np.minimum(current, rows - 1)], rows)
+        if not closes:
+            return np.full((0, len(tstart)), rows, dtype=np.int64)
+        return np.stack(closes)
+
+
+def _segments(values, first, last, group, groups):
+    """
+    Reduce the inclusive row ranges [first, last] of each column, an empty range when first
+    is after last.  The columns of a group share their ranges.
+
+    :return: tuple of the count, sum, minimum and maximum of every range.
+    """
+    counts = np.maximum(last - first + 1, 0).astype(np.float64)
+    sums = np.zeros(first.shape)
+    minimums = np.full(first.shape, np.inf)
+    maximums = np.full(first.shape, -np.inf)
+    rows = len(values)
+    # The columns transposed into rows, grouped, so each group is a contiguous block that
+    # reduceat runs through along its rows.  Transposing in tiles of rows stays in cache.
+    order = np.argsort(group, kind='stable')
+    edges = np.searchsorted(group[order], np.arange(groups + 1))
+    transposed = np.empty((len(order), rows))
+    for tile in range(0, rows, _FILL_TILE):
+        transposed[:, tile:tile + _FILL_TILE] = np.take(values[tile:tile + _FILL_TILE], order, axis=1).T
+    for index in range(groups):
+        columns = order[edges[index]:edges[index + 1]]
+        column = columns[0]
+        ranges = np.flatnonzero(counts[:, column] > 0)
+        if not len(ranges):
+            continue
+        bounds = np.empty(2 * len(ranges), dtype=np.int64)
+        bounds[0::2] = first[ranges, column]
+        bounds[1::2] = last[ranges, column] + 1
+        if bounds[-1] >= rows:
+            bounds = bounds[:-1]
+        block = transposed[edges[index]:edges[index + 1]]
+        target = np.ix_(ranges, columns)
+        sums[target] = np.add.reduceat(block, bounds, axis=1)[:, 0::2].T
+        minimums[target] = np.minimum.reduceat(block, bounds, axis=1)[:, 0::2].T
+        maximums[target] = np.maximum.reduceat(block, bounds, axis=1)[:, 0::2].T
+    return counts, sums, minimums, maximums
+
+
+def read_table(path, chunk_rows=100000):
+    """
+    Read a table with the time in the first column and a signal in each other column.
+
+    A CSV file has a header row of column names, "# t[s],v,i" as numpy.savetxt writes it is
+    accepted.  A .npy file is memory mapped and its names are read from <path>.json, a list
+    of the names of every column.
+
+    :return: tuple of the signal names and a generator of (rows, columns) arrays.
+    """
+    if str(path).endswith('.npy'):
+        data = np.load(path, mmap_mode='r', allow_pickle=False)
+        try:
+            with open(f"{path}.json") as fp:
+                names = json.load(fp)[1:]
+        except FileNotFoundError:
+            names = [f"c{index}" for index in range(1, data.shape[1])]
+        return names, (data[index:index + chunk_rows] for index in range(0, len(data), chunk_rows))
+    with open(path) as fp:
+        header = fp.readline().lstrip('#').strip()
+    names = [name.strip() for name in header.split(',')][1:]
+    return names, read_csv_chunks(path, skiprows=1, chunk_rows=chunk_rows)
+
+
+class TableWriter(object):
+    def __init__(self, path, names):
+        """
+        Write the output of `ColumnSensors`, t and then the mean, minimum and maximum of each
+        signal.  A .npy file is written through a temporary raw file and gets a <path>.json of
+        its column names, anything else is a CSV file with a header row.
+        """
+        self._path = str(path)
+        self._columns = ['t'] + [f"{name}_{statistic}" for name in names for statistic in ('avg', 'min', 'max')]
+        self._binary = self._path.endswith('.npy')
+        self._rows = 0
+        if self._binary:
+            self._fp = open(f"{self._path}.tmp", 'wb')
+        else:
+            self._fp = open(self._path, 'w')
+            self._fp.write(','.join(self._columns) + '\n')
+
+    @property
+    def rows(self):
+        return self._rows
+
+    def write(self, table):
+        """
+        Append the rows returned by `ColumnSensors.process`.
+        """
+        if self._binary:
+            self._fp.write(np.ascontiguousarray(table).tobytes())
+        else:
+            np.savetxt(self._fp, table, fmt='%.3f', delimiter=',')
+        self._rows += len(table)
+
+    def close(self):
+        self._fp.close()
+        if not self._binary:
+            return
+        raw = np.memmap(f"{self._path}.tmp", dtype=np.float64, mode='r', shape=(self._rows, len(self._columns))) \
+            if self._rows else np.zeros((0, len(self._columns)))
+        target = np.lib.format.open_memmap(self._path, mode='w+', dtype=np.float64, shape=raw.shape)
+        target[:] = raw
+        target.flush()
+        del raw, target
+        os.remove(f"{self._path}.tmp")
+        with open(f"{self._path}.json", 'w') as fp:
+            json.dump(self._columns, fp)
+
+
+def run_batch(source, target, config: dict = None, random_seed=0, chunk_rows=100000):
+    """
+    Run every signal of a table through its own range sensor, see `ColumnSensors`.
+
+    The config dictionary has the following structure, each value may also be a list with
+    one entry per signal:
+        {
+            "normal-value": 100.0,
+            "perunit-confidence-band": 0.01,
+            "perunit-drop-rate": 0.01,
+            "aggregation-interval": 30.0
+        }
+
+    :param source: Input table, see `read_table`.
+    :param target: Output table, see `TableWriter`.
+    :param chunk_rows: Rows processed at once.
+    :return: A `BatchStats`.
+    """
+    settings = dict(DEFAULT_BATCH_CONFIG)
+    settings.update(config or {})
+    names, chunks = read_table(source, chunk_rows)
+    sensors = ColumnSensors(names, settings['normal-value'], settings['perunit-confidence-band'],
+                            settings['perunit-drop-rate'], settings['aggregation-interval'], random_seed)
+    writer = TableWriter(target, names)
+    count = 0
+    start = time.perf_counter()
+    try:
+        for chunk in chunks:
+            writer.write(sensors.process(chunk[:, 0], chunk[:, 1:]))
+            count += len(chunk)
+    finally:
+        writer.close()
+    return BatchStats(count, writer.rows, time.perf_counter() - start)
@@ -0,0 +1,170 @@
+import json
+import logging
+import os
+import shutil
+
+import numpy as np
+
+_log = logging.getLogger(__file__)
+
+# Columns of a capture and their types, one entry per sensor present in a message.
+CAPTURE_COLUMNS = {
+    'timestamp': np.int64,
+    'row': np.int32,
+    'magnitude': np.float64,
+    'angle': np.float64,
+    'value': np.float64,
+    'dropped': np.bool_
+}
+
+MRIDS = 'mrids.json'
+OFFSETS = 'offsets'
+
+
+class ColumnarCapture(object):
+    def __init__(self, directory, chunk_rows=1000000):
+        """
+        Write measurements to directory as chunks of columnar .npy files.
+
+        Each chunk is a directory holding one .npy file per column of `CAPTURE_COLUMNS` with
+        the entries sorted by row, the index of the sensor's mrid in mrids.json, and then by
+        time.  offsets.npy holds where the entries of each row start, so the entries of one
+        sensor are a slice of every chunk.  A chunk is written to a temporary directory and
+        renamed into place, the chunks on disk are always complete.
+
+        :param directory: Directory of the capture, any earlier capture in it is removed.
+        :param chunk_rows: Entries buffered in memory before they are written as a chunk.
+        """
+        self._directory = directory
+        self._chunk_rows = max(1, int(chunk_rows))
+        self._pending = []
+        self._size = 0
+        self._chunks = 0
+        self._mrids = []
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+
+    @property
+    def directory(self):
+        return self._directory
+
+    def append(self, columns: dict, mrids):
+        """
+        Add the entries of one message.
+
+        :param columns: Dictionary of equal length arrays, one for each of `CAPTURE_COLUMNS`.
+        :param mrids: The mrid of each row, only ever appended to.
+        """
+        self._mrids = mrids
+        self._pending.append(columns)
+        self._size += len(columns['row'])
+        if self._size >= self._chunk_rows:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the buffered entries as a new chunk.
+        """
+        if not self._pending:
+            return
+        columns = {name: np.concatenate([c[name] for c in self._pending]).astype(dtype, copy=False)
+                   for name, dtype in CAPTURE_COLUMNS.items()}
+        self._pending = []
+        self._size = 0
+        mrids = list(self._mrids)
+
+        order = np.argsort(columns['row'], kind='stable')
+        counts = np.bincount(columns['row'], minlength=len(mrids))
+        target = os.path.join(self._directory, f"chunk-{self._chunks:08d}")
+        staging = f"{target}.tmp"
+        os.makedirs(staging)
+        for name, array in columns.items():
+            np.save(os.path.join(staging, f"{name}.npy"), array[order], allow_pickle=False)
+        np.save(os.path.join(staging, f"{OFFSETS}.npy"), np.concatenate(([0], np.cumsum(counts))),
+                allow_pickle=False)
+        os.replace(staging, target)
+        self._chunks += 1
+
+        path = os.path.join(self._directory, MRIDS)
+        with open(f"{path}.tmp", 'w') as fp:
+            json.dump(mrids, fp)
+        os.replace(f"{path}.tmp", path)
+
+    def close(self):
+        self.flush()
+
+
+class CaptureReader(object):
+    def __init__(self, directory, mmap_mode='r'):
+        """
+        Read a capture written by `ColumnarCapture`.
+
+        The columns of each chunk are memory mapped, reading the series of one sensor only
+        touches its slice of every chunk.
+
+        :param directory: Directory of the capture.
+        :param mmap_mode: How the columns are memory mapped.
+        """
+        self._directory = directory
+        self._mmap_mode = mmap_mode
+        try:
+            with open(os.path.join(directory, MRIDS)) as fp:
+                self._mrids = json.load(fp)
+        except FileNotFoundError:
+            self._mrids = []
+        self._rows = {mrid: row for row, mrid in enumerate(self._mrids)}
+        self._names = sorted(name for name in os.listdir(directory)
+                             if name.startswith('chunk-') and not name.endswith('.tmp'))
+        self._chunks = {}
+
+    @property
+    def mrids(self):
+        return self._mrids
+
+    def __len__(self):
+        return sum(len(self._chunk(index)['row']) for index in range(len(self._names)))
+
+    def series(self, mrid):
+        """
+        Return every entry of one sensor in time order.
+
+        :param mrid: mrid of the sensor.
+        :return: Dictionary of the arrays of `CAPTURE_COLUMNS`.
+        """
+        row = self._rows[mrid]
+        slices = []
+        for index in range(len(self._names)):
+            chunk = self._chunk(index)
+            offsets = chunk[OFFSETS]
+            if row + 1 < len(offsets):
+                slices.append((chunk, slice(offsets[row], offsets[row + 1])))
+        return {name: np.concatenate([np.zeros(0, dtype)] + [chunk[name][part] for chunk, part in slices])
+                for name, dtype in CAPTURE_COLUMNS.items()}
+
+    def read(self):
+        """
+        Return every entry of the capture ordered by time and then by row.
+
+        :return: Dictionary of the arrays of `CAPTURE_COLUMNS`.
+        """
+        chunks = [self._chunk(index) for index in range(len(self._names))]
+        columns = {name: np.concatenate([np.zeros(0, dtype)] + [chunk[name] for chunk in chunks])
+                   for name, dtype in CAPTURE_COLUMNS.items()}
+        order = np.lexsort((columns['row'], columns['timestamp']))
+        return {name: array[order] for name, array in columns.items()}
+
+    def _chunk(self, index):
+        chunk = self._chunks.get(index)
+        if chunk is None:
+            path = os.path.join(self._directory, self._names[index])
+            chunk = self._chunks[index] = {name: _load(os.path.join(path, f"{name}.npy"), self._mmap_mode)
+                                           for name in list(CAPTURE_COLUMNS) + [OFFSETS]}
+        return chunk
+
+
+def _load(path, mmap_mode):
+    try:
+        return np.load(path, mmap_mode=mmap_mode, allow_pickle=False)
+    except ValueError:
+        # Empty arrays can not be memory mapped.
+        return np.load(path, allow_pickle=False)
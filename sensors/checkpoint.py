@@ -0,0 +1,105 @@
+import json
+import logging
+import os
+import shutil
+
+import numpy as np
+
+_log = logging.getLogger(__file__)
+
+CHECKPOINT_VERSION = 2
+LATEST = 'LATEST'
+
+DEFAULT_CHECKPOINT_CONFIG = {
+    'directory': '/tmp/gridappsd_tmp/{simulation_id}/checkpoint',
+    'interval': 0,
+    'restore': True
+}
+
+
+def write_checkpoint(directory, arrays: dict, meta: dict, keep=None):
+    """
+    Write a checkpoint and make it the latest one in directory.
+
+    Each array is written to its own .npy file so that it can be memory mapped when the
+    checkpoint is read and meta, which must be JSON serializable, to meta.json.  The
+    checkpoint is written to a temporary directory that is renamed into place and the
+    LATEST file is replaced atomically, so a crash never leaves a partial checkpoint
+    behind.  The index follows the highest checkpoint on disk, not the latest one, as a
+    crash before LATEST is replaced leaves a complete checkpoint it does not point to.
+    The older checkpoints are removed, except keep.
+
+    :param keep: Path of a checkpoint whose arrays are still memory mapped, such as the one
+        the sensors were restored from.  Windows can not remove a mapped file, so it is
+        left until a later call no longer keeps it.
+    :return: Path of the checkpoint.
+    """
+    os.makedirs(directory, exist_ok=True)
+    index = max((_index(entry) for entry in os.listdir(directory)), default=-1) + 1
+    name = f"checkpoint-{index:08d}"
+    target = os.path.join(directory, name)
+    staging = f"{target}.tmp"
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    for key, array in arrays.items():
+        np.save(os.path.join(staging, f"{key}.npy"), array, allow_pickle=False)
+    with open(os.path.join(staging, 'meta.json'), 'w') as fp:
+        json.dump(dict(meta, version=CHECKPOINT_VERSION, arrays=sorted(arrays)), fp)
+    os.replace(staging, target)
+
+    pointer = os.path.join(directory, f"{LATEST}.tmp")
+    with open(pointer, 'w') as fp:
+        fp.write(name)
+    os.replace(pointer, os.path.join(directory, LATEST))
+    for entry in os.listdir(directory):
+        path = os.path.join(directory, entry)
+        if entry.startswith('checkpoint-') and not entry.endswith('.tmp') and entry != name and \
+                (keep is None or not os.path.samefile(path, keep)):
+            shutil.rmtree(path, ignore_errors=True)
+    return target
+
+
+def read_checkpoint(directory, mmap_mode='c'):
+    """
+    Read the latest checkpoint in directory.
+
+    :param mmap_mode: How the arrays are memory mapped, the default copy on write maps
+        can be modified without changing the checkpoint.  While they are mapped the path of
+        the checkpoint, meta['path'], has to be passed as keep to `write_checkpoint`.
+    :return: tuple of the dictionary of arrays and the meta dictionary, None when there is
+        no checkpoint.
+    """
+    name = _latest(directory)
+    if name is None:
+        return None
+    path = os.path.join(directory, name)
+    with open(os.path.join(path, 'meta.json')) as fp:
+        meta = json.load(fp)
+    if meta.get('version') != CHECKPOINT_VERSION:
+        raise ValueError(f"Unsupported checkpoint version {meta.get('version')} in {path}")
+    arrays = {key: _load(os.path.join(path, f"{key}.npy"), mmap_mode) for key in meta['arrays']}
+    meta['path'] = path
+    return arrays, meta
+
+
+def _load(path, mmap_mode):
+    try:
+        return np.load(path, mmap_mode=mmap_mode, allow_pickle=False)
+    except ValueError:
+        # Empty arrays can not be memory mapped.
+        return np.load(path, allow_pickle=False)
+
+
+def _index(entry):
+    prefix, _, index = entry.partition('-')
+    if prefix != 'checkpoint' or not index.isdigit():
+        return -1
+    return int(index)
+
+
+def _latest(directory):
+    try:
+        with open(os.path.join(directory, LATEST)) as fp:
+            return fp.read().strip() or None
+    except FileNotFoundError:
+        return None
@@ -0,0 +1,240 @@
+import json
+import logging
+import os
+import queue
+import threading
+
+from .capture import ColumnarCapture
+
+_log = logging.getLogger(__file__)
+
+# Diagnostic streams that can be captured and the file each is written to.
+DIAGNOSTIC_STREAMS = {
+    'measurement-list': 'measurement_list.txt',
+    'measurement-in': 'measurement.infile.txt',
+    'measurement-out': 'measurement.outfile.txt',
+    'measurement-data': 'measurement.data.txt',
+    'sensor-data': 'sensor.data.txt',
+    'measurement-capture': 'capture'
+}
+
+# Streams written by a `ColumnarCapture` into the directory named above, their formatter
+# returns the columns and mrids of a record instead of text.
+COLUMNAR_STREAMS = ('measurement-capture',)
+
+DEFAULT_DIAGNOSTICS_CONFIG = {
+    'directory': '/tmp/gridappsd_tmp/{simulation_id}',
+    'queue-size': 10000,
+    'batch-size': 256,
+    'max-bytes': 100 * 1024 * 1024,
+    'backup-count': 5,
+    'chunk-rows': 1000000
+}
+
+# Seconds close waits for the writer thread to take the stop request and to finish.
+CLOSE_TIMEOUT = 30.0
+
+_STOP = object()
+
+
+def format_json(payload):
+    return f"{json.dumps(payload)}\n"
+
+
+class DiagnosticsWriter(object):
+    def __init__(self, simulation_id, config: dict = None):
+        """
+        Capture diagnostic streams to disk from a background thread.
+
+        Records are placed on a bounded queue by `submit` and formatted and written in
+        batches by a writer thread, so the caller never waits on the disk.  When the queue
+        is full the record is discarded and counted rather than blocking the caller.  A
+        record that can not be written, for example because the disk is full, is logged and
+        counted and the thread carries on with the next one.
+
+        The config dictionary has the following structure, every stream is off unless it
+        is set to true:
+            {
+                "measurement-in": true,
+                "measurement-out": false,
+                "measurement-data": false,
+                "sensor-data": false,
+                "measurement-list": false,
+                "measurement-capture": false,
+                "directory": "/tmp/gridappsd_tmp/{simulation_id}",
+                "queue-size": 10000,
+                "batch-size": 256,
+                "max-bytes": 104857600,
+                "backup-count": 5,
+                "chunk-rows": 1000000
+            }
+
+            max-bytes    - Size a file may grow to before it is rotated, 0 disables rotation.
+            backup-count - Number of rotated files that are kept for each stream.
+            chunk-rows   - Entries of measurement-capture written to each chunk, see `ColumnarCapture`.
+
+        The JSON lines streams measurement-in and measurement-out are read by replay.py, the
+        measurement-capture stream holds the values of every sensor in columnar form for
+        analysis, see `CaptureReader`.  It is not rotated.
+
+        :param simulation_id:
+            Simulation the diagnostics belong to, substituted into the directory.
+        :param config:
+            Diagnostics configuration from the user options.
+        """
+        config = dict(config or {})
+        self._streams = {name for name in DIAGNOSTIC_STREAMS if config.pop(name, False)}
+        settings = dict(DEFAULT_DIAGNOSTICS_CONFIG)
+        settings.update(config)
+        self._directory = settings['directory'].format(simulation_id=simulation_id)
+        self._batch_size = int(settings['batch-size'])
+        self._max_bytes = int(settings['max-bytes'])
+        self._backup_count = int(settings['backup-count'])
+        self._chunk_rows = int(settings['chunk-rows'])
+        self._queue = queue.Queue(maxsize=int(settings['queue-size']))
+        self._files = {}
+        self._captures = {}
+        self._discarded = 0
+        self._failed = {}
+        self._closed = False
+        self._thread = None
+
+        if self._streams:
+            os.makedirs(self._directory, exist_ok=True)
+            self._thread = threading.Thread(target=self._run, name="sensor-diagnostics", daemon=True)
+            self._thread.start()
+            _log.info(f"Capturing diagnostics {sorted(self._streams)} to {self._directory}")
+
+    @property
+    def directory(self):
+        return self._directory
+
+    @property
+    def discarded(self):
+        """
+        Number of records discarded because the queue was full.
+        """
+        return self._discarded
+
+    @property
+    def failed(self):
+        """
+        Number of batches of records that could not be written.
+        """
+        return sum(self._failed.values())
+
+    def enabled(self, stream):
+        return stream in self._streams
+
+    def path(self, stream):
+        return os.path.join(self._directory, DIAGNOSTIC_STREAMS[stream])
+
+    def submit(self, stream, payload, formatter=format_json):
+        """
+        Queue a record for a stream.
+
+        :param stream: Name of the diagnostic stream.
+        :param payload: The object to write.  It must not be modified after it is submitted.
+        :param formatter: Callable turning the payload into text, run on the writer thread.
+        """
+        if stream not in self._streams or self._closed:
+            return
+        try:
+            self._queue.put_nowait((stream, payload, formatter))
+        except queue.Full:
+            if self._discarded == 0:
+                _log.warning("Diagnostics queue is full, discarding records")
+            self._discarded += 1
+
+    def close(self):
+        """
+        Write everything that has been submitted and close the files.
+
+        Waits at most CLOSE_TIMEOUT seconds for the writer thread to take the stop request
+        and again for it to finish, so a stuck disk does not hang the shutdown.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        if self._thread is not None and self._thread.is_alive():
+            try:
+                self._queue.put(_STOP, timeout=CLOSE_TIMEOUT)
+            except queue.Full:
+                _log.error("Diagnostics writer is not taking records, closing without it")
+            else:
+                self._thread.join(CLOSE_TIMEOUT)
+                if self._thread.is_alive():
+                    _log.error("Diagnostics writer did not finish, closing without it")
+        if self._discarded:
+            _log.warning(f"Discarded {self._discarded} diagnostic records")
+        if self._failed:
+            _log.warning(f"Unable to write {self.failed} batches of diagnostic records")
+
+    def _run(self):
+        running = True
+        while running:
+            batch = [self._queue.get()]
+            while len(batch) < self._batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            pending = {}
+            for record in batch:
+                if record is _STOP:
+                    running = False
+                    continue
+                stream, payload, formatter = record
+                try:
+                    pending.setdefault(stream, []).append(formatter(payload))
+                except Exception:
+                    _log.exception(f"Unable to format {stream} diagnostic record")
+
+            for stream, chunks in pending.items():
+                try:
+                    if stream in COLUMNAR_STREAMS:
+                        self._write_columns(stream, chunks)
+                    else:
+                        self._write(stream, ''.join(chunks))
+                except Exception:
+                    # Only the first failure of a stream is logged, a full disk fails every batch.
+                    if stream not in self._failed:
+                        _log.exception(f"Unable to write {stream} diagnostic records")
+                    self._failed[stream] = self._failed.get(stream, 0) + 1
+
+        for stream, fp in list(self._files.items()) + list(self._captures.items()):
+            try:
+                fp.close()
+            except Exception:
+                _log.exception(f"Unable to close {stream} diagnostics")
+        self._files.clear()
+        self._captures.clear()
+
+    def _write_columns(self, stream, records):
+        capture = self._captures.get(stream)
+        if capture is None:
+            capture = self._captures[stream] = ColumnarCapture(self.path(stream), self._chunk_rows)
+        for columns, mrids in records:
+            capture.append(columns, mrids)
+
+    def _write(self, stream, text):
+        fp = self._files.get(stream)
+        if fp is None:
+            fp = self._files[stream] = open(self.path(stream), 'w')
+        fp.write(text)
+        if self._max_bytes > 0 and fp.tell() >= self._max_bytes:
+            self._rotate(stream)
+        else:
+            fp.flush()
+
+    def _rotate(self, stream):
+        self._files.pop(stream).close()
+        path = self.path(stream)
+        if self._backup_count > 0:
+            for index in range(self._backup_count - 1, 0, -1):
+                source = f"{path}.{index}"
+                if os.path.exists(source):
+                    os.replace(source, f"{path}.{index + 1}")
+            os.replace(path, f"{path}.1")
+        self._files[stream] = open(path, 'w')
@@ -0,0 +1,107 @@
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import queue
+import threading
+
+from .sensor import Sensors
+
+_log = logging.getLogger(__file__)
+
+
+class SensorHost(object):
+    def __init__(self, gridappsd, workers=4):
+        """
+        Host the sensors of many simulations in one process over one connection.
+
+        Each simulation has its own `Sensors` with isolated state.  Its measurement messages
+        are processed by one of a fixed number of worker lanes, a lane runs the messages of
+        the simulations assigned to it one at a time and in order, so a simulation is never
+        processed by two threads at once.  A simulation is torn down once it completes, its
+        `Sensors` hands its id to the main loop when it does.
+
+        :param gridappsd: The connection shared by every simulation.
+        :param workers: Number of worker lanes.
+        """
+        self._gappsd = gridappsd
+        self._lanes = [ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"sensor-lane-{index}")
+                       for index in range(max(1, int(workers)))]
+        self._load = [0] * len(self._lanes)
+        self._simulations = {}
+        self._lock = threading.Lock()
+        # Ids of the completed simulations and None to stop, SimpleQueue.put is safe in a
+        # signal handler.
+        self._completed = queue.SimpleQueue()
+
+    @property
+    def simulations(self):
+        """
+        Ids of the simulations currently hosted.
+        """
+        with self._lock:
+            return list(self._simulations)
+
+    def add_simulation(self, simulation_id, user_options, read_topic, write_topic, log_topic=None,
+                       control_topic=None, measurement_info=None, stats_topic=None, command_topic=None):
+        """
+        Create the sensors of a simulation and subscribe to its topics.  The arguments are
+        passed on to `Sensors`.
+
+        :return: The `Sensors` of the simulation.
+        """
+        with self._lock:
+            if simulation_id in self._simulations:
+                raise ValueError(f"Simulation {simulation_id} is already hosted")
+            lane = self._load.index(min(self._load))
+            self._load[lane] += 1
+            sensors = Sensors(self._gappsd, read_topic, write_topic, user_options, simulation_id=simulation_id,
+                              log_topic=log_topic, control_topic=control_topic,
+                              measurement_info=measurement_info, stats_topic=stats_topic,
+                              on_complete=self._completed.put, command_topic=command_topic)
+            self._simulations[simulation_id] = (sensors, lane)
+        sensors.subscribe(self._lanes[lane])
+        _log.info(f"Hosting simulation {simulation_id} on lane {lane}, {len(self._simulations)} simulations")
+        return sensors
+
+    def remove_simulation(self, simulation_id):
+        """
+        Unsubscribe a simulation, wait for its queued messages and close its sensors.
+        """
+        with self._lock:
+            entry = self._simulations.pop(simulation_id, None)
+            if entry is None:
+                return
+            sensors, lane = entry
+            self._load[lane] -= 1
+        sensors.simulation_complete()
+        sensors.unsubscribe()
+        # The lane runs in order so close runs after the messages already queued.
+        self._lanes[lane].submit(sensors.close).result()
+        _log.info(f"Simulation {simulation_id} removed, {len(self._simulations)} simulations")
+
+    def stop(self):
+        """
+        Stop the main loop.  Safe to call from any thread or from a signal handler.
+        """
+        self._completed.put(None)
+
+    def main_loop(self):
+        """
+        Tear down simulations as they complete until `stop` is called, then remove every
+        remaining simulation and stop the workers.
+        """
+        while True:
+            simulation_id = self._completed.get()
+            if simulation_id is None:
+                break
+            with self._lock:
+                entry = self._simulations.get(simulation_id)
+            # A removed simulation reports again, and its id may be hosted anew by now.
+            if entry is not None and entry[0].is_complete:
+                self.remove_simulation(simulation_id)
+        self.close()
+
+    def close(self):
+        for simulation_id in self.simulations:
+            self.remove_simulation(simulation_id)
+        for lane in self._lanes:
+            lane.shutdown(wait=True)
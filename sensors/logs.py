@@ -0,0 +1,128 @@
+from collections import deque
+import logging
+import time
+
+# Seconds between repeated messages of the same kind, see `RateLimitedLog`.
+DEFAULT_LOG_INTERVAL = 60
+
+
+class RateLimitedLog(object):
+    def __init__(self, logger, interval=DEFAULT_LOG_INTERVAL):
+        """
+        Log repeated events, such as the sensor output of every timestep, at most once every
+        interval seconds for each key.
+
+        A message is only formatted when it is emitted.  The suppressed messages are counted
+        and the count is added to the next message emitted for the key.
+
+        :param logger: Logger the messages are sent to.
+        :param interval: Seconds between messages of the same key, 0 logs every message and a
+            negative interval none.
+        """
+        self._logger = logger
+        self._interval = float(interval)
+        self._next = {}
+        self._suppressed = {}
+
+    @property
+    def interval(self):
+        return self._interval
+
+    def log(self, key, level, msg, *args):
+        """
+        Log msg % args unless a message with the same key was logged less than interval
+        seconds ago.
+
+        :return: True when the message was logged.
+        """
+        if self._interval < 0 or not self._logger.isEnabledFor(level):
+            return False
+        now = time.monotonic()
+        if now < self._next.get(key, 0.0):
+            self._suppressed[key] = self._suppressed.get(key, 0) + 1
+            return False
+        self._next[key] = now + self._interval
+        suppressed = self._suppressed.pop(key, 0)
+        if suppressed:
+            msg = f"{msg} (suppressed {suppressed} similar messages)"
+        self._logger.log(level, msg, *args)
+        return True
+
+
+class RingBufferHandler(logging.Handler):
+    def __init__(self, capacity, target, threshold=logging.INFO, dump_level=logging.ERROR):
+        """
+        Keep the most recent records below threshold, the detail the log file does not
+        show, and write them to target before a record of dump_level or above.
+
+        The records are kept as they are, they are only formatted if they are written out.
+
+        :param capacity: Most records kept.
+        :param target: Handler the records are written to, usually the log file's.
+        :param threshold: Level of the records written by target, only the records below it
+            are kept.
+        :param dump_level: Level of the records that write out the buffer.
+        """
+        super(RingBufferHandler, self).__init__(logging.DEBUG)
+        self._records = deque(maxlen=capacity)
+        self._target = target
+        self._threshold = threshold
+        self._dump_level = dump_level
+
+    def __len__(self):
+        return len(self._records)
+
+    def emit(self, record):
+        if record.levelno < self._threshold:
+            self._records.append(record)
+        elif record.levelno >= self._dump_level:
+            self.dump()
+
+    def dump(self):
+        """
+        Write the kept records to the target and forget them.
+        """
+        records = list(self._records)
+        self._records.clear()
+        if not records:
+            return
+        self._target.handle(logging.makeLogRecord({'name': __name__, 'levelno': logging.INFO, 'levelname': 'INFO',
+                                                   'msg': f"---- {len(records)} recent records ----"}))
+        for record in records:
+            self._target.handle(record)
+        self._target.handle(logging.makeLogRecord({'name': __name__, 'levelno': logging.INFO, 'levelname': 'INFO',
+                                                   'msg': "---- end of recent records ----"}))
+
+
+def configure_logging(stream, level=logging.INFO, ring_buffer=0):
+    """
+    Send the log to stream at level.
+
+    With a ring buffer the root logger is lowered to DEBUG and the latest ring_buffer records
+    below level are written to the stream ahead of any error.  Without it the root logger
+    stays at level so a disabled debug call costs no more than the level check.
+
+    :param stream: Text file object the log is written to.
+    :param level: Level of the records written to stream, a number or a name such as "debug".
+    :param ring_buffer: Number of recent records kept, 0 disables the buffer.
+    :return: The `RingBufferHandler` or None.
+    """
+    if not isinstance(level, int):
+        name = str(level).upper()
+        level = logging.getLevelName(name)
+        if not isinstance(level, int):
+            raise ValueError(f"Unknown log level {name}")
+    handler = logging.StreamHandler(stream)
+    handler.setLevel(level)
+    handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+    root = logging.getLogger()
+    buffer = None
+    if ring_buffer > 0:
+        buffer = RingBufferHandler(ring_buffer, handler, threshold=level)
+        # Added first so the recent records come before the error that writes them out.
+        root.addHandler(buffer)
+        root.setLevel(min(level, logging.DEBUG))
+    else:
+        root.setLevel(level)
+    root.addHandler(handler)
+    return buffer
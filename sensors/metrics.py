@@ -0,0 +1,192 @@
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import logging
+import threading
+import time
+import weakref
+
+_log = logging.getLogger(__file__)
+
+# Upper bounds (seconds) of the latency histogram buckets.
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+                   5.0, 10.0)
+
+# Stages of processing a message, "message" covers decode through build.
+STAGES = ('decode', 'sample', 'build', 'publish', 'message')
+
+COUNTERS = ('messages', 'emitted', 'dropped', 'suppressed', 'missing', 'passthrough')
+
+DEFAULT_METRICS_CONFIG = {
+    'enabled': True,
+    'publish-interval': 60,
+    'port': 0
+}
+
+# Every SensorMetrics alive in the process, rendered by the HTTP endpoint.
+_registry = weakref.WeakSet()
+_servers = {}
+_servers_lock = threading.Lock()
+
+
+class LatencyHistogram(object):
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        """
+        A fixed bucket histogram of durations in seconds.  The last bucket counts everything
+        larger than the largest bound.
+        """
+        self._bounds = tuple(bounds)
+        self._counts = [0] * (len(self._bounds) + 1)
+        self._sum = 0.0
+        self._count = 0
+
+    @property
+    def count(self):
+        return self._count
+
+    @property
+    def sum(self):
+        return self._sum
+
+    def observe(self, seconds):
+        self._counts[bisect_left(self._bounds, seconds)] += 1
+        self._sum += seconds
+        self._count += 1
+
+    def quantile(self, q):
+        """
+        Upper bound of the bucket holding the q quantile, inf when it is past the last bound.
+        """
+        if self._count == 0:
+            return 0.0
+        target = q * self._count
+        total = 0
+        for bound, count in zip(self._bounds, self._counts):
+            total += count
+            if total >= target:
+                return bound
+        return float('inf')
+
+    def cumulative(self):
+        """
+        (upper bound, cumulative count) pairs in the Prometheus bucket layout.
+        """
+        total = 0
+        for bound, count in zip(self._bounds + (float('inf'),), self._counts):
+            total += count
+            yield bound, total
+
+
+class SensorMetrics(object):
+    def __init__(self, simulation_id):
+        """
+        Stage timers and counters of the sensors of one simulation.
+
+        Updating a metric is a few additions on the message's own thread, no locks are
+        taken, so a reader may see a snapshot that is off by the message in progress.
+
+        :param simulation_id: Simulation the metrics belong to, used as a label.
+        """
+        self._simulation_id = simulation_id
+        self._histograms = {stage: LatencyHistogram() for stage in STAGES}
+        self._counters = dict.fromkeys(COUNTERS, 0)
+        self._gauges = {}
+        self._started = time.time()
+        _registry.add(self)
+
+    @property
+    def simulation_id(self):
+        return self._simulation_id
+
+    def observe(self, stage, seconds):
+        self._histograms[stage].observe(seconds)
+
+    def count(self, counter, value=1):
+        self._counters[counter] += value
+
+    def gauge(self, name, value):
+        self._gauges[name] = value
+
+    def snapshot(self):
+        """
+        The metrics as a JSON serializable dictionary, stage times are in seconds.
+        """
+        elapsed = max(time.time() - self._started, 1e-9)
+        stages = {}
+        for stage, histogram in self._histograms.items():
+            stages[stage] = {
+                'count': histogram.count,
+                'mean': histogram.sum / histogram.count if histogram.count else 0.0,
+                'p50': histogram.quantile(0.5),
+                'p99': histogram.quantile(0.99)
+            }
+        return {
+            'simulation_id': self._simulation_id,
+            'timestamp': time.time(),
+            'messages-per-second': self._counters['messages'] / elapsed,
+            'counters': dict(self._counters),
+            'gauges': dict(self._gauges),
+            'stages': stages
+        }
+
+    def render(self):
+        """
+        The metrics in the Prometheus text exposition format.
+        """
+        label = f'simulation_id="{self._simulation_id}"'
+        lines = []
+        for counter, value in self._counters.items():
+            lines.append(f'sensor_{counter}_total{{{label}}} {value}')
+        for name, value in self._gauges.items():
+            lines.append(f'sensor_{name.replace("-", "_")}{{{label}}} {value}')
+        for stage, histogram in self._histograms.items():
+            stage_label = f'{label},stage="{stage}"'
+            for bound, total in histogram.cumulative():
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'sensor_stage_seconds_bucket{{{stage_label},le="{le}"}} {total}')
+            lines.append(f'sensor_stage_seconds_sum{{{stage_label}}} {histogram.sum}')
+            lines.append(f'sensor_stage_seconds_count{{{stage_label}}} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    def close(self):
+        _registry.discard(self)
+
+
+def render_all():
+    """
+    The metrics of every simulation in the process in the Prometheus text format.
+    """
+    return ''.join(metrics.render() for metrics in list(_registry))
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = render_all().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        _log.debug(format, *args)
+
+
+def start_http_server(port, address=''):
+    """
+    Serve the metrics of every simulation in the process on port, from a daemon thread.
+    Only one server is started per port, later calls return the running one.
+
+    :return: The `ThreadingHTTPServer`.
+    """
+    with _servers_lock:
+        server = _servers.get(port)
+        if server is None:
+            server = ThreadingHTTPServer((address, port), _MetricsHandler)
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, name="sensor-metrics", daemon=True).start()
+            _servers[port] = server
+            _log.info(f"Serving metrics on port {server.server_address[1]}")
+        return server
@@ -0,0 +1,225 @@
+from collections import deque
+import logging
+import threading
+import time
+
+_log = logging.getLogger(__file__)
+
+# What a full receive queue does with a new message.
+BACKPRESSURE_POLICIES = ('block', 'drop-oldest', 'coalesce')
+
+DEFAULT_PIPELINE_CONFIG = {
+    'queue-size': 0,
+    'policy': 'block',
+    'publish-queue-size': 16
+}
+
+_STOP = object()
+
+
+class BoundedQueue(object):
+    def __init__(self, maxsize, policy='block'):
+        """
+        A first in first out queue holding at most maxsize items.
+
+        When the queue is full `put` applies the policy:
+
+            block       - wait until there is room
+            drop-oldest - discard the oldest item
+            coalesce    - discard every queued item so the consumer skips to the newest
+
+        :param maxsize: Most items queued at once.
+        :param policy: One of `BACKPRESSURE_POLICIES`.
+        """
+        if policy not in BACKPRESSURE_POLICIES:
+            raise ValueError(f"Invalid policy {policy}, expected one of {BACKPRESSURE_POLICIES}")
+        self._maxsize = max(1, int(maxsize))
+        self._policy = policy
+        self._items = deque()
+        self._condition = threading.Condition()
+        self._max_depth = 0
+        self._discarded = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    @property
+    def max_depth(self):
+        return self._max_depth
+
+    @property
+    def discarded(self):
+        return self._discarded
+
+    def put(self, item, force=False):
+        """
+        Add an item, applying the policy when the queue is full.
+
+        :param force: Add the item even when the queue is full, used for the stop marker.
+        """
+        with self._condition:
+            if not force and len(self._items) >= self._maxsize:
+                if self._policy == 'block':
+                    self._condition.wait_for(lambda: len(self._items) < self._maxsize)
+                elif self._policy == 'drop-oldest':
+                    self._items.popleft()
+                    self._discarded += 1
+                else:
+                    self._discarded += len(self._items)
+                    self._items.clear()
+            self._items.append(item)
+            self._max_depth = max(self._max_depth, len(self._items))
+            self._condition.notify_all()
+
+    def get(self):
+        with self._condition:
+            self._condition.wait_for(lambda: self._items)
+            item = self._items.popleft()
+            self._condition.notify_all()
+            return item
+
+
+class MessagePipeline(object):
+    def __init__(self, process, publish, config: dict = None, name="sensors"):
+        """
+        Decouple receiving messages from processing and publishing them.
+
+        The message bus callback only places the message on a bounded receive queue.  A
+        processing thread takes the messages in order and passes them to process, whose
+        result (when not None) is placed on a second bounded queue that a publishing thread
+        hands to publish.
+
+        The config dictionary has the following structure:
+            {
+                "queue-size": 100,
+                "policy": "block",
+                "publish-queue-size": 16
+            }
+
+            queue-size         - Messages the receive queue holds, 0 disables the pipeline.
+            policy             - What a full receive queue does, "block" the message bus thread,
+                                 "drop-oldest" message or "coalesce" to the newest message.
+            publish-queue-size - Messages waiting to be published before processing blocks.
+
+        :param process: Callable taking a message and returning the message to publish or None.
+        :param publish: Callable publishing a message.
+        :param config: Pipeline configuration from the user options.
+        :param name: Prefix of the thread names.
+        """
+        settings = dict(DEFAULT_PIPELINE_CONFIG)
+        settings.update(config or {})
+        self._process = process
+        self._publish = publish
+        self._received = BoundedQueue(settings['queue-size'], settings['policy'])
+        self._outbound = BoundedQueue(settings['publish-queue-size'], 'block')
+        self._received_timestamp = None
+        self._processed_timestamp = None
+        self._wait = 0.0
+        self._processed = 0
+        # Messages handed to the publishing stage and published, guarded by the condition.
+        self._handed = 0
+        self._published = 0
+        self._published_condition = threading.Condition()
+        self._closed = False
+        self._threads = [threading.Thread(target=self._run_process, name=f"{name}-process", daemon=True),
+                         threading.Thread(target=self._run_publish, name=f"{name}-publish", daemon=True)]
+        for thread in self._threads:
+            thread.start()
+        _log.info(f"Processing messages through a receive queue of {settings['queue-size']} "
+                  f"({settings['policy']})")
+
+    @property
+    def statistics(self):
+        """
+        Current state of the pipeline:
+
+            depth            - messages waiting in the receive queue
+            max-depth        - most messages that have waited in the receive queue
+            discarded        - messages discarded by the backpressure policy
+            processed        - messages processed
+            lag              - simulation seconds between the newest message received and the
+                               newest message processed
+            mean-wait        - mean seconds a message waited in the receive queue
+            publish-depth    - messages waiting to be published
+        """
+        lag = 0.0
+        if self._received_timestamp is not None and self._processed_timestamp is not None:
+            lag = float(self._received_timestamp - self._processed_timestamp)
+        return {
+            'depth': len(self._received),
+            'max-depth': self._received.max_depth,
+            'discarded': self._received.discarded,
+            'processed': self._processed,
+            'lag': lag,
+            'mean-wait': self._wait / self._processed if self._processed else 0.0,
+            'publish-depth': len(self._outbound)
+        }
+
+    def submit(self, headers, message):
+        """
+        Message bus callback, queue the message for processing.
+        """
+        if self._closed:
+            return
+        try:
+            self._received_timestamp = message['message']['timestamp']
+        except (KeyError, TypeError):
+            pass
+        self._received.put((time.monotonic(), message))
+
+    def wait_published(self):
+        """
+        Wait until every message handed to the publishing stage has been published.
+        """
+        with self._published_condition:
+            self._published_condition.wait_for(lambda: self._published >= self._handed)
+
+    def close(self):
+        """
+        Stop accepting messages and wait until the queued ones are processed and published.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._received.put(_STOP, force=True)
+        for thread in self._threads:
+            thread.join()
+        statistics = self.statistics
+        _log.info(f"Pipeline processed {statistics['processed']} messages, discarded {statistics['discarded']}, "
+                  f"max depth {statistics['max-depth']}, mean wait {statistics['mean-wait']:.4f}s")
+
+    def _run_process(self):
+        while True:
+            item = self._received.get()
+            if item is _STOP:
+                break
+            received, message = item
+            self._wait += time.monotonic() - received
+            try:
+                result = self._process(message)
+            except Exception:
+                _log.exception("Unable to process message")
+                result = None
+            self._processed += 1
+            try:
+                self._processed_timestamp = message['message']['timestamp']
+            except (KeyError, TypeError):
+                pass
+            if result is not None:
+                with self._published_condition:
+                    self._handed += 1
+                self._outbound.put(result)
+        self._outbound.put(_STOP, force=True)
+
+    def _run_publish(self):
+        while True:
+            message = self._outbound.get()
+            if message is _STOP:
+                break
+            try:
+                self._publish(message)
+            except Exception:
+                _log.exception("Unable to publish message")
+            with self._published_condition:
+                self._published += 1
+                self._published_condition.notify_all()
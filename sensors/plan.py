@@ -0,0 +1,111 @@
+import logging
+from operator import itemgetter
+
+import numpy as np
+
+_log = logging.getLogger(__file__)
+
+
+class MeasurementPlan(object):
+    def __init__(self, mrids, measurements):
+        """
+        The resolved layout of a simulation's measurements for a list of configured sensors.
+
+        The plan is compiled once from the first message (or any mapping of mrid to the
+        fields it carries, such as the result of a model query) and then used to gather
+        every following message without looking at the configuration again.  It records
+        which configured mrids exist, which of them carry a magnitude and which also
+        carry an angle.  The configured mrids that do not exist are listed in `missing`.
+
+        :param mrids: The configured sensor mrids, in bank row order.
+        :param measurements: Mapping of mrid to measurement (or field names).
+        """
+        self._size = len(mrids)
+        self._count = len(measurements)
+        # Fingerprint of the layout, the mrids and the number of fields each one carries.
+        self._keys = frozenset(measurements)
+        self._fields = _field_counts(measurements)
+        magnitude_rows = []
+        angle_rows = []
+        missing = []
+        for row, mrid in enumerate(mrids):
+            item = measurements.get(mrid)
+            if not item:
+                missing.append(mrid)
+                continue
+            # Only measurements with a magnitude are modeled by a sensor.
+            if 'magnitude' in item:
+                magnitude_rows.append(row)
+                if 'angle' in item:
+                    angle_rows.append(row)
+
+        self._magnitude_rows = np.array(magnitude_rows, dtype=np.intp)
+        self._magnitude_mrids = [mrids[row] for row in magnitude_rows]
+        self._angle_rows = np.array(angle_rows, dtype=np.intp)
+        self._angle_mrids = [mrids[row] for row in angle_rows]
+        self._get_magnitude_items = _items_getter(self._magnitude_mrids)
+        self._get_angle_items = _items_getter(self._angle_mrids)
+        self._present = np.zeros(self._size, dtype=bool)
+        self._present[self._magnitude_rows] = True
+        self._present.setflags(write=False)
+        self._missing = missing
+
+        _log.info(f"Compiled measurement plan: {len(magnitude_rows)} sensors ({len(angle_rows)} with angle), "
+                  f"{len(missing)} configured mrids not found in {self._count} measurements")
+
+    def __repr__(self):
+        return f"<MeasurementPlan(sensors={len(self._magnitude_rows)}, missing={len(self._missing)})>"
+
+    @property
+    def missing(self):
+        return self._missing
+
+    @property
+    def present(self):
+        """
+        Read only mask of the configured sensors that have a magnitude.
+        """
+        return self._present
+
+    def matches(self, measurements):
+        """
+        Cheap check that a message still has the layout the plan was compiled for: the same
+        mrids, each with the same number of fields, so a measurement that gains or loses
+        its angle or is replaced by another mrid is noticed.
+        """
+        return len(measurements) == self._count and measurements.keys() == self._keys and \
+            _field_counts(measurements) == self._fields
+
+    def gather(self, measurements):
+        """
+        Gather the magnitude and angle of each sensor into arrays.
+
+        :raises KeyError: when a measurement or field the plan expects is not in the message.
+        :return: tuple of the magnitude array, angle array and mask of the sensors present.
+        """
+        magnitude = np.full(self._size, np.nan)
+        angle = np.full(self._size, np.nan)
+        magnitude[self._magnitude_rows] = list(map(_get_magnitude, self._get_magnitude_items(measurements)))
+        angle[self._angle_rows] = list(map(_get_angle, self._get_angle_items(measurements)))
+        return magnitude, angle, self._present
+
+
+_get_magnitude = itemgetter('magnitude')
+_get_angle = itemgetter('angle')
+
+
+def _field_counts(measurements):
+    return [len(item) if item else 0 for item in measurements.values()]
+
+
+def _items_getter(mrids):
+    """
+    Return a callable that looks up all of mrids in a mapping at once and always returns
+    a tuple (itemgetter returns a bare item for a single key).
+    """
+    if len(mrids) == 0:
+        return lambda measurements: ()
+    if len(mrids) == 1:
+        getter = itemgetter(mrids[0])
+        return lambda measurements: (getter(measurements),)
+    return itemgetter(*mrids)
@@ -0,0 +1,262 @@
+import calendar
+from collections import namedtuple
+from datetime import datetime
+import itertools
+import logging
+import math
+import os
+import re
+
+import numpy as np
+
+from .sinks import open_text
+
+_log = logging.getLogger(__file__)
+
+# How a `PlayerSignal` fills the time between two rows of a player file.
+INTERPOLATIONS = ('linear', 'hold')
+
+PlayerPoint = namedtuple('PlayerPoint', ['timestamp', 'value', 'angle'], defaults=(None,))
+PlayerPoint.__doc__ = """
+A row of a player file.
+
+timestamp - seconds since the epoch
+value     - the value, the magnitude of a complex value
+angle     - angle of a complex value in degrees, None for a real value
+"""
+
+_OFFSET = re.compile(r'^\+(\d+(?:\.\d*)?)([smhd]?)$')
+_NUMBER = r'\d+(?:\.\d*)?(?:[eE][+-]?\d+)?|\.\d+(?:[eE][+-]?\d+)?'
+_COMPLEX = re.compile(rf'^([+-]?(?:{_NUMBER}))([+-](?:{_NUMBER}))([ijdr])$')
+_UNITS = {'': 1, 's': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def read_player(path):
+    """
+    Generate the points of a GridLAB-D player file one line at a time.
+
+    Each line is a time and a value, for example:
+
+        2013-07-01 00:00:00,110125.23
+        +30s,110125.23
+        +30s,7199.5-0.25j
+
+    The time is either absolute, read as UTC and a trailing time zone name is ignored, or
+    an offset from the previous line in seconds, minutes, hours or days (+30s, +5m, +1h,
+    +1d).  A value is real or complex, written as GridLAB-D does in rectangular form
+    (+1.2-3.4j or i) or in polar form with the angle in degrees (120+30d) or radians
+    (120+0.52r), and its magnitude and angle are kept.  Empty lines and comments starting
+    with # are skipped.
+
+    :param path: Player file, compressed when it ends in .gz.
+    :return: Generator of `PlayerPoint` with the timestamp in seconds since the epoch.
+    """
+    timestamp = None
+    with open_text(path) as fp:
+        for number, line in enumerate(fp, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            when, _, value = line.partition(',')
+            when = when.strip()
+            offset = _OFFSET.match(when)
+            if offset:
+                if timestamp is None:
+                    raise ValueError(f"{path}:{number} starts with an offset instead of a time")
+                timestamp += float(offset.group(1)) * _UNITS[offset.group(2)]
+            else:
+                timestamp = _parse_time(when, path, number)
+            yield PlayerPoint(timestamp, *_parse_value(value, path, number))
+
+
+def _parse_value(text, path, number):
+    text = text.strip()
+    try:
+        return float(text), None
+    except ValueError:
+        pass
+    match = _COMPLEX.match(text.replace(' ', ''))
+    if match is None:
+        raise ValueError(f"{path}:{number} has an invalid value {text}")
+    first, second, unit = float(match.group(1)), float(match.group(2)), match.group(3)
+    if unit in 'ij':
+        return math.hypot(first, second), math.degrees(math.atan2(second, first))
+    return first, second if unit == 'd' else math.degrees(second)
+
+
+def _parse_time(text, path, number):
+    parts = text.split()
+    if len(parts) > 2:
+        # A time zone such as "PST" or "UTC", every time is read as UTC.
+        parts = parts[:2]
+    for layout in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M'):
+        try:
+            return float(calendar.timegm(datetime.strptime(' '.join(parts), layout).timetuple()))
+        except ValueError:
+            continue
+    raise ValueError(f"{path}:{number} has an invalid time {text}")
+
+
+class PlayerSignal(object):
+    def __init__(self, points, interpolation='linear'):
+        """
+        The value of a player over time, read as it is needed.
+
+        Only the rows on either side of the latest time asked for are held, so a player of
+        any length uses constant memory.  Before the first row the first value is used and
+        after the last row the last value is held.  The angle of a complex player is
+        interpolated the short way around the circle.
+
+        :param points: Iterable of `PlayerPoint` in time order, such as `read_player`.
+        :param interpolation: One of `INTERPOLATIONS`.
+        """
+        if interpolation not in INTERPOLATIONS:
+            raise ValueError(f"Invalid interpolation {interpolation}, expected one of {INTERPOLATIONS}")
+        self._points = iter(points)
+        self._interpolation = interpolation
+        self._previous = next(self._points, None)
+        if self._previous is None:
+            raise ValueError("A player needs at least one point")
+        self._next = next(self._points, None)
+        self._last = -np.inf
+
+    @property
+    def start(self):
+        """
+        Timestamp of the first row, until the signal has moved past it.
+        """
+        return self._previous.timestamp
+
+    def finished(self, t):
+        """
+        True when t is after the last row of the player.
+        """
+        self._advance(t)
+        return self._next is None and t > self._previous.timestamp
+
+    def at(self, t):
+        """
+        Return the value at time t, t may not go back in time.
+        """
+        fraction = self._fraction(t)
+        if fraction is None:
+            return self._previous.value
+        return self._previous.value + fraction * (self._next.value - self._previous.value)
+
+    def angle(self, t):
+        """
+        Return the angle in degrees at time t, None while the value is real.
+        """
+        fraction = self._fraction(t)
+        previous = self._previous.angle
+        if fraction is None or previous is None or self._next.angle is None:
+            return previous
+        turn = (self._next.angle - previous + 180.0) % 360.0 - 180.0
+        return (previous + fraction * turn + 180.0) % 360.0 - 180.0
+
+    def _fraction(self, t):
+        """
+        Return how far t is from the previous row to the next, None when the previous row holds.
+        """
+        self._advance(t)
+        previous, following = self._previous, self._next
+        if following is None or t <= previous.timestamp or self._interpolation == 'hold':
+            return None
+        return (t - previous.timestamp) / (following.timestamp - previous.timestamp)
+
+    def _advance(self, t):
+        if t < self._last:
+            raise ValueError(f"Time {t} is before {self._last}, a player signal only moves forward")
+        self._last = t
+        while self._next is not None and self._next.timestamp <= t:
+            self._previous = self._next
+            self._next = next(self._points, None)
+
+
+class PlayerFeeder(object):
+    def __init__(self, players, measurements=1000, scale=1.0, scale_spread=0.05, angle_fraction=0.75,
+                 interpolation='linear', seed=0, start=None, simulation_id="player"):
+        """
+        Generate `simulation_output` shaped messages for measurements mrids driven by GridLAB-D
+        player files, the same interface as `SyntheticFeeder`.
+
+        The mrids are spread over the players in turn and each scales its player by scale
+        times its own factor drawn from [1 - scale_spread, 1 + scale_spread], so the values
+        follow a realistic load shape and are reproducible for a seed.  A fraction of the
+        measurements carry an angle, the angle of a complex player or else the angle of
+        their phase, 0, -120 and 120 degrees for the first, second and third player.
+
+        :param players: Player file paths, or iterables of `PlayerPoint`.
+        :param measurements: Number of measurement mrids in the feeder.
+        :param scale: Factor applied to every player value.
+        :param scale_spread: Relative spread of the factor of each mrid.
+        :param angle_fraction: Fraction of the measurements that carry an angle.
+        :param interpolation: One of `INTERPOLATIONS`.
+        :param seed: Seed for the scales and angles of the measurements.
+        :param start: Timestamp of the first message, the start of the first player by default.
+        :param simulation_id: Simulation id placed in each message.
+        """
+        if not players:
+            raise ValueError("At least one player is needed")
+        self._signals = [PlayerSignal(read_player(p) if isinstance(p, (str, os.PathLike)) else p, interpolation)
+                         for p in players]
+        rng = np.random.default_rng(seed)
+        self._mrids = [f"_player-{index:08d}" for index in range(measurements)]
+        self._player = np.arange(measurements) % len(self._signals)
+        self._scale = scale * rng.uniform(1.0 - scale_spread, 1.0 + scale_spread, measurements)
+        self._angle = rng.uniform(0, 1, measurements) < angle_fraction
+        self._phase_angle = np.array([0.0, -120.0, 120.0])[self._player % 3]
+        self._start = int(self._signals[0].start if start is None else start)
+        self._simulation_id = simulation_id
+
+    def __len__(self):
+        return len(self._mrids)
+
+    @property
+    def mrids(self):
+        return self._mrids
+
+    @property
+    def start(self):
+        return self._start
+
+    def finished(self, t):
+        """
+        True when t is after the last row of every player.
+        """
+        return all(signal.finished(t) for signal in self._signals)
+
+    def message(self, t):
+        """
+        Build a new message for timestamp t, t may not go back in time.
+        """
+        values = np.array([signal.at(t) for signal in self._signals])
+        magnitude = (values[self._player] * self._scale).tolist()
+        angles = [signal.angle(t) for signal in self._signals]
+        if any(value is not None for value in angles):
+            player_angle = np.array([np.nan if value is None else value for value in angles])[self._player]
+            angle = np.where(np.isnan(player_angle), self._phase_angle, player_angle).tolist()
+        else:
+            angle = self._phase_angle.tolist()
+        has_angle = self._angle.tolist()
+
+        measurements = {}
+        for index, mrid in enumerate(self._mrids):
+            if has_angle[index]:
+                measurements[mrid] = {"measurement_mrid": mrid, "magnitude": magnitude[index],
+                                      "angle": angle[index]}
+            else:
+                measurements[mrid] = {"measurement_mrid": mrid, "magnitude": magnitude[index]}
+        return {"simulation_id": self._simulation_id,
+                "message": {"timestamp": t, "measurements": measurements}}
+
+    def messages(self, timesteps=None, step=1):
+        """
+        Generate a message every step seconds from the start, timesteps messages or until
+        every player has finished.
+        """
+        for index in itertools.count() if timesteps is None else range(timesteps):
+            t = self._start + index * step
+            if timesteps is None and self.finished(t):
+                break
+            yield self.message(t)
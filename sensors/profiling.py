@@ -0,0 +1,234 @@
+from collections import Counter
+import cProfile
+import io
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+
+_log = logging.getLogger(__file__)
+
+PROFILER_MODES = ('cprofile', 'sampling')
+
+DEFAULT_PROFILING_CONFIG = {
+    'directory': '/tmp/gridappsd_tmp/{simulation_id}',
+    'mode': 'cprofile',
+    'messages': 0,
+    'seconds': 0,
+    'interval': 0.005
+}
+
+
+class MessageProfiler(object):
+    def __init__(self, simulation_id, config: dict = None):
+        """
+        Profile the processing of messages on demand.
+
+        A profile runs for a number of messages and/or seconds, whichever comes first, and
+        is then written to the directory.  It is started by `start`, either from the
+        user options when the sensors are created or at any time from the command topic.
+
+            cprofile - deterministic profile of every call, written as profile-<time>-<n>.prof
+                       (load with pstats or snakeviz) and a .txt summary.
+            sampling - samples the stack of the processing thread every interval seconds and
+                       writes the counts as collapsed stacks in profile-<time>-<n>.folded, ready
+                       for flamegraph.pl or speedscope.  Much lower overhead on large feeders.
+
+        The config dictionary has the following structure:
+            {
+                "mode": "cprofile",
+                "messages": 100,
+                "seconds": 0,
+                "interval": 0.005,
+                "directory": "/tmp/gridappsd_tmp/{simulation_id}"
+            }
+
+        :param simulation_id: Simulation being profiled, substituted into the directory.
+        :param config: Profiling configuration from the user options, a profile is started
+            right away when messages or seconds is set.
+        """
+        settings = dict(DEFAULT_PROFILING_CONFIG)
+        settings.update(config or {})
+        self._directory = settings['directory'].format(simulation_id=simulation_id)
+        self._defaults = settings
+        # Guards the requests from other threads against the message thread, which is the
+        # only one that switches the profiler on and off while messages are processed.
+        self._lock = threading.Lock()
+        self._active = False
+        self._busy = False
+        self._pending = None
+        self._mode = None
+        self._remaining = 0
+        self._timer = None
+        self._profile = None
+        self._samples = None
+        self._sampler = None
+        self._sampling = None
+        self._thread_id = None
+        self._in_message = False
+        self._written = 0
+
+        if settings['messages'] or settings['seconds']:
+            self.start()
+
+    @property
+    def active(self):
+        return self._active
+
+    @property
+    def directory(self):
+        return self._directory
+
+    def start(self, messages=None, seconds=None, mode=None, interval=None):
+        """
+        Profile the messages after this call, parameters that are not given use the
+        configured values.  The profile starts with the next message, a profile that is
+        already running is written out first.
+        """
+        messages = int(self._defaults['messages'] if messages is None else messages)
+        seconds = float(self._defaults['seconds'] if seconds is None else seconds)
+        mode = self._defaults['mode'] if mode is None else mode
+        interval = float(self._defaults['interval'] if interval is None else interval)
+        if mode not in PROFILER_MODES:
+            raise ValueError(f"Invalid profiler mode {mode}, expected one of {PROFILER_MODES}")
+        if messages <= 0 and seconds <= 0:
+            messages = 1
+        with self._lock:
+            self._pending = ('start', (messages, seconds, mode, interval))
+
+    def call(self, function, *args):
+        """
+        Run function, profiling it when a profile is active.  Requested starts and stops are
+        carried out before and a profile is finished after function once its message count or
+        time is reached.
+        """
+        if not self._active and self._pending is None:
+            return function(*args)
+
+        with self._lock:
+            request, self._pending = self._pending, None
+            finished = self._take() if request is not None else None
+            if request is not None and request[0] == 'start':
+                self._begin(*request[1])
+            self._busy = True
+        if finished is not None:
+            self._write(*finished)
+
+        try:
+            profile = self._profile
+            if profile is not None:
+                profile.enable()
+                try:
+                    return function(*args)
+                finally:
+                    profile.disable()
+            if self._active:
+                self._thread_id = threading.get_ident()
+                self._in_message = True
+            try:
+                return function(*args)
+            finally:
+                self._in_message = False
+        finally:
+            with self._lock:
+                self._busy = False
+                if self._active and self._remaining is not None:
+                    self._remaining -= 1
+                done = self._pending == ('stop', None) or (self._remaining is not None and self._remaining <= 0)
+                finished = None
+                if done:
+                    if self._pending == ('stop', None):
+                        self._pending = None
+                    finished = self._take()
+            if finished is not None:
+                self._write(*finished)
+
+    def stop(self):
+        """
+        Finish the active profile and write it to the directory.  While a message is being
+        processed the profile is finished once it is done, by the thread processing it.
+
+        :return: Path of the profile written, None when none was written by this call.
+        """
+        with self._lock:
+            if self._busy:
+                if self._active:
+                    self._pending = ('stop', None)
+                return None
+            self._pending = None
+            finished = self._take()
+        return None if finished is None else self._write(*finished)
+
+    def _begin(self, messages, seconds, mode, interval):
+        # Called with the lock held.
+        self._mode = mode
+        self._remaining = messages if messages > 0 else None
+        if mode == 'cprofile':
+            self._profile = cProfile.Profile()
+        else:
+            self._samples = Counter()
+            self._sampling = threading.Event()
+            self._sampler = threading.Thread(target=self._sample, args=(interval, self._samples, self._sampling),
+                                             name="sensor-profiler", daemon=True)
+            self._sampler.start()
+        if seconds > 0:
+            # An idle simulation gets its profile written when the time is up as well.
+            self._timer = threading.Timer(seconds, self._expire, args=(self._sampler or self._profile,))
+            self._timer.daemon = True
+            self._timer.start()
+        self._active = True
+        _log.info(f"Profiling ({mode}) for {messages or 'unlimited'} messages and {seconds or 'unlimited'} seconds")
+
+    def _take(self):
+        # Called with the lock held, detach the active profile so it can be written.
+        if not self._active:
+            return None
+        self._active = False
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        profile, self._profile = self._profile, None
+        samples, sampler, sampling = self._samples, self._sampler, self._sampling
+        self._samples = self._sampler = self._sampling = None
+        if sampling is not None:
+            sampling.set()
+        return profile, samples, sampler
+
+    def _expire(self, owner):
+        if owner is self._profile or owner is self._sampler:
+            self.stop()
+
+    def _write(self, profile, samples, sampler):
+        os.makedirs(self._directory, exist_ok=True)
+        self._written += 1
+        base = os.path.join(self._directory, time.strftime(f"profile-%Y%m%d-%H%M%S-{self._written}"))
+        if profile is not None:
+            path = f"{base}.prof"
+            profile.dump_stats(path)
+            summary = io.StringIO()
+            pstats.Stats(profile, stream=summary).sort_stats('cumulative').print_stats(50)
+            with open(f"{base}.txt", 'w') as fp:
+                fp.write(summary.getvalue())
+        else:
+            sampler.join()
+            path = f"{base}.folded"
+            with open(path, 'w') as fp:
+                for stack, count in samples.most_common():
+                    fp.write(f"{stack} {count}\n")
+        _log.info(f"Wrote profile to {path}")
+        return path
+
+    def _sample(self, interval, samples, stopped):
+        while not stopped.wait(interval):
+            if not self._in_message:
+                continue
+            frame = sys._current_frames().get(self._thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                samples[';'.join(reversed(stack))] += 1
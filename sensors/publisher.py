@@ -0,0 +1,247 @@
+import json
+import logging
+import math
+
+_log = logging.getLogger(__file__)
+
+DEFAULT_PUBLISHING_CONFIG = {
+    'max-measurements': 0,
+    'max-bytes': 0,
+    'coalesce-timesteps': 1,
+    'coalesce-seconds': 0
+}
+
+# Bytes set aside in each frame for everything around the messages.
+_HEADER_RESERVE = 128
+# Measurements serialized to estimate the size of a large part and the fraction of the
+# budget the estimate aims for.
+_SAMPLE_SIZE = 256
+_HEADROOM = 0.9
+
+
+class FramePublisher(object):
+    def __init__(self, gridappsd, topic, simulation_id, config: dict = None):
+        """
+        Publish the sensor output, optionally split into bounded frames and coalesced over
+        several timesteps.
+
+        Without any option set every message is sent as is.  Otherwise the pending timesteps
+        are published as one or more frames of the following structure, where the frames
+        of one sequence together hold every measurement of the coalesced timesteps:
+            {
+                "simulation_id": "12345",
+                "sequence": 7,
+                "part": 0,
+                "parts": 3,
+                "messages": [
+                    {"timestamp": 1570041113, "measurements": {...}},
+                    {"timestamp": 1570041114, "measurements": {...}}
+                ]
+            }
+
+        A timestep may be spread over several parts, `FrameAssembler` merges the parts of
+        a sequence back into simulation output messages.
+
+        The config dictionary has the following structure:
+            {
+                "max-measurements": 0,
+                "max-bytes": 0,
+                "coalesce-timesteps": 1,
+                "coalesce-seconds": 0
+            }
+
+            max-measurements   - Most measurements in a frame, 0 for no limit.
+            max-bytes          - Largest serialized frame, 0 for no limit.  A single measurement
+                                 larger than the limit is still sent in a frame of its own.
+            coalesce-timesteps - Timesteps collected before they are published, 0 for no limit.
+            coalesce-seconds   - Simulation seconds the first pending timestep may wait before
+                                 publishing, 0 for no limit.
+
+        :param gridappsd: Connection the frames are sent with.
+        :param topic: Topic the frames are sent to.
+        :param simulation_id: Simulation id placed in every frame.
+        :param config: Publishing configuration from the user options.
+        """
+        settings = dict(DEFAULT_PUBLISHING_CONFIG)
+        settings.update(config or {})
+        self._gappsd = gridappsd
+        self._topic = topic
+        self._header = json.dumps(simulation_id)
+        self._max_measurements = int(settings['max-measurements'])
+        self._max_bytes = int(settings['max-bytes'])
+        self._coalesce_timesteps = int(settings['coalesce-timesteps'])
+        self._coalesce_seconds = float(settings['coalesce-seconds'])
+        if self._coalesce_timesteps <= 0 and self._coalesce_seconds <= 0:
+            self._coalesce_timesteps = 1
+        self._framed = bool(self._max_measurements > 0 or self._max_bytes > 0 or self._coalesce_timesteps != 1)
+        self._pending = []
+        self._sequence = 0
+        self._frames = 0
+
+        if self._framed:
+            _log.info(f"Publishing frames of at most {self._max_measurements} measurements and {self._max_bytes} "
+                      f"bytes, coalescing {self._coalesce_timesteps} timesteps or {self._coalesce_seconds} seconds")
+
+    @property
+    def framed(self):
+        return self._framed
+
+    @property
+    def frames(self):
+        """
+        Number of frames (or messages when not framed) sent.
+        """
+        return self._frames
+
+    def state(self, message=None):
+        """
+        The sequence number and pending timesteps, JSON serializable, see `restore`.
+
+        :param message: Optional message about to be published, the state is the one the
+            publisher will have after publishing it.
+        """
+        if message is None or not self._framed:
+            return {'sequence': self._sequence, 'pending': self._pending}
+        pending = self._pending + [_pending_entry(message)]
+        if self._due(pending):
+            return {'sequence': self._sequence + 1, 'pending': []}
+        return {'sequence': self._sequence, 'pending': pending}
+
+    def restore(self, state):
+        """
+        Continue from a `state`, so the frames are numbered and grouped as if the publisher
+        had never stopped.
+        """
+        self._sequence = state['sequence']
+        self._pending = [(timestamp, [tuple(item) for item in items]) for timestamp, items in state['pending']]
+
+    def publish(self, message):
+        """
+        Publish a sensor output message, or hold it until enough timesteps are pending.
+
+        :param message: Simulation output message with the sensor measurements.
+        """
+        if not self._framed:
+            self._gappsd.send(self._topic, message)
+            self._frames += 1
+            return
+
+        self._pending.append(_pending_entry(message))
+        if self._due(self._pending):
+            self.flush()
+
+    def _due(self, pending):
+        return 0 < self._coalesce_timesteps <= len(pending) or \
+            0 < self._coalesce_seconds <= pending[-1][0] - pending[0][0]
+
+    def flush(self):
+        """
+        Publish the pending timesteps as the frames of a new sequence.
+        """
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+
+        parts = _chunk(pending, self._max_measurements) if self._max_measurements > 0 else [pending]
+        if self._max_bytes > 0:
+            budget = max(1, self._max_bytes - _HEADER_RESERVE - len(self._header))
+            bodies = [body for part in parts for body in self._encode_bounded(part, budget)]
+        else:
+            bodies = [_encode(part) for part in parts]
+
+        for index, body in enumerate(bodies):
+            self._gappsd.send(self._topic, f'{{"simulation_id": {self._header}, "sequence": {self._sequence}, '
+                                           f'"part": {index}, "parts": {len(bodies)}, "messages": {body}}}')
+        self._frames += len(bodies)
+        self._sequence += 1
+
+    def _encode_bounded(self, part, budget):
+        """
+        Serialize a part, splitting it evenly until every piece fits within budget bytes.
+
+        Large parts are split up front from the size of a sample of their measurements so
+        that most measurements are only serialized once.
+        """
+        count = sum(len(items) for _, items in part)
+        if count > _SAMPLE_SIZE:
+            sample = _chunk(part, _SAMPLE_SIZE)[0]
+            estimate = len(_encode(sample)) * count / _SAMPLE_SIZE
+            if estimate > budget:
+                limit = max(1, int(count * budget * _HEADROOM / estimate))
+                return [body for piece in _chunk(part, limit) for body in self._encode_split(piece, budget)]
+        return self._encode_split(part, budget)
+
+    def _encode_split(self, part, budget):
+        body = _encode(part)
+        count = sum(len(items) for _, items in part)
+        if len(body) <= budget or count == 1:
+            if len(body) > budget:
+                _log.warning(f"A single measurement of {len(body)} bytes exceeds max-bytes")
+            return [body]
+        pieces = min(count, max(2, math.ceil(len(body) / budget)))
+        return [body for piece in _chunk(part, math.ceil(count / pieces))
+                for body in self._encode_split(piece, budget)]
+
+
+class FrameAssembler(object):
+    def __init__(self):
+        """
+        Rebuild simulation output messages from the frames published by a `FramePublisher`.
+        """
+        self._parts = {}
+
+    def add(self, frame):
+        """
+        Add a decoded frame.
+
+        :return: The messages of the frame's sequence, in timestamp order, once every part
+            of the sequence has been added, otherwise an empty list.
+        """
+        if isinstance(frame, str):
+            frame = json.loads(frame)
+        key = (frame['simulation_id'], frame['sequence'])
+        parts = self._parts.setdefault(key, {})
+        parts[frame['part']] = frame['messages']
+        if len(parts) < frame['parts']:
+            return []
+        del self._parts[key]
+
+        measurements = {}
+        for index in sorted(parts):
+            for message in parts[index]:
+                measurements.setdefault(message['timestamp'], {}).update(message['measurements'])
+        return [{"simulation_id": frame['simulation_id'],
+                 "message": {"timestamp": timestamp, "measurements": measurements[timestamp]}}
+                for timestamp in sorted(measurements)]
+
+
+def _pending_entry(message):
+    body = message['message']
+    return body['timestamp'], list(body['measurements'].items())
+
+
+def _chunk(part, limit):
+    """
+    Split a list of (timestamp, items) into lists holding at most limit items each.
+    """
+    chunks = []
+    current = []
+    size = 0
+    for timestamp, items in part:
+        start = 0
+        while start < len(items):
+            take = min(limit - size, len(items) - start)
+            current.append((timestamp, items[start:start + take]))
+            size += take
+            start += take
+            if size >= limit:
+                chunks.append(current)
+                current = []
+                size = 0
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _encode(part):
+    return json.dumps([{"timestamp": timestamp, "measurements": dict(items)} for timestamp, items in part])
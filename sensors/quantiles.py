@@ -0,0 +1,119 @@
+import numpy as np
+
+# Quantiles estimated by the sketch.
+PERCENTILES = (0.05, 0.95)
+
+# Quantiles tracked by the markers of the extended P-square algorithm, the minimum and maximum,
+# each percentile and the midpoints on either side of them.
+MARKER_QUANTILES = np.array([0.0, PERCENTILES[0] / 2, PERCENTILES[0], (PERCENTILES[0] + PERCENTILES[1]) / 2,
+                             PERCENTILES[1], (1.0 + PERCENTILES[1]) / 2, 1.0])
+MARKERS = len(MARKER_QUANTILES)
+
+
+def reset(heights, values):
+    """
+    Start new sketches holding a single value each.
+
+    The sketches are stored marker major, column j of heights and positions is sketch j, so
+    that each step of the update works on contiguous rows.
+
+    :param heights: (MARKERS, n) array of marker heights, updated in place.
+    :param values: (n,) array of the first value of each sketch.
+    """
+    heights[0] = values
+
+
+def insert(heights, positions, values, counts):
+    """
+    Add one value to each of many independent P-square quantile sketches.
+
+    Each sketch holds MARKERS heights and positions, a constant amount of memory however
+    many values it sees (Jain and Chlamtac, "The P2 algorithm for dynamic calculation of
+    quantiles and histograms without storing observations", 1985).  Until a sketch has seen
+    MARKERS values the heights simply hold the values and the positions are not used.
+
+    :param heights: (MARKERS, n) array of marker heights, updated in place.
+    :param positions: (MARKERS, n) array of marker positions, updated in place.
+    :param values: (n,) array of the values to add.
+    :param counts: (n,) array of the number of values in each sketch including the new one.
+    """
+    filling = counts <= MARKERS
+    x = values
+    seen = counts - 1.0
+    if filling.any():
+        if filling.all():
+            _fill(heights, positions, values, counts, np.flatnonzero(filling))
+            return
+        # A NaN value and count leave the markers of the sketches that are still filling as they are.
+        x = np.where(filling, np.nan, values)
+        seen[filling] = np.nan
+
+    q = heights
+    pos = positions
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # Cell k holds x, the extreme markers move out to include it.
+        k = (q[1] <= x).astype(np.int8)
+        for i in range(2, MARKERS - 1):
+            k += q[i] <= x
+        np.fmin(q[0], x, out=q[0])
+        np.fmax(q[-1], x, out=q[-1])
+        pos[1:] += k < np.arange(1, MARKERS)[:, np.newaxis]
+
+        for i in range(1, MARKERS - 1):
+            delta = MARKER_QUANTILES[i] * seen + 1.0 - pos[i]
+            move = np.flatnonzero(((delta >= 1.0) & (pos[i + 1] - pos[i] > 1.0)) |
+                                  ((delta <= -1.0) & (pos[i - 1] - pos[i] < -1.0)))
+            if not len(move):
+                continue
+            d = np.sign(delta[move])
+            qm, qi, qp = q[i - 1, move], q[i, move], q[i + 1, move]
+            nm, ni, np_ = pos[i - 1, move], pos[i, move], pos[i + 1, move]
+            parabolic = qi + d / (np_ - nm) * ((ni - nm + d) * (qp - qi) / (np_ - ni) +
+                                               (np_ - ni - d) * (qi - qm) / (ni - nm))
+            linear = qi + d * np.where(d > 0, (qp - qi) / (np_ - ni), (qm - qi) / (nm - ni))
+            q[i, move] = np.where((qm < parabolic) & (parabolic < qp), parabolic, linear)
+            pos[i, move] = ni + d
+
+    if x is not values:
+        _fill(heights, positions, values, counts, np.flatnonzero(filling))
+
+
+def _fill(heights, positions, values, counts, columns):
+    n = counts[columns]
+    heights[n - 1, columns] = values[columns]
+    full = columns[n == MARKERS]
+    if len(full):
+        heights[:, full] = np.sort(heights[:, full], axis=0)
+        positions[:, full] = np.arange(1, MARKERS + 1)[:, np.newaxis]
+
+
+def estimate(heights, positions, counts):
+    """
+    Return the estimate of each of the PERCENTILES for every sketch.
+
+    The estimate interpolates between the markers on either side of the percentile's
+    position, which is exact until a sketch has seen more than MARKERS values.
+
+    :param heights: (MARKERS, n) array of marker heights.
+    :param positions: (MARKERS, n) array of marker positions.
+    :param counts: (n,) array of the number of values in each sketch.
+    :return: (len(PERCENTILES), n) array of the estimates.
+    """
+    counts = np.maximum(counts, 1)
+    filling = counts < MARKERS
+    if filling.any():
+        ranks = np.arange(MARKERS)[:, np.newaxis]
+        heights = np.where(filling, np.sort(np.where(ranks < counts, heights, np.inf), axis=0), heights)
+        positions = np.where(filling, ranks + 1.0, positions)
+    columns = np.arange(len(counts))
+    result = np.empty((len(PERCENTILES), len(counts)))
+    for index, percentile in enumerate(PERCENTILES):
+        desired = 1.0 + (counts - 1) * percentile
+        low = np.clip((positions <= desired).sum(axis=0) - 1, 0, MARKERS - 2)
+        high = np.where(filling, np.minimum(low + 1, counts - 1), low + 1)
+        span = positions[high, columns] - positions[low, columns]
+        fraction = np.divide(desired - positions[low, columns], span, out=np.zeros(len(counts)), where=span > 0)
+        lower = heights[low, columns]
+        with np.errstate(invalid='ignore'):
+            result[index] = lower + fraction * (heights[high, columns] - lower)
+    return result
@@ -0,0 +1,63 @@
+from collections import namedtuple
+import json
+import logging
+import time
+
+from .sensor import Sensors
+from .sinks import open_text
+
+_log = logging.getLogger(__file__)
+
+REPLAY_READ_TOPIC = "replay.simulation.output"
+REPLAY_WRITE_TOPIC = "replay.simulation.sensors"
+
+ReplayStats = namedtuple('ReplayStats', ['messages', 'published', 'seconds'])
+
+
+def read_lines(path):
+    """
+    Generate the non empty lines of a JSONL capture (the format of the measurement-in
+    diagnostics) one at a time so that captures of any size use constant memory.
+
+    :param path: Capture file, compressed when it ends in .gz.
+    """
+    with open_text(path) as fp:
+        for line in fp:
+            if line.strip():
+                yield line
+
+
+def read_messages(path):
+    """
+    Generate the decoded messages of a JSONL capture one at a time.
+
+    :param path: Capture file, compressed when it ends in .gz.
+    """
+    for line in read_lines(path):
+        yield json.loads(line)
+
+
+def replay(messages, sink, user_options, simulation_id="replay", progress=0):
+    """
+    Run messages through a `Sensors` instance as fast as possible.
+
+    :param messages: Iterable of simulation output messages.
+    :param sink: Object with `send(topic, message)` and `get_logger()` receiving the output.
+    :param user_options: The sensor simulator user options.
+    :param simulation_id: Simulation id used for diagnostics output paths.
+    :param progress: Log the rate every progress messages, 0 disables progress logging.
+    :return: A `ReplayStats`.
+    """
+    sensors = Sensors(sink, REPLAY_READ_TOPIC, REPLAY_WRITE_TOPIC, user_options, simulation_id=simulation_id)
+    sent_before = getattr(sink, 'sent', 0)
+    count = 0
+    start = time.perf_counter()
+    try:
+        for message in messages:
+            sensors.on_simulation_message({}, message)
+            count += 1
+            if progress and count % progress == 0:
+                _log.info(f"Replayed {count} messages ({count / (time.perf_counter() - start):.1f} msg/s)")
+    finally:
+        sensors.close()
+    return ReplayStats(count, getattr(sink, 'sent', 0) - sent_before, time.perf_counter() - start)
@@ -0,0 +1,156 @@
+from fnmatch import translate
+import logging
+import re
+
+_log = logging.getLogger(__file__)
+
+# Keys of a sensor configuration that are passed on to the sensor itself.
+SENSOR_PARAMETERS = ('normal-value', 'aggregation-interval', 'perunit-drop-rate', 'perunit-confidence-band',
+                     'output-mode', 'deadband', 'perunit-deadband', 'max-silence-interval', 'statistics')
+
+
+class SensorRule(object):
+    def __init__(self, config: dict, rank):
+        """
+        A rule selecting the measurements a sensor configuration applies to.
+
+        Every condition given in the rule must match:
+
+            all              - true to match every measurement
+            prefix           - mrid prefix, or a list of prefixes
+            pattern          - shell style mrid pattern (e.g. "_0031*"), or a list of patterns
+            measurement-type - measurement type from the model (e.g. "PNV", "VA", "A"), or a list of types
+            phase            - phase letter that must be in the measurement's phases, or a list of letters
+            exclude          - true to keep the matched measurements from becoming sensors
+
+        The remaining keys are the sensor parameters (normal-value, aggregation-interval,
+        perunit-drop-rate, perunit-confidence-band, output-mode, deadband, perunit-deadband,
+        max-silence-interval and statistics).
+
+        :param config: The rule from the sensor-rules user option.
+        :param rank: Position of the rule in precedence order, lower wins.
+        """
+        self._rank = rank
+        self._all = bool(config.get('all', False))
+        self._prefixes = tuple(_as_list(config.get('prefix')))
+        patterns = _as_list(config.get('pattern'))
+        self._pattern = re.compile('|'.join(translate(p) for p in patterns)) if patterns else None
+        self._types = frozenset(_as_list(config.get('measurement-type')))
+        self._phases = tuple(_as_list(config.get('phase')))
+        self._exclude = bool(config.get('exclude', False))
+        self._parameters = {k: v for k, v in config.items() if k in SENSOR_PARAMETERS}
+
+        if not (self._all or self._prefixes or self._pattern or self._types or self._phases):
+            raise ValueError(f"Sensor rule {config} has no condition, use \"all\": true to match everything")
+
+    def __repr__(self):
+        return f"<SensorRule(rank={self._rank}, prefixes={self._prefixes}, types={sorted(self._types)})>"
+
+    @property
+    def rank(self):
+        return self._rank
+
+    @property
+    def prefixes(self):
+        return self._prefixes
+
+    @property
+    def exclude(self):
+        return self._exclude
+
+    @property
+    def parameters(self):
+        return self._parameters
+
+    @property
+    def needs_info(self):
+        return bool(self._types or self._phases)
+
+    def matches(self, mrid, info=None):
+        if self._prefixes and not mrid.startswith(self._prefixes):
+            return False
+        if self._pattern is not None and not self._pattern.match(mrid):
+            return False
+        if self._types or self._phases:
+            if not info:
+                return False
+            if self._types and info.get('type') not in self._types:
+                return False
+            if self._phases and not any(phase in (info.get('phases') or '') for phase in self._phases):
+                return False
+        return True
+
+
+class SensorRules(object):
+    def __init__(self, sensors_config: dict = None, rules: list = None):
+        """
+        An index resolving a measurement mrid to the configuration of its sensor.
+
+        Explicitly configured mrids (sensors-config) take precedence over every rule.  The
+        rules then apply in order of descending "priority" (default 0) and then the order
+        they are listed in, the first matching rule wins.  Rules with a prefix are indexed
+        by prefix so only the rules that can match an mrid are evaluated.
+
+        :param sensors_config: Mapping of mrid to sensor parameters.
+        :param rules: List of rule dictionaries, see `SensorRule`.
+        """
+        self._exact = dict(sensors_config or {})
+        ordered = sorted(enumerate(rules or []), key=lambda item: (-item[1].get('priority', 0), item[0]))
+        self._rules = [SensorRule(config, rank) for rank, (_, config) in enumerate(ordered)]
+
+        # prefix -> ranks of the rules requiring it, and the ranks of the rules without a prefix
+        self._by_prefix = {}
+        self._unindexed = []
+        for rule in self._rules:
+            if rule.prefixes:
+                for prefix in rule.prefixes:
+                    self._by_prefix.setdefault(prefix, []).append(rule.rank)
+            else:
+                self._unindexed.append(rule.rank)
+        self._prefix_lengths = sorted({len(prefix) for prefix in self._by_prefix})
+
+    def __len__(self):
+        return len(self._exact) + len(self._rules)
+
+    @property
+    def exact(self):
+        return self._exact
+
+    @property
+    def needs_info(self):
+        """
+        True when a rule selects measurements by type or phase from the model.
+        """
+        return any(rule.needs_info for rule in self._rules)
+
+    def match(self, mrid, info=None):
+        """
+        Return the sensor parameters for mrid or None when it is not a sensor.
+
+        :param mrid: The measurement mrid.
+        :param info: Optional model information about the measurement ({"type": ..., "phases": ...}).
+        """
+        parameters = self._exact.get(mrid)
+        if parameters is not None:
+            return parameters
+
+        candidates = self._unindexed
+        if self._prefix_lengths:
+            candidates = list(candidates)
+            for length in self._prefix_lengths:
+                candidates.extend(self._by_prefix.get(mrid[:length], ()))
+            candidates.sort()
+
+        for rank in candidates:
+            rule = self._rules[rank]
+            if rule.matches(mrid, info):
+                return None if rule.exclude else rule.parameters
+        return None
+
+
+def _as_list(value):
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple, set)):
+        return list(value)
+    return [value]
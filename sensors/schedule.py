@@ -0,0 +1,72 @@
+import heapq
+
+import numpy as np
+
+
+class TimingWheel(object):
+    def __init__(self, resolution=1.0):
+        """
+        An index of sensor rows by deadline, bucketed into slots of resolution seconds.
+
+        Only the slots that hold rows exist, their numbers are kept in a heap so finding the
+        due slots does not depend on how far apart the deadlines are.  Scheduling and taking
+        the due rows cost in proportion to the number of rows involved, not to the number of
+        rows in the wheel.
+
+        :param resolution: Width of a slot in seconds.
+        """
+        self._resolution = float(resolution)
+        self._slots = {}
+        self._heap = []
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def __repr__(self):
+        return f"<TimingWheel(rows={self._size}, slots={len(self._slots)})>"
+
+    def schedule(self, rows, deadlines):
+        """
+        Add rows to the slots of their deadlines.
+
+        :param rows: Integer array of rows.
+        :param deadlines: Array of the time each row is due, or a single time for all of them.
+        """
+        if not len(rows):
+            return
+        slots = np.floor(np.asarray(deadlines, dtype=np.float64) / self._resolution).astype(np.int64)
+        if slots.ndim == 0 or (slots == slots[0]).all():
+            self._add(int(slots.flat[0]), rows)
+        else:
+            order = np.argsort(slots, kind='stable')
+            slots = slots[order]
+            rows = rows[order]
+            bounds = np.flatnonzero(np.diff(slots)) + 1
+            for slot, chunk in zip(slots[np.concatenate(([0], bounds))], np.split(rows, bounds)):
+                self._add(int(slot), chunk)
+        self._size += len(rows)
+
+    def pop_due(self, t):
+        """
+        Remove and return the rows in every slot up to and including the slot of time t.
+
+        The rows are sorted and unique.  They may be due later in t's own slot, callers
+        check the exact deadline and schedule the rows that are not due again.
+        """
+        limit = int(np.floor(t / self._resolution))
+        chunks = []
+        while self._heap and self._heap[0] <= limit:
+            chunks.extend(self._slots.pop(heapq.heappop(self._heap)))
+        if not chunks:
+            return np.zeros(0, dtype=np.int64)
+        rows = np.concatenate(chunks)
+        self._size -= len(rows)
+        return np.unique(rows)
+
+    def _add(self, slot, rows):
+        chunks = self._slots.get(slot)
+        if chunks is None:
+            self._slots[slot] = chunks = []
+            heapq.heappush(self._heap, slot)
+        chunks.append(rows)
@@ -1,21 +1,120 @@
-from copy import deepcopy
 import json
 import logging
 import random
+import threading
 import time
 
+import numpy as np
+
+from .bank import SensorBank
+from .checkpoint import DEFAULT_CHECKPOINT_CONFIG, read_checkpoint, write_checkpoint
+from .diagnostics import DiagnosticsWriter
+from .logs import DEFAULT_LOG_INTERVAL, RateLimitedLog
+from .metrics import DEFAULT_METRICS_CONFIG, SensorMetrics, start_http_server
+from .pipeline import MessagePipeline
+from .plan import MeasurementPlan
+from .profiling import MessageProfiler
+from .publisher import FramePublisher
+from .rules import SensorRules
+from .streams import RandomStreams, STAGGER, DROP, NOISE, mrid_keys
+
 _log = logging.getLogger(__file__)
 
+# processStatus values on the simulation log topic that end a simulation.  Every app logs on
+# that topic, so an ERROR from any of them does not end the simulation.
+SIMULATION_FINISHED_STATUSES = ('COMPLETE', 'CLOSED', 'STOPPED')
+
 DEFAULT_SENSOR_CONFIG = {
     "default-perunit-confidence-band": 2,
     "default-aggregation-interval": 30,
     "default-perunit-drop-rate": 0.01,
-    'default-normal-value': 100
+    'default-normal-value': 100,
+    'default-output-mode': 'instantaneous',
+    'default-deadband': 0,
+    'default-perunit-deadband': 0,
+    'default-max-silence-interval': 0,
+    'default-statistics': []
 }
 
+# Values of output-mode, "range" publishes the mean, minimum and maximum of each interval.
+OUTPUT_MODES = ('instantaneous', 'range')
+
+# Values of statistics, the interval statistics a sensor publishes along with its value.
+STATISTICS = ('variance', 'percentiles')
+
+
+def _json_object(message):
+    """
+    Return a message of a status or command topic as a dictionary, None when it is not one.
+    """
+    if isinstance(message, str):
+        try:
+            message = json.loads(message)
+        except ValueError:
+            return None
+    return message if isinstance(message, dict) else None
+
+
+def _format_measurement_list(mrids):
+    return ''.join(f'"{x}": ' + '{},\n' for x in mrids)
+
+
+def _format_measurement_data(record):
+    timestamp, mrids, rows, magnitude, angle = record
+    lines = []
+    for index in rows:
+        lines.append(f"{timestamp} {mrids[index]}, magnitude: {magnitude[index]}\n")
+        if not np.isnan(angle[index]):
+            lines.append(f"{timestamp} {mrids[index]}, angle: {angle[index]}\n")
+    return ''.join(lines)
+
+
+def _format_sensor_data(record):
+    timestamp, mrids, rows, new_magnitude, angle = record
+    lines = []
+    for index, value in zip(rows, new_magnitude):
+        lines.append(f"{timestamp} {mrids[index]}, {value}\n")
+        if not np.isnan(angle[index]):
+            lines.append(f"{timestamp} {mrids[index]}, {angle[index]}\n")
+    return ''.join(lines)
+
+
+def _capture_columns(record):
+    timestamp, mrids, magnitude, angle, present, sample = record
+    rows = np.flatnonzero(present)
+    value = np.full(len(present), np.nan)
+    value[sample.rows[sample.emit]] = sample.magnitude[sample.emit]
+    dropped = np.zeros(len(present), dtype=bool)
+    dropped[sample.rows[sample.dropped]] = True
+    columns = {
+        'timestamp': np.full(len(rows), timestamp, dtype=np.int64),
+        'row': rows.astype(np.int32),
+        'magnitude': magnitude[rows],
+        'angle': angle[rows],
+        'value': value[rows],
+        'dropped': dropped[rows]
+    }
+    return columns, mrids
+
+
+def _check_output_mode(mode):
+    if mode not in OUTPUT_MODES:
+        raise ValueError(f"Invalid output-mode {mode}, expected one of {OUTPUT_MODES}")
+    return mode
+
+
+def _check_statistics(statistics):
+    statistics = [statistics] if isinstance(statistics, str) else list(statistics or [])
+    for statistic in statistics:
+        if statistic not in STATISTICS:
+            raise ValueError(f"Invalid statistic {statistic}, expected one of {STATISTICS}")
+    return statistics
+
 
 class Sensors(object):
-    def __init__(self, gridappsd, read_topic, write_topic, user_options: dict = None):
+    def __init__(self, gridappsd, read_topic, write_topic, user_options: dict = None, simulation_id=None,
+                 log_topic=None, control_topic=None, measurement_info: dict = None, stats_topic=None,
+                 on_complete=None, command_topic=None):
         """
         Create sensors based upon thee user_options dictionary
 
@@ -31,13 +130,50 @@ class Sensors(object):
                     "_0031ff7c-5140-47cf-b750-0146bb3d9024": {},
                     "_00313f7c-5140-47cf-b750-0146bb3d9024": {
                         "normal-value": 35
-                    },
-                    "default-perunit-confidence-band": 0.01,
-                    "default-aggregation-interval": 30,
-                    "default-perunit-drop-rate": 0.01,
-                    "passthrough-if-not-specified": false,
-                    "random-seed": 0,
-                    "log-statistics": false
+                    }
+                },
+                "sensor-rules": [
+                    {"prefix": "_0a", "exclude": true},
+                    {"measurement-type": "PNV", "normal-value": 2400, "aggregation-interval": 15},
+                    {"all": true}
+                ],
+                "default-perunit-confidence-band": 0.01,
+                "default-aggregation-interval": 30,
+                "default-perunit-drop-rate": 0.01,
+                "default-output-mode": "instantaneous",
+                "default-deadband": 0,
+                "default-perunit-deadband": 0.001,
+                "default-max-silence-interval": 300,
+                "default-statistics": ["variance", "percentiles"],
+                "passthrough-if-not-specified": false,
+                "random-seed": 0,
+                "log-statistics": false,
+                "log-interval": 60,
+                "diagnostics": {
+                    "measurement-in": false,
+                    "measurement-out": false
+                },
+                "publishing": {
+                    "max-measurements": 0,
+                    "max-bytes": 1048576,
+                    "coalesce-timesteps": 1
+                },
+                "pipeline": {
+                    "queue-size": 100,
+                    "policy": "block"
+                },
+                "metrics": {
+                    "enabled": true,
+                    "publish-interval": 60,
+                    "port": 0
+                },
+                "profiling": {
+                    "mode": "sampling",
+                    "messages": 100
+                },
+                "checkpoint": {
+                    "interval": 60,
+                    "restore": true
                 }
             }
 
@@ -52,10 +188,51 @@ class Sensors(object):
                                 perunit-confidence-band - Confidence level that the mean value is within this range
                                 aggregation-interval    - Number of samples to collect before emitting a measurement
                                 perunit-drop-rate       - Rate to drop the measurement value
+                                output-mode             - "instantaneous" to publish the noisy mean of each
+                                                          interval or "range" to also publish its minimum and
+                                                          maximum (magnitude_min, magnitude_max, angle_min and
+                                                          angle_max)
+                                deadband                - Absolute change in magnitude a value must exceed
+                                                          to be published (report by exception)
+                                perunit-deadband        - Change a value must exceed to be published, per unit
+                                                          of the normal value
+                                max-silence-interval    - Seconds after which a value inside the deadband is
+                                                          published anyway, 0 for no limit
+                                statistics              - List of interval statistics of the received values
+                                                          to publish with the mean, "variance" (magnitude_variance,
+                                                          angle_variance) and/or "percentiles" (magnitude_p5,
+                                                          magnitude_p95, angle_p5 and angle_p95)
 
-            random-seed - A seed to produce reliable results over different runs of the code base
+            sensor-rules - A list of rules selecting sensors by mrid prefix or pattern, by measurement type or
+                           phase, or all measurements.  Measurements listed in sensor-config take precedence,
+                           then the first matching rule (see `SensorRules`).  Sensors are created when a
+                           matching measurement first appears.
+            random-seed - A seed to produce reliable results over different runs of the code base.  Each
+                          sensor draws from its own counter-based stream keyed by (seed, mrid, timestamp)
+                          so results do not depend on the order or grouping of the sensors.
             passthrough-if-not-specified - Allows measurements of non-specified sensors to be published to the
                                            sensors output topic without modification.
+            log-statistics - Logs the state of every sensor at DEBUG along with the sensor output.
+            log-interval - Seconds between the per message log lines (the sensor output, "No sensor output."
+                           and invalid mrids), the ones in between are counted and not formatted.  0 logs
+                           every message and -1 none.
+            diagnostics - Turns on capturing of the inbound/outbound messages and per sensor values to files.  All
+                          of the streams are off by default, see `DiagnosticsWriter` for the available options.
+            publishing - Splits the output into frames bounded by size or measurement count and coalesces
+                         timesteps, see `FramePublisher`.  By default each timestep is sent as one message.
+            pipeline - Receives messages into a bounded queue processed and published by their own threads
+                       instead of on the message bus thread, see `MessagePipeline`.  Off by default.
+            metrics - Stage timers and counters (see `SensorMetrics`) are always collected.  publish-interval
+                      is the number of seconds between snapshots sent to the stats topic (0 disables them)
+                      and a port above 0 serves them in the Prometheus text format over HTTP.  With enabled
+                      false neither is done.
+            profiling - Profiles the processing of the first messages and writes the result next to the
+                        sensors.log, see `MessageProfiler`.  A profile can also be started at any time with a
+                        {"command": "profile", "messages": 100, "mode": "sampling"} message on the command topic.
+            checkpoint - Writes the state of every sensor to a checkpoint every interval simulation seconds (0 only
+                         on shutdown) under /tmp/gridappsd_tmp/<simulation_id>/checkpoint.  With restore the
+                         sensors resume from the latest checkpoint, skip the messages it already covers and
+                         produce the same output as an uninterrupted run.  Off unless specified.
 
             The following values are used as defaults for each sensor listed in sensor-config but does not specify
             the value for the parameter
@@ -63,6 +240,11 @@ class Sensors(object):
                 default-perunit-confidence-band
                 default-aggregation-interval
                 default-perunit-drop-rate
+                default-output-mode
+                default-deadband
+                default-perunit-deadband
+                default-max-silence-interval
+                default-statistics
 
         :param read_topic:
             The topic to listen for measurement data to come through the bus
@@ -72,19 +254,38 @@ class Sensors(object):
             The main object used to connect to gridappsd
         :param user_options:
             A dictionary of options to specify how the service will run.
+        :param simulation_id:
+            The simulation the sensors belong to.  Defaults to the last segment of the read topic.
+        :param log_topic:
+            Optional simulation log topic, the service stops when the simulation's processStatus
+            reports that it has finished.
+        :param control_topic:
+            Optional simulation input topic, the service stops when a "stop" command is received.
+        :param measurement_info:
+            Optional mapping of mrid to model information ({"type": "PNV", "phases": "A"}) used by
+            sensor-rules that select measurements by type or phase.
+        :param stats_topic:
+            Optional topic the metrics are periodically published to.
+        :param on_complete:
+            Optional callable, called with the simulation id by `simulation_complete`.  It may
+            be called from a signal handler, so it should only hand the id to another thread.
+        :param command_topic:
+            Optional topic owned by the service that "profile" commands are received on, see
+            `on_service_command`.  The simulation input topic belongs to the simulator.
         """
         super(Sensors, self).__init__()
-        if user_options is None:
-            user_options = {}
-        else:
-            user_options = deepcopy(user_options)
+        # Options are popped from a shallow copy, the nested configuration is only read.
+        user_options = dict(user_options or {})
         self._random_seed = user_options.get('random-seed', 0)
-        self._sensors = {}
         self._gappsd = gridappsd
         self._logger = self._gappsd.get_logger()
         self._read_topic = read_topic
         self._write_topic = write_topic
-        self._log_statistics = False
+        self._log_topic = log_topic
+        self._control_topic = control_topic
+        self._command_topic = command_topic
+        self._log_statistics = user_options.get('log-statistics', False)
+        self._log_limit = RateLimitedLog(_log, user_options.get('log-interval', DEFAULT_LOG_INTERVAL))
 
         assert self._gappsd, "Invalid gridappsd object specified, cannot be None"
         assert self._read_topic, "Invalid read topic specified, cannot be None"
@@ -101,143 +302,562 @@ class Sensors(object):
                                                              DEFAULT_SENSOR_CONFIG['default-aggregation-interval'])
         self.default_normal_value = user_options.get('default-normal-value',
                                                      DEFAULT_SENSOR_CONFIG['default-normal-value'])
+        self.default_output_mode = _check_output_mode(user_options.get('default-output-mode',
+                                                                       DEFAULT_SENSOR_CONFIG['default-output-mode']))
+        self.default_deadband = user_options.get('default-deadband', DEFAULT_SENSOR_CONFIG['default-deadband'])
+        self.default_perunit_deadband = user_options.get('default-perunit-deadband',
+                                                         DEFAULT_SENSOR_CONFIG['default-perunit-deadband'])
+        self.default_max_silence_interval = user_options.get('default-max-silence-interval',
+                                                             DEFAULT_SENSOR_CONFIG['default-max-silence-interval'])
+        self.default_statistics = _check_statistics(user_options.get('default-statistics',
+                                                                     DEFAULT_SENSOR_CONFIG['default-statistics']))
+
+        _log.debug("sensors_config is: %s", sensors_config)
+        self._rules = SensorRules(sensors_config, user_options.pop('sensor-rules', None))
+        self._measurement_info = measurement_info or {}
+        if self._rules.needs_info and not self._measurement_info:
+            _log.warning("sensor-rules select measurements by type or phase but no measurement info is available")
+
+        # Sensors are added to the bank when a matching measurement first appears.
+        self._mrids = []
+        self._rows = {}
+        self._unmatched = set()
+        self._bank = SensorBank(normal_value=[], aggregation_interval=[], perunit_drop_rate=[],
+                                perunit_confidence_band=[], random_seed=self._random_seed, keys=[])
 
-        _log.debug(f"sensors_config is: {sensors_config}")
-        random.seed(self._random_seed)
-        for k, v in sensors_config.items():
-            agg_interval = v.get("aggregation-interval", self.default_aggregation_interval)
-            perunit_drop_rate = v.get("perunit-drop-rate", self.default_drop_rate)
-            perunit_confidence_rate = v.get('perunit-confidence-band', self.default_perunit_confifidence_band)
-            normal_value = v.get('normal-value', self.default_normal_value)
-            self._sensors[k] = Sensor(normal_value=normal_value,
-                                      aggregation_interval=agg_interval,
-                                      perunit_drop_rate=perunit_drop_rate,
-                                      perunit_confidence_band=perunit_confidence_rate)
-
-        _log.info("Created {} sensors".format(len(self._sensors)))
+        _log.info("Created {} sensor rules".format(len(self._rules)))
+        self._plan = None
         self._first_time_through = True
-        self.sensor_file = open("/tmp/sensor.data.txt", 'w')
-        self.measurement_file = open("/tmp/measurement.data.txt", 'w')
-        self._simulation_complete = False
-        self.measurement_in_file = open("/tmp/measurement.infile.txt", 'w')
-        self.measurement_out_file = open("/tmp/measurement.outfile.txt", 'w')
+        self._simulation_complete = threading.Event()
+        self._on_complete = on_complete
+        # Number of messages currently being processed, guarded by the condition.
+        self._in_flight = 0
+        self._idle = threading.Condition()
+        self._subscriptions = []
+        self._closed = False
+        if simulation_id is None:
+            simulation_id = self._read_topic.split('.')[-1]
+        self._simulation_id = simulation_id
+        self._diagnostics = DiagnosticsWriter(simulation_id, user_options.pop('diagnostics', None))
+        self._publisher = FramePublisher(self._gappsd, self._write_topic, simulation_id,
+                                         user_options.pop('publishing', None))
+        metrics_config = dict(DEFAULT_METRICS_CONFIG)
+        metrics_config.update(user_options.pop('metrics', None) or {})
+        self._metrics = SensorMetrics(simulation_id)
+        self._missing_configured = 0
+        self._stats_topic = stats_topic
+        enabled = bool(metrics_config['enabled'])
+        self._stats_interval = float(metrics_config['publish-interval']) if enabled else 0.0
+        self._next_stats = time.monotonic() + self._stats_interval
+        if enabled and int(metrics_config['port']) > 0:
+            start_http_server(int(metrics_config['port']))
+
+        self._profiler = MessageProfiler(simulation_id, user_options.pop('profiling', None))
+
+        self._last_timestamp = None
+        self._resume_after = None
+        self._checkpoint_directory = None
+        checkpoint_config = user_options.pop('checkpoint', None)
+        if checkpoint_config is not None:
+            settings = dict(DEFAULT_CHECKPOINT_CONFIG)
+            settings.update(checkpoint_config)
+            self._checkpoint_directory = settings['directory'].format(simulation_id=simulation_id)
+            self._checkpoint_interval = float(settings['interval'])
+            self._last_checkpoint = None
+            self._restored_from = None
+            if settings['restore']:
+                self.restore()
+
+        self._pipeline = None
+        pipeline_config = user_options.pop('pipeline', None)
+        if pipeline_config and pipeline_config.get('queue-size', 0) > 0:
+            self._pipeline = MessagePipeline(self._run_message, self._publish, pipeline_config,
+                                             name=f"sensors-{simulation_id}")
 
     def simulation_complete(self):
-        self._simulation_complete = True
+        """
+        Signal the main loop that the simulation is over.  Safe to call from any thread
+        or from a signal handler.
+        """
+        self._simulation_complete.set()
+        if self._on_complete is not None:
+            self._on_complete(self._simulation_id)
+
+    @property
+    def simulation_id(self):
+        return self._simulation_id
+
+    @property
+    def mrids(self):
+        return self._mrids
+
+    @property
+    def bank(self):
+        return self._bank
+
+    @property
+    def sent(self):
+        """
+        Total number of sensor values published.
+        """
+        return int(self._bank.sent.sum())
+
+    @property
+    def suppressed(self):
+        """
+        Total number of sensor values suppressed by the deadbands.
+        """
+        return int(self._bank.suppressed.sum())
+
+    @property
+    def metrics(self):
+        return self._metrics
+
+    @property
+    def profiler(self):
+        return self._profiler
+
+    @property
+    def pipeline(self):
+        """
+        The `MessagePipeline` receiving messages, None when messages are processed on the
+        message bus thread.
+        """
+        return self._pipeline
+
+    @property
+    def is_complete(self):
+        return self._simulation_complete.is_set()
+
+    def on_simulation_status(self, headers, message):
+        """
+        Listen for the end of the simulation on the simulation log and control topics.
+
+        :param headers:
+        :param message:
+            Simulation log message or simulation control command.
+        """
+        message = _json_object(message)
+        if message is None:
+            return
+
+        status = message.get('processStatus')
+        command = message.get('command')
+        if status in SIMULATION_FINISHED_STATUSES or command == 'stop':
+            _log.info(f"Simulation finished (status: {status}, command: {command})")
+            self.simulation_complete()
+
+    def on_service_command(self, headers, message):
+        """
+        Listen for commands to the sensors of this simulation on the command topic.
+
+        {"command": "profile"} starts a profile, see `MessageProfiler.start` for the optional
+        messages, seconds, mode and interval keys.
+
+        :param headers:
+        :param message:
+            Service command.
+        """
+        message = _json_object(message)
+        if message is None or message.get('command') != 'profile':
+            return
+        try:
+            self._profiler.start(messages=message.get('messages'), seconds=message.get('seconds'),
+                                 mode=message.get('mode'), interval=message.get('interval'))
+        except ValueError as e:
+            _log.error(f"Unable to start profiling: {e}")
 
     def on_simulation_message(self, headers, message):
         """
         Listen for simulation measurement messages off the gridappsd message bus.
 
-        Each measurement is mapped onto a `Sensor` which determines whether or not the
-        measurement is published to the sensor output topic or dropped.
+        Messages that arrive after the simulation has completed are ignored.
 
         :param headers:
         :param message:
             Simulation measurement message.
         """
+        with self._idle:
+            if self._closed:
+                return
+            self._in_flight += 1
+        try:
+            message = self._run_message(message)
+            if message is not None:
+                self._publish(message)
+        finally:
+            with self._idle:
+                self._in_flight -= 1
+                self._idle.notify_all()
+
+    def _run_message(self, message):
+        return self._profiler.call(self._process_message, message)
+
+    def _process_message(self, message):
+        """
+        Process one simulation measurement message.
+
+        Each measurement is mapped onto a row of the `SensorBank` which determines whether
+        or not the measurement is published to the sensor output topic or dropped.
+
+        :param message:
+            Simulation measurement message.
+        :return: The message to publish or None when no sensor reports this timestep.
+        """
         _log.debug("Measurement Detected")
-        measurement_out = {}
 
+        timestamp = message['message']['timestamp']
+        if self._resume_after is not None and timestamp <= self._resume_after:
+            _log.debug("Skipping message %s already covered by the checkpoint", timestamp)
+            return None
+        self._last_timestamp = timestamp
+
+        diagnostics = self._diagnostics
         if self._first_time_through:
-            with open("/tmp/measurement_list.txt", 'w') as mef:
-                for x in message['message']['measurements']:
-                    mef.write(f'"{x}": '+'{},\n')
+            diagnostics.submit('measurement-list', list(message['message']['measurements']),
+                               _format_measurement_list)
             self._first_time_through = False
 
-        self.measurement_in_file.write(f"{json.dumps(message)}\n")
+        if diagnostics.enabled('measurement-in'):
+            # The outbound measurements replace the inbound ones on this message, in place
+            # when passing through, so the capture needs its own copy of the mapping.  The
+            # measurement objects themselves are never modified.
+            inbound = dict(message['message'])
+            inbound['measurements'] = dict(inbound['measurements'])
+            diagnostics.submit('measurement-in', dict(message, message=inbound))
 
-        # if passthrough set then copy over the measurmments of the entire message
-        # into the output.
-        if self.passthrough_if_not_specified:
-            measurement_out = deepcopy(message['message']['measurements'])
+        measurements = message['message']['measurements']
 
-        timestamp = message['message']['timestamp']
+        metrics = self._metrics
+        start = time.perf_counter()
+        magnitude, angle, present = self.gather_measurements(measurements)
+        decoded = time.perf_counter()
+        metrics.observe('decode', decoded - start)
 
-        # Loop over the configured sensor andding measurements for each of them
-        for mrid in self._sensors:
-            new_measurement = dict(
-                measurement_mrid=mrid
-            )
+        if diagnostics.enabled('measurement-data'):
+            diagnostics.submit('measurement-data',
+                               (timestamp, self._mrids, np.flatnonzero(present), magnitude, angle),
+                               _format_measurement_data)
 
-            _log.debug(f"Getting message from sensor: {mrid}")
-            item = message['message']['measurements'].get(mrid)
+        sample = self._bank.update(timestamp, magnitude, angle, present)
+        sampled = time.perf_counter()
+        metrics.observe('sample', sampled - decoded)
 
-            if not item:
-                _log.error(f"Invalid sensor mrid configured {mrid}")
-                continue
+        if diagnostics.enabled('sensor-data'):
+            diagnostics.submit('sensor-data',
+                               (timestamp, self._mrids, sample.rows[sample.emit], sample.magnitude[sample.emit],
+                                angle),
+                               _format_sensor_data)
+
+        if diagnostics.enabled('measurement-capture'):
+            diagnostics.submit('measurement-capture', (timestamp, self._mrids, magnitude, angle, present, sample),
+                               _capture_columns)
 
-            # Create new values for data from the sensor.
-            for prop, value in item.items():
-                if prop in ('measurement_mrid',):
-                    new_measurement[prop] = value
-                    continue
-                new_value = None
-
-                if prop == 'magnitude':
-                    self.measurement_file.write(f"{timestamp} {mrid}, magnitude: {value}\n")
-                elif prop == 'angle':
-                    self.measurement_file.write(f"{timestamp} {mrid}, angle: {value}\n")
-
-                sensor = self._sensors[mrid]
-
-                if prop in ('angle', 'magnitude'):
-                    sensor_prop = sensor.get_property_sensor(prop)
-                    if sensor_prop is None:
-                        # sensor is normally 0
-                        sensor.add_property_sensor(prop, 180, sensor.interval, sensor.perunit_dropping,
-                                                   sensor._perunit_confidence_band_95pct)
-                        sensor_prop = sensor.get_property_sensor(prop)
-                    new_value = sensor_prop.get_new_value(timestamp, value)
-                else:
-                    # Keep values other than angle and magnitued the same for now.
-                    new_measurement[prop] = value
-
-                if new_value is None:
-                    new_measurement = None
-                    _log.debug(f"Not reporting measurement for ts: {timestamp} {mrid}")
-                    break
-
-                _log.debug(f"mrid: {mrid} timestamp: {timestamp} prop: {prop} new_value: {new_value}")
-                if prop == 'magnitude':
-                    self.sensor_file.write(f"{timestamp} {mrid}, {new_value}\n")
-                elif prop == 'angle':
-                    self.sensor_file.write(f"{timestamp} {mrid}, {value}\n")
-                new_measurement[prop] = new_value
-
-            if new_measurement is not None:
-                _log.debug(f"Adding new measurement: {new_measurement}")
-                measurement_out[mrid] = new_measurement
+        measurement_out = self.build_measurements(measurements, sample)
+        built = time.perf_counter()
+        metrics.observe('build', built - sampled)
+        metrics.observe('message', built - start)
 
+        emitted = np.count_nonzero(sample.emit)
+        metrics.count('messages')
+        metrics.count('emitted', emitted)
+        metrics.count('dropped', np.count_nonzero(sample.dropped))
+        metrics.count('suppressed', np.count_nonzero(sample.suppressed))
+        metrics.count('missing', len(self._mrids) - np.count_nonzero(present) + self._missing_configured)
+        if self.passthrough_if_not_specified:
+            metrics.count('passthrough', len(measurement_out) - emitted)
+        self._update_stats()
+
+        outbound = None
         if len(measurement_out) > 0:
             message['message']['measurements'] = measurement_out
             if self._log_statistics:
                 self._log_sensors()
-            _log.info(f"Sensor Measurements:\n{measurement_out}")
-            self.measurement_out_file.write(f"{json.dumps(message)}\n")
-            self._gappsd.send(self._write_topic, message)
+            self._log_limit.log('measurements', logging.INFO, "Sensor Measurements at %s:\n%s", timestamp,
+                                measurement_out)
+            diagnostics.submit('measurement-out', message)
+            outbound = message
+        else:
+            self._log_limit.log('no-output', logging.INFO, "No sensor output.")
+        _log.debug("Message %s: %d measurements in, %d emitted", timestamp, len(measurements), emitted)
+
+        if self._checkpoint_directory is not None and self._checkpoint_interval > 0:
+            if self._last_checkpoint is None:
+                self._last_checkpoint = timestamp
+            elif timestamp - self._last_checkpoint >= self._checkpoint_interval:
+                self.checkpoint(outbound)
+                self._last_checkpoint = timestamp
+        return outbound
+
+    def gather_measurements(self, measurements):
+        """
+        Gather the magnitude and angle of each configured sensor into arrays so the whole
+        bank can be updated at once.
+
+        The layout of the measurements is compiled into a `MeasurementPlan` on the first
+        message and recompiled whenever the set of measurements changes.
+
+        :param measurements: The measurements mapping of a simulation output message.
+        :return: tuple of the magnitude array, angle array and mask of the sensors present.
+        """
+        plan = self._plan
+        if plan is None or not plan.matches(measurements):
+            plan = self.compile_plan(measurements)
+        try:
+            return plan.gather(measurements)
+        except KeyError:
+            return self.compile_plan(measurements).gather(measurements)
+
+    def compile_plan(self, measurements):
+        """
+        Resolve the configured sensors against measurements, a mapping of mrid to the
+        measurement or its field names (e.g. {"_mrid": ["magnitude", "angle"]}).
+
+        Measurements seen for the first time are matched against the sensor configuration
+        and the matching ones with a magnitude are added to the bank.
+        """
+        parameters = []
+        for mrid, item in measurements.items():
+            if mrid in self._rows or mrid in self._unmatched:
+                continue
+            config = None
+            if item and 'magnitude' in item:
+                config = self._rules.match(mrid, self._measurement_info.get(mrid))
+            if config is None:
+                self._unmatched.add(mrid)
+                continue
+            self._rows[mrid] = len(self._mrids)
+            self._mrids.append(mrid)
+            parameters.append(config)
+
+        if parameters:
+            statistics = [_check_statistics(v.get('statistics', self.default_statistics)) for v in parameters]
+            self._bank.extend(
+                normal_value=[v.get('normal-value', self.default_normal_value) for v in parameters],
+                aggregation_interval=[v.get("aggregation-interval", self.default_aggregation_interval)
+                                      for v in parameters],
+                perunit_drop_rate=[v.get("perunit-drop-rate", self.default_drop_rate) for v in parameters],
+                perunit_confidence_band=[v.get('perunit-confidence-band', self.default_perunit_confifidence_band)
+                                         for v in parameters],
+                keys=mrid_keys(self._mrids[-len(parameters):]),
+                range_output=[_check_output_mode(v.get('output-mode', self.default_output_mode)) == 'range'
+                              for v in parameters],
+                deadband=[v.get('deadband', self.default_deadband) for v in parameters],
+                perunit_deadband=[v.get('perunit-deadband', self.default_perunit_deadband) for v in parameters],
+                max_silence_interval=[v.get('max-silence-interval', self.default_max_silence_interval)
+                                      for v in parameters],
+                variance_output=['variance' in v for v in statistics],
+                percentile_output=['percentiles' in v for v in statistics])
+            _log.info(f"Created {len(parameters)} sensors, {len(self._mrids)} in total")
+
+        self._missing_configured = 0
+        for mrid in self._rules.exact:
+            if mrid not in self._rows and mrid not in measurements:
+                self._log_limit.log(('invalid-mrid', mrid), logging.ERROR, "Invalid sensor mrid configured %s", mrid)
+                self._missing_configured += 1
+
+        self._plan = MeasurementPlan(self._mrids, measurements)
+        for mrid in self._plan.missing:
+            self._log_limit.log(('invalid-mrid', mrid), logging.ERROR, "Invalid sensor mrid configured %s", mrid)
+        return self._plan
+
+    def build_measurements(self, measurements, sample):
+        """
+        Build the outbound measurements from the inbound ones and a `BankSample`.
+
+        If passthrough is set then the inbound measurements become the output and only the
+        entries of the sensors that report this timestep are replaced.  The message is owned
+        by the caller so nothing needs to be copied.
+
+        :param measurements: The measurements mapping of a simulation output message.
+        :param sample: The `BankSample` produced for the message.
+        :return: The measurements to publish.
+        """
+        if self.passthrough_if_not_specified:
+            measurement_out = measurements
         else:
-            _log.info("No sensor output.")
+            measurement_out = {}
+
+        # Build the new measurements for the sensors that are reporting this timestep.
+        range_output = self._bank.range_output
+        variance_output = self._bank.variance_output
+        percentile_output = self._bank.percentile_output
+        for index in np.flatnonzero(sample.emit):
+            row = sample.rows[index]
+            mrid = self._mrids[row]
+            item = measurements[mrid]
+            new_measurement = dict(item)
+            new_measurement['magnitude'] = float(sample.magnitude[index])
+            if range_output[row]:
+                new_measurement['magnitude_min'] = float(sample.magnitude_min[index])
+                new_measurement['magnitude_max'] = float(sample.magnitude_max[index])
+            if variance_output[row]:
+                new_measurement['magnitude_variance'] = float(sample.magnitude_variance[index])
+            if percentile_output[row]:
+                new_measurement['magnitude_p5'] = float(sample.magnitude_p5[index])
+                new_measurement['magnitude_p95'] = float(sample.magnitude_p95[index])
+            if 'angle' in item:
+                new_measurement['angle'] = float(sample.angle[index])
+                if range_output[row]:
+                    new_measurement['angle_min'] = float(sample.angle_min[index])
+                    new_measurement['angle_max'] = float(sample.angle_max[index])
+                if variance_output[row]:
+                    new_measurement['angle_variance'] = float(sample.angle_variance[index])
+                if percentile_output[row]:
+                    new_measurement['angle_p5'] = float(sample.angle_p5[index])
+                    new_measurement['angle_p95'] = float(sample.angle_p95[index])
+            measurement_out[mrid] = new_measurement
+
+        return measurement_out
+
+    def checkpoint(self, outbound=None):
+        """
+        Write the state of the sensors to a new checkpoint.  Must not be called while a
+        message is being processed.
+
+        :param outbound: The output of the last message when it has not been handed to the
+            publisher yet, the checkpoint records the publisher as it will be after it is.
+        :return: Path of the checkpoint.
+        """
+        start = time.perf_counter()
+        if self._pipeline is not None:
+            self._pipeline.wait_published()
+        meta = {'simulation_id': self._simulation_id,
+                'random_seed': self._bank.random_seed,
+                'timestamp': self._last_timestamp,
+                'mrids': self._mrids,
+                'publisher': self._publisher.state(outbound)}
+        path = write_checkpoint(self._checkpoint_directory, self._bank.state(), meta, keep=self._restored_from)
+        _log.info(f"Checkpointed {len(self._mrids)} sensors at {self._last_timestamp} to {path} "
+                  f"in {time.perf_counter() - start:.3f}s")
+        return path
+
+    def restore(self):
+        """
+        Resume from the latest checkpoint, when there is one.  Messages up to the timestamp
+        of the checkpoint are skipped afterwards.
+
+        :return: True when a checkpoint was restored.
+        """
+        checkpoint = read_checkpoint(self._checkpoint_directory)
+        if checkpoint is None:
+            return False
+        arrays, meta = checkpoint
+        if meta['random_seed'] != self._bank.random_seed:
+            _log.warning(f"Checkpoint random-seed {meta['random_seed']} differs from {self._bank.random_seed}, "
+                         f"using the checkpoint's")
+        self._bank = SensorBank.from_state(arrays, random_seed=meta['random_seed'])
+        # The bank maps the arrays of the checkpoint, which is kept until the process ends.
+        self._restored_from = meta['path']
+        self._mrids = list(meta['mrids'])
+        self._rows = {mrid: row for row, mrid in enumerate(self._mrids)}
+        self._unmatched = set()
+        self._plan = None
+        self._publisher.restore(meta['publisher'])
+        self._resume_after = self._last_timestamp = meta['timestamp']
+        _log.info(f"Restored {len(self._mrids)} sensors from {self._checkpoint_directory} at {meta['timestamp']}")
+        return True
+
+    def _publish(self, message):
+        start = time.perf_counter()
+        self._publisher.publish(message)
+        self._metrics.observe('publish', time.perf_counter() - start)
+
+    def _update_stats(self, force=False):
+        """
+        Refresh the gauges and publish a snapshot of the metrics when one is due.
+        """
+        metrics = self._metrics
+        metrics.gauge('sensors', len(self._mrids))
+        if self._pipeline is not None:
+            statistics = self._pipeline.statistics
+            metrics.gauge('queue-depth', statistics['depth'])
+            metrics.gauge('queue-lag-seconds', statistics['lag'])
+            metrics.gauge('queue-discarded', statistics['discarded'])
+        if self._stats_topic is None or self._stats_interval <= 0:
+            return
+        now = time.monotonic()
+        if force or now >= self._next_stats:
+            self._next_stats = now + self._stats_interval
+            self._gappsd.send(self._stats_topic, metrics.snapshot())
 
     def _log_sensors(self):
-        for s in self._sensors:
+        if not self._log_limit.log('sensors', logging.DEBUG, "State of %d sensors:", len(self._mrids)):
+            return
+        for index, mrid in enumerate(self._mrids):
+            s = f"{mrid} {self._bank.describe(index)}"
             _log.debug(s)
             self._logger.debug(s)
 
+    def close(self):
+        """
+        Stop accepting messages, wait for the in-flight ones to finish and close all of
+        the files.
+        """
+        if self._closed:
+            return
+        if self._pipeline is not None:
+            self._pipeline.close()
+        with self._idle:
+            self._closed = True
+            self._idle.wait_for(lambda: self._in_flight == 0)
+        self._publisher.flush()
+        if self._checkpoint_directory is not None and self._last_timestamp is not None:
+            self.checkpoint()
+        self._diagnostics.close()
+        self._update_stats(force=True)
+        self._metrics.close()
+        self._profiler.stop()
+        _log.info(f"Published {self.sent} sensor values, suppressed {self.suppressed} inside their deadband")
+
+    def subscribe(self, executor=None):
+        """
+        Subscribe to the simulation's output, log and control topics and the command topic.
+
+        :param executor: Optional `concurrent.futures.Executor` the measurement messages are
+            submitted to, by default they are processed on the connection's thread.  The
+            executor must run the messages of a simulation one at a time and in order.  It
+            is not used when the sensors have their own pipeline.
+        """
+        callback = self.on_simulation_message
+        if self._pipeline is not None:
+            callback = self._pipeline.submit
+        elif executor is not None:
+            def callback(headers, message):
+                executor.submit(self.on_simulation_message, headers, message)
+        self._subscribe(self._read_topic, callback)
+        for topic in (self._log_topic, self._control_topic):
+            if topic:
+                self._subscribe(topic, self.on_simulation_status)
+        if self._command_topic:
+            self._subscribe(self._command_topic, self.on_service_command)
+
+    def unsubscribe(self):
+        for subscription in self._subscriptions:
+            self._gappsd.unsubscribe(subscription)
+        self._subscriptions.clear()
+
     def main_loop(self):
-        self._gappsd.subscribe(self._read_topic, self.on_simulation_message)
+        """
+        Subscribe to the simulation and block until it completes, then shut down cleanly.
+        """
+        self.subscribe()
 
-        while True and not self._simulation_complete:
-            time.sleep(0.001)
+        self._simulation_complete.wait()
 
-        self.measurement_file.close()
-        self.sensor_file.close()
-        self.measurement_in_file.close()
+        _log.info("Simulation complete, shutting down sensors")
+        self.unsubscribe()
+        self.close()
+
+    def _subscribe(self, topic, callback):
+        subscription = self._gappsd.subscribe(topic, callback)
+        if subscription is not None:
+            self._subscriptions.append(subscription)
 
 
 class Sensor(object):
     def __init__(self, normal_value, aggregation_interval, perunit_drop_rate,
-                 perunit_confidence_band):
+                 perunit_confidence_band, streams: RandomStreams = None, key=0, channel=0):
         """
         An object modeling an individual sensor.
 
@@ -252,6 +872,10 @@ class Sensor(object):
             measurements will be dropped over the long run.
         :param perunit_confidence_band: with a 95 % confidence interval, we are 95 % certain
             that the true value lies within an interval this wide, centered on the measured value.
+        :param streams: Optional `RandomStreams` to draw from.  When not specified the
+            global `random` module is used.
+        :param key: 64 bit key (see `streams.mrid_key`) of this sensor's random stream.
+        :param channel: Noise channel of the sensor, 0 for magnitude and 1 for angle.
 
         """
         self._normal_value = normal_value
@@ -268,6 +892,9 @@ class Sensor(object):
         self._max = 0
         self._initialized = False
         self._complex = False
+        self._streams = streams
+        self._key = key
+        self._channel = channel
         # A secondary list of sensors
         self._properties = {}
 
@@ -278,7 +905,8 @@ class Sensor(object):
         if key in self._properties:
             raise KeyError(f"key {key} already exists in the sensor properties")
 
-        self._properties[key] = Sensor(normal_value, aggregation_interval, perunit_drop_rate, perunit_confidence_band)
+        self._properties[key] = Sensor(normal_value, aggregation_interval, perunit_drop_rate, perunit_confidence_band,
+                                       streams=self._streams, key=self._key, channel=len(self._properties) + 1)
 
     def get_property_sensor(self, key):
         if key == 'magnitude':
@@ -308,7 +936,7 @@ class Sensor(object):
 
     def initialize(self, t, val):
         if self._interval > 0.0:
-            offset = random.randint(0, self._interval - 1)  # each sensor needs a staggered start
+            offset = self._randint(self._interval)  # each sensor needs a staggered start
             self.reset_interval(t - offset, val)
         else:
             self._n = 1
@@ -346,13 +974,13 @@ class Sensor(object):
             self._n = 1
         mean_val = self._average / self._n
         if self.perunit_dropping > 0.0:
-            drop = random.uniform(0, 1)
+            drop = self._uniform(t)
             if drop <= self.perunit_dropping:
                 self.reset_interval(t, mean_val)
                 return None, None, None
-        ret = (mean_val + random.gauss(0.0, self._stddev),  # TODO (Tom, Andy, Andy): do we want the same error on each?
-               self._min + random.gauss(0.0, self._stddev),
-               self._max + random.gauss(0.0, self._stddev))
+        ret = (mean_val + self._gauss(t, 0),  # TODO (Tom, Andy, Andy): do we want the same error on each?
+               self._min + self._gauss(t, 1),
+               self._max + self._gauss(t, 2))
         self.reset_interval(t, mean_val)
         return ret
 
@@ -361,20 +989,46 @@ class Sensor(object):
             self._n = 1
         mean_val = self._average / self._n
         if self.perunit_dropping > 0.0:
-            drop = random.uniform(0, 1)
+            drop = self._uniform(t)
             if drop <= self.perunit_dropping:
                 self.reset_interval(t, mean_val)
                 return None
-        ret = mean_val + random.gauss(0.0, self._stddev)
+        ret = mean_val + self._gauss(t, 0)
         self.reset_interval(t, mean_val)
         return ret
 
+    def _randint(self, interval):
+        if self._streams is None:
+            return random.randint(0, interval - 1)
+        return int(self._streams.integers(STAGGER, [self._key], 0, int(interval))[0])
+
+    def _uniform(self, t):
+        if self._streams is None:
+            return random.uniform(0, 1)
+        return float(self._streams.uniform(DROP, [self._key], t)[0])
+
+    def _gauss(self, t, statistic):
+        if self._streams is None:
+            return random.gauss(0.0, self._stddev)
+        # Noise index layout shared with SensorBank: channel + 2 * statistic (mean, min, max).
+        return float(self._streams.normal(NOISE, [self._key], t, self._channel + 2 * statistic)[0]) * self._stddev
+
     def get_new_value(self, t, value):
         self.add_sample(t, value)
         if self.ready_to_sample(t):
             return self.take_inst_sample(t)
         return None
 
+    def get_new_range(self, t, value):
+        """
+        Same as `get_new_value` but returns the (mean, min, max) of the interval from
+        `take_range_sample`.
+        """
+        self.add_sample(t, value)
+        if self.ready_to_sample(t):
+            return self.take_range_sample(t)
+        return None
+
     def __str__(self):
         return "nominal: {}, stddev: {}, pu dropped: {}, agg interval: {}".format(
             self.normal_value, self.stddev, self.perunit_dropping, self.interval
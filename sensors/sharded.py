@@ -0,0 +1,306 @@
+from itertools import chain, islice
+import json
+import logging
+import multiprocessing
+from multiprocessing import shared_memory
+import time
+
+import numpy as np
+
+from .bank import BankSample
+from .replay import REPLAY_READ_TOPIC, REPLAY_WRITE_TOPIC, ReplayStats
+from .sensor import Sensors
+from .sinks import NullSink
+
+_log = logging.getLogger(__file__)
+
+# Memory the decoded timesteps of one chunk may use.
+DEFAULT_BUFFER_BYTES = 256 * 1024 * 1024
+MAX_ROWS_PER_CHUNK = 4096
+
+# Options applied by `Sensors` on the way out that a sharded replay does not apply.
+SHARDED_UNSUPPORTED_OPTIONS = ('publishing', 'diagnostics', 'checkpoint')
+# Options of the service process, every worker would bind the same metrics port and start its
+# own profiler and pipeline threads, so they are left out of the workers' options.
+SHARDED_IGNORED_OPTIONS = ('metrics', 'profiling', 'pipeline')
+
+
+class SharedBuffer(object):
+    FIELDS = (('magnitude', np.float64), ('angle', np.float64), ('present', np.bool_))
+
+    def __init__(self, rows, sensors, names=None):
+        """
+        The decoded magnitude, angle and presence of every sensor for a chunk of timesteps,
+        held in shared memory so that every process reads the same copy.
+
+        :param rows: Number of timesteps the buffer holds.
+        :param sensors: Number of sensors.
+        :param names: Names of existing shared memory blocks to attach to, when not
+            specified new blocks are created and owned by this object.
+        """
+        self._owner = names is None
+        self._memory = {}
+        self._arrays = {}
+        for name, dtype in self.FIELDS:
+            if self._owner:
+                size = max(1, rows * sensors * np.dtype(dtype).itemsize)
+                memory = shared_memory.SharedMemory(create=True, size=size)
+            else:
+                memory = shared_memory.SharedMemory(name=names[name])
+            self._memory[name] = memory
+            self._arrays[name] = np.ndarray((rows, sensors), dtype=dtype, buffer=memory.buf)
+
+    def __getitem__(self, name):
+        return self._arrays[name]
+
+    @property
+    def names(self):
+        return {name: memory.name for name, memory in self._memory.items()}
+
+    def close(self):
+        self._arrays.clear()
+        for memory in self._memory.values():
+            memory.close()
+            if self._owner:
+                memory.unlink()
+        self._memory.clear()
+
+
+def _create_sensors(user_options, simulation_id, layout):
+    """
+    Create sensors whose rows are resolved from layout, a mapping of mrid to field names,
+    so that every process has the same rows in the same order.
+    """
+    sensors = Sensors(NullSink(), REPLAY_READ_TOPIC, REPLAY_WRITE_TOPIC, user_options, simulation_id=simulation_id)
+    sensors.compile_plan(layout)
+    return sensors
+
+
+def _codec_main(conn, user_options, simulation_id, layout, names, rows, size):
+    """
+    Decode the lines of a piece of each chunk into the shared buffer and, once the shards
+    have updated the sensors, build their output lines from the same parsed messages.
+    """
+    sensors = _start_worker(conn, user_options, simulation_id, layout)
+    if sensors is None:
+        return
+    buffer = SharedBuffer(rows, size, names)
+    messages = []
+    try:
+        while True:
+            task = conn.recv()
+            if task is None:
+                break
+            try:
+                if task[0] == 'decode':
+                    _, row, lines = task
+                    messages = [json.loads(line) for line in lines]
+                    conn.send(_decode(sensors, buffer, row, messages))
+                else:
+                    conn.send(_encode(sensors, messages, task[1]))
+                    messages = []
+            except Exception as e:
+                conn.send(e)
+    finally:
+        buffer.close()
+        conn.close()
+
+
+def _decode(sensors, buffer, row, messages):
+    """
+    Gather messages into the shared buffer starting at row and return their timestamps.
+    """
+    timestamps = []
+    for offset, message in enumerate(messages):
+        message = message['message']
+        timestamps.append(message['timestamp'])
+        magnitude, angle, present = sensors.gather_measurements(message['measurements'])
+        if len(magnitude) != buffer['magnitude'].shape[1]:
+            raise ValueError("New sensors appeared during a sharded replay, replay with a single worker")
+        buffer['magnitude'][row + offset] = magnitude
+        buffer['angle'][row + offset] = angle
+        buffer['present'][row + offset] = present
+    return timestamps
+
+
+def _encode(sensors, messages, samples):
+    """
+    Build the output lines of decoded messages from their merged `BankSample`s.
+    """
+    output = []
+    for message, sample in zip(messages, samples):
+        measurement_out = sensors.build_measurements(message['message']['measurements'], sample)
+        if len(measurement_out) > 0:
+            message['message']['measurements'] = measurement_out
+            output.append(json.dumps(message))
+            output.append('\n')
+    return ''.join(output), len(output) // 2
+
+
+def _start_worker(conn, user_options, simulation_id, layout):
+    """
+    Create the sensors of a worker process and tell the coordinator whether that worked,
+    the exception is sent back when it did not and None is returned.
+    """
+    try:
+        sensors = _create_sensors(user_options, simulation_id, layout)
+    except Exception as e:
+        conn.send(e)
+        conn.close()
+        return None
+    conn.send(True)
+    return sensors
+
+
+def _receive(conn):
+    result = conn.recv()
+    if isinstance(result, Exception):
+        raise result
+    return result
+
+
+def _shard_main(conn, user_options, simulation_id, layout, names, rows, sensors, columns):
+    """
+    Own the aggregation state of the sensors in columns and process each chunk of the
+    shared buffer the coordinator announces.
+    """
+    created = _start_worker(conn, user_options, simulation_id, layout)
+    if created is None:
+        return
+    bank = created.bank.subset(columns)
+    buffer = SharedBuffer(rows, sensors, names)
+    try:
+        while True:
+            timestamps = conn.recv()
+            if timestamps is None:
+                break
+            try:
+                samples = [bank.update(t, buffer['magnitude'][row, columns], buffer['angle'][row, columns],
+                                       buffer['present'][row, columns])
+                           for row, t in enumerate(timestamps)]
+                # Only the sensors that are due are sent back, numbered as in the whole bank.
+                conn.send([sample._replace(rows=sample.rows + columns.start) for sample in samples])
+            except Exception as e:
+                conn.send(e)
+    finally:
+        buffer.close()
+        conn.close()
+
+
+def _split(sequence, parts):
+    bounds = np.linspace(0, len(sequence), parts + 1).astype(int)
+    return [(lo, sequence[lo:hi]) for lo, hi in zip(bounds[:-1], bounds[1:]) if hi > lo]
+
+
+def sharded_replay(lines, output, user_options, workers=None, simulation_id="replay", rows_per_chunk=None,
+                   progress=0):
+    """
+    Replay captured messages with the configured sensors split across processes.
+
+    The coordinator reads chunks of lines, codec processes parse a piece each into a shared
+    buffer, one shard process per worker updates the aggregation state of its slice of the
+    sensors and each codec builds the output lines of the messages it parsed, which are
+    written in the original order.  Each sensor's random stream is keyed by its mrid so the
+    output is identical to a single process run with the same random-seed.
+
+    The sensors are resolved from the first message, every following message must have
+    the same set of measurements.  Each output message is written as one line, the
+    publishing, diagnostics and checkpoint options are not supported and raise a
+    ValueError, replay with a single process to use them.  The metrics, profiling and
+    pipeline options belong to the service process and are ignored.
+
+    :param lines: Iterable of JSONL capture lines.
+    :param output: Text file object the output lines are written to.
+    :param user_options: The sensor simulator user options.
+    :param workers: Number of processes, defaults to the number of CPUs.
+    :param simulation_id: Simulation id passed to the sensors.
+    :param rows_per_chunk: Number of timesteps decoded at once, sized from the number of
+        sensors when not specified.
+    :param progress: Log the rate every progress messages, 0 disables progress logging.
+    :return: A `ReplayStats`.
+    """
+    unsupported = [name for name in SHARDED_UNSUPPORTED_OPTIONS if user_options.get(name)]
+    if unsupported:
+        raise ValueError(f"A sharded replay does not support the {', '.join(unsupported)} options, "
+                         f"replay with a single worker")
+    ignored = [name for name in SHARDED_IGNORED_OPTIONS if name in user_options]
+    if ignored:
+        _log.info(f"A sharded replay ignores the {', '.join(ignored)} options")
+        user_options = {name: value for name, value in user_options.items() if name not in ignored}
+    workers = workers or multiprocessing.cpu_count()
+    lines = iter(lines)
+    first = next(lines, None)
+    if first is None:
+        return ReplayStats(0, 0, 0.0)
+    lines = chain((first,), lines)
+    layout = {mrid: tuple(item) for mrid, item in json.loads(first)['message']['measurements'].items()}
+    size = len(_create_sensors(user_options, simulation_id, layout).mrids)
+    if rows_per_chunk is None:
+        rows_per_chunk = int(np.clip(DEFAULT_BUFFER_BYTES // max(1, size * 17), 1, MAX_ROWS_PER_CHUNK))
+
+    buffer = SharedBuffer(rows_per_chunk, size)
+    init_args = (user_options, simulation_id, layout, buffer.names, rows_per_chunk, size)
+    shards = []
+    codecs = []
+    count = published = 0
+    start = time.perf_counter()
+    try:
+        for lo, columns in _split(np.arange(size), workers):
+            parent, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=_shard_main,
+                                              args=(child, *init_args, slice(lo, lo + len(columns))),
+                                              daemon=True)
+            process.start()
+            child.close()
+            shards.append((parent, process))
+        for _ in range(workers):
+            parent, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=_codec_main, args=(child, *init_args), daemon=True)
+            process.start()
+            child.close()
+            codecs.append((parent, process))
+        # Every worker reports whether it created its sensors before any work is sent.
+        for conn, _ in shards + codecs:
+            _receive(conn)
+
+        while True:
+            chunk = list(islice(lines, rows_per_chunk))
+            if not chunk:
+                break
+
+            # Piece i is always parsed by codec i, which keeps the messages to encode them.
+            pieces = _split(chunk, workers)
+            for (conn, _), (lo, piece) in zip(codecs, pieces):
+                conn.send(('decode', lo, piece))
+            timestamps = [t for (conn, _), _ in zip(codecs, pieces) for t in _receive(conn)]
+
+            for conn, _ in shards:
+                conn.send(timestamps)
+            results = [_receive(conn) for conn, _ in shards]
+            if results:
+                # The shards hold consecutive sensors so their rows concatenate in order.
+                merged = [BankSample(*(np.concatenate(field) for field in zip(*step))) for step in zip(*results)]
+            else:
+                merged = [BankSample(*(np.zeros(0) for _ in BankSample._fields))] * len(chunk)
+
+            for (conn, _), (lo, piece) in zip(codecs, pieces):
+                conn.send(('encode', merged[lo:lo + len(piece)]))
+            for (conn, _), _ in zip(codecs, pieces):
+                text, sent = _receive(conn)
+                output.write(text)
+                published += sent
+
+            count += len(chunk)
+            if progress and count // progress != (count - len(chunk)) // progress:
+                _log.info(f"Replayed {count} messages ({count / (time.perf_counter() - start):.1f} msg/s)")
+    finally:
+        for conn, process in shards + codecs:
+            try:
+                conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+            process.join()
+            conn.close()
+        buffer.close()
+
+    return ReplayStats(count, published, time.perf_counter() - start)
@@ -0,0 +1,56 @@
+import gzip
+import json
+import logging
+
+_log = logging.getLogger(__file__)
+
+
+def open_text(path, mode='r'):
+    """
+    Open a text file, transparently handling gzip compressed files ending in .gz.
+    """
+    if str(path).endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8', buffering=1024 * 1024)
+
+
+class NullSink(object):
+    """
+    A stand in for the gridappsd connection that discards everything sent to it.
+    """
+    def __init__(self):
+        self._sent = 0
+
+    @property
+    def sent(self):
+        return self._sent
+
+    def send(self, topic, message):
+        self._sent += 1
+
+    def get_logger(self):
+        return _log
+
+    def close(self):
+        pass
+
+
+class JsonlSink(NullSink):
+    def __init__(self, path):
+        """
+        A stand in for the gridappsd connection that writes every sent message to a file,
+        one JSON document per line (the same format as the measurement-out diagnostics).
+
+        :param path: File to write, compressed when it ends in .gz.
+        """
+        super(JsonlSink, self).__init__()
+        self._fp = open_text(path, 'w')
+
+    def send(self, topic, message):
+        # Like the gridappsd connection, messages that are already serialized are sent as is.
+        self._fp.write(message if isinstance(message, str) else json.dumps(message))
+        self._fp.write('\n')
+        self._sent += 1
+
+    def close(self):
+        self._fp.close()
@@ -0,0 +1,147 @@
+import hashlib
+import logging
+
+import numpy as np
+
+_log = logging.getLogger(__file__)
+
+# Philox4x32-10 constants (Salmon et al., "Parallel Random Numbers: As Easy as 1, 2, 3").
+PHILOX_M0 = np.uint64(0xD2511F53)
+PHILOX_M1 = np.uint64(0xCD9E8D57)
+PHILOX_W0 = np.uint64(0x9E3779B9)
+PHILOX_W1 = np.uint64(0xBB67AE85)
+PHILOX_ROUNDS = 10
+
+MASK32 = np.uint64(0xFFFFFFFF)
+SHIFT32 = np.uint64(32)
+TWO_POW_26 = 67108864.0
+TWO_POW_53 = 9007199254740992.0
+
+# The purpose of a draw, so the same sensor and timestamp produce independent values
+# for each decision that is made.
+STAGGER = 0
+DROP = 1
+NOISE = 2
+
+
+def philox4x32(counter, key):
+    """
+    Apply the Philox4x32-10 bijection to an array of counters.
+
+    :param counter: (n, 4) array of 32 bit counter words.
+    :param key: (n, 2) or (2,) array of 32 bit key words.
+    :return: (n, 4) uint32 array of random bits.
+    """
+    counter = np.asarray(counter, dtype=np.uint64)
+    words = [counter[..., i].copy() for i in range(4)]
+    key = np.asarray(key, dtype=np.uint64)
+    _philox_rounds(words, key[..., 0].copy(), key[..., 1].copy())
+    return np.stack(words, axis=-1).astype(np.uint32)
+
+
+def _philox_rounds(words, k0, k1):
+    """
+    Run the rounds of Philox4x32-10 on the four uint64 arrays of 32 bit words in place,
+    reusing the same arrays for every round.
+    """
+    c0, c1, c2, c3 = words
+    p0 = np.empty_like(c0)
+    p1 = np.empty_like(c0)
+    for i in range(PHILOX_ROUNDS):
+        if i > 0:
+            k0 = (k0 + PHILOX_W0) & MASK32
+            k1 = (k1 + PHILOX_W1) & MASK32
+        np.multiply(c0, PHILOX_M0, out=p0)
+        np.multiply(c2, PHILOX_M1, out=p1)
+        # c0, c1, c2, c3 = hi(p1) ^ c1 ^ k0, lo(p1), hi(p0) ^ c3 ^ k1, lo(p0)
+        np.right_shift(p1, SHIFT32, out=c0)
+        c0 ^= c1
+        c0 ^= k0
+        np.bitwise_and(p1, MASK32, out=c1)
+        np.right_shift(p0, SHIFT32, out=c2)
+        c2 ^= c3
+        c2 ^= k1
+        np.bitwise_and(p0, MASK32, out=c3)
+
+
+def mrid_key(mrid):
+    """
+    Return a stable 64 bit key for an mrid.
+
+    Python's hash() is salted per process so it cannot be used for reproducible streams.
+    """
+    return int.from_bytes(hashlib.blake2b(str(mrid).encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def mrid_keys(mrids):
+    """
+    Return an array of stable 64 bit keys, one per mrid.
+    """
+    return np.fromiter((mrid_key(mrid) for mrid in mrids), dtype=np.uint64, count=len(mrids))
+
+
+class RandomStreams(object):
+    def __init__(self, seed=0):
+        """
+        Counter-based random numbers addressed by (seed, key, timestamp, purpose).
+
+        Every value is a pure function of its address, so the draws for one sensor do not
+        depend on how many other sensors exist, in what order they are processed or which
+        worker processes them.  Each call produces a whole array of draws at once.
+
+        :param seed: The random-seed from the service configuration.
+        """
+        self._seed = int(seed)
+        seed = self._seed & 0xFFFFFFFFFFFFFFFF
+        self._key = np.array([seed & 0xFFFFFFFF, seed >> 32], dtype=np.uint64)
+
+    def __repr__(self):
+        return f"<RandomStreams(seed={self._seed})>"
+
+    @property
+    def seed(self):
+        return self._seed
+
+    def bits(self, stream, keys, t, index=0):
+        """
+        Return four 32 bit random words for each key.
+
+        :param stream: The purpose of the draw (STAGGER, DROP or NOISE).
+        :param keys: Array of 64 bit sensor keys.
+        :param t: Timestamp (scalar or array broadcast against keys).
+        :param index: Distinguishes several draws with the same purpose and timestamp.
+        """
+        keys = np.asarray(keys, dtype=np.uint64)
+        t = np.broadcast_to(np.asarray(t, dtype=np.float64).astype(np.int64).view(np.uint64), keys.shape)
+        purpose = np.uint64((index & 0xFF) << 16) | np.uint64((stream & 0xFF) << 24)
+        words = [t & MASK32, ((t >> SHIFT32) & np.uint64(0xFFFF)) | purpose, keys & MASK32, keys >> SHIFT32]
+        # The rounds run in place, which needs arrays even for a single key.
+        words = [np.asarray(word) for word in words]
+        _philox_rounds(words, self._key[0], self._key[1])
+        return np.stack(words, axis=-1).astype(np.uint32)
+
+    def uniform(self, stream, keys, t, index=0):
+        """
+        Return a uniform value on [0, 1) for each key.
+        """
+        words = self.bits(stream, keys, t, index)
+        return self._to_double(words[..., 0], words[..., 1])
+
+    def normal(self, stream, keys, t, index=0):
+        """
+        Return a standard normal value for each key.
+        """
+        words = self.bits(stream, keys, t, index)
+        u1 = self._to_double(words[..., 0], words[..., 1])
+        u2 = self._to_double(words[..., 2], words[..., 3])
+        return np.sqrt(-2.0 * np.log1p(-u1)) * np.cos(2.0 * np.pi * u2)
+
+    def integers(self, stream, keys, t, high, index=0):
+        """
+        Return an integer on [0, high) for each key.
+        """
+        return np.floor(self.uniform(stream, keys, t, index) * high).astype(np.int64)
+
+    @staticmethod
+    def _to_double(a, b):
+        return ((a >> 5).astype(np.float64) * TWO_POW_26 + (b >> 6).astype(np.float64)) / TWO_POW_53
@@ -0,0 +1,74 @@
+import logging
+
+import numpy as np
+
+_log = logging.getLogger(__file__)
+
+
+class SyntheticFeeder(object):
+    def __init__(self, measurements=1000, angle_fraction=0.75, value_fraction=0.05, normal_value=2400.0,
+                 seed=0, start=1570041113, simulation_id="synthetic"):
+        """
+        Generate `simulation_output` shaped messages for a feeder of arbitrary size.
+
+        Each measurement follows a slow sine wave around the normal value with its own phase
+        so that aggregation produces varying results.  A fraction of the measurements carry
+        an angle and a fraction are discrete (a "value" instead of a magnitude).
+
+        :param measurements: Number of measurement mrids in the feeder.
+        :param angle_fraction: Fraction of the analog measurements that carry an angle.
+        :param value_fraction: Fraction of the measurements that are discrete values.
+        :param normal_value: Normal value of the analog magnitudes.
+        :param seed: Seed for the layout and phases of the measurements.
+        :param start: Timestamp of the first message.
+        :param simulation_id: Simulation id placed in each message.
+        """
+        rng = np.random.default_rng(seed)
+        self._mrids = [f"_synthetic-{index:08d}" for index in range(measurements)]
+        kind = rng.uniform(0, 1, measurements)
+        self._discrete = kind < value_fraction
+        self._angle = ~self._discrete & (rng.uniform(0, 1, measurements) < angle_fraction)
+        self._phase = rng.uniform(0, 2 * np.pi, measurements)
+        self._normal_value = float(normal_value)
+        self._start = start
+        self._simulation_id = simulation_id
+
+    def __len__(self):
+        return len(self._mrids)
+
+    @property
+    def mrids(self):
+        return self._mrids
+
+    @property
+    def start(self):
+        return self._start
+
+    def message(self, t):
+        """
+        Build a new message for timestamp t.
+        """
+        wave = np.sin(2 * np.pi * t / 600.0 + self._phase)
+        magnitude = (self._normal_value * (1.0 + 0.02 * wave)).tolist()
+        angle = (wave * 5.0 - 120.0).tolist()
+        discrete = self._discrete.tolist()
+        has_angle = self._angle.tolist()
+
+        measurements = {}
+        for index, mrid in enumerate(self._mrids):
+            if discrete[index]:
+                measurements[mrid] = {"measurement_mrid": mrid, "value": 1}
+            elif has_angle[index]:
+                measurements[mrid] = {"measurement_mrid": mrid, "magnitude": magnitude[index],
+                                      "angle": angle[index]}
+            else:
+                measurements[mrid] = {"measurement_mrid": mrid, "magnitude": magnitude[index]}
+        return {"simulation_id": self._simulation_id,
+                "message": {"timestamp": t, "measurements": measurements}}
+
+    def messages(self, timesteps, step=1):
+        """
+        Generate a message for each of timesteps consecutive timestamps.
+        """
+        for index in range(timesteps):
+            yield self.message(self._start + index * step)
@@ -52,6 +52,6 @@ README = (HERE / "README.md").read_text()
 setup(
     name="gridappsd-sensor-simulator",
     version=__version__,
-    install_requires=['gridappsd'],
+    install_requires=['gridappsd', 'numpy'],
     packages=['sensors'],
 )
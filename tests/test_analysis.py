@@ -0,0 +1,55 @@
+import os
+
+import numpy as np
+
+from sensors.analysis import downsample, downsample_lttb, downsample_minmax, load_csv
+
+
+def test_load_csv_caches_parsed_array(tmp_path):
+    path = tmp_path / "Input.csv"
+    data = np.column_stack((np.arange(25), np.arange(25) * 0.5))
+    np.savetxt(path, data, fmt=['%d', '%.3f'], delimiter=',', header='t[s],v')
+
+    loaded = load_csv(str(path), chunk_rows=7)
+    assert np.array_equal(loaded, data)
+    cached = [name for name in os.listdir(tmp_path) if name.endswith('.npy')]
+    assert len(cached) == 1
+
+    # The cache is memory mapped and used until the source changes.
+    assert isinstance(load_csv(str(path)), np.memmap)
+    assert np.array_equal(load_csv(str(path), usecols=[1], cache=False), data[:, 1:])
+    assert np.array_equal(load_csv(str(path), skiprows=21), data[20:])
+
+
+def test_load_csv_complex(tmp_path):
+    path = tmp_path / "Transformer.csv"
+    path.write_text("# header\n2019-01-01 00:00:00,+7199.5-0.25j,+1000+20j\n")
+    assert load_csv(str(path), usecols=[1, 2], dtype=complex, cache=False).tolist() == [[7199.5 - 0.25j, 1000 + 20j]]
+
+
+def test_minmax_keeps_extremes_in_order():
+    x = np.arange(1000)
+    y = np.sin(x / 50.0)
+    y[333] = 10
+    y[666] = -10
+    y[400:420] = np.nan
+    kx, ky = downsample_minmax(x, y, 50)
+    assert len(kx) <= 100
+    assert np.all(np.diff(kx) > 0)
+    assert np.nanmax(ky) == 10 and np.nanmin(ky) == -10
+    assert np.isnan(ky).sum() == 1
+    assert np.array_equal(ky, y[kx], equal_nan=True)
+
+
+def test_lttb():
+    x = np.arange(10000)
+    y = np.sin(x / 100.0)
+    y[5000] = 5
+    kx, ky = downsample_lttb(x, y, 200)
+    assert len(kx) == 200
+    assert kx[0] == 0 and kx[-1] == 9999
+    assert np.all(np.diff(kx) > 0)
+    assert 5000 in kx
+
+    assert len(downsample(x, y, 100, 'none')[0]) == 10000
+    assert len(downsample(x[:50], y[:50], 100, 'lttb')[0]) == 50
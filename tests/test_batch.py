@@ -0,0 +1,88 @@
+import json
+
+import numpy as np
+import pytest
+
+from sensors.bank import SensorBank
+from sensors.batch import ColumnSensors, read_table, run_batch
+from sensors.streams import mrid_keys
+
+
+def bank_output(names, t, values, interval, drop_rate, random_seed=0):
+    """
+    The output of the old row by row test mode: a row whenever a sensor reports, holding the
+    latest output of every sensor and 0 for a dropped value.
+    """
+    size = len(names)
+    bank = SensorBank(np.full(size, 100.0), np.broadcast_to(np.asarray(interval, dtype=float), (size,)),
+                      np.full(size, drop_rate), np.full(size, 0.01), random_seed=random_seed,
+                      keys=mrid_keys(names), range_output=True)
+    last = np.zeros((3, size))
+    times = []
+    outputs = []
+    for index, timestamp in enumerate(t):
+        sample = bank.update(timestamp, values[index])
+        if len(sample.rows):
+            reported = np.stack((sample.magnitude, sample.magnitude_min, sample.magnitude_max))
+            reported[:, sample.dropped] = 0.0
+            last[:, sample.rows] = reported
+            times.append(timestamp)
+            outputs.append(last.copy())
+    return np.array(times), np.stack(outputs, axis=1)
+
+
+@pytest.mark.parametrize("interval, step, chunk", [
+    (30, 1.0, 37),
+    (0, 1.0, 50),
+    (7.5, 2.0, 11),
+    ([5, 30, 0, 12], 1.0, 1000),
+    (30, 1.0, 1),
+    (3, None, 23),
+])
+def test_column_sensors_match_bank(interval, step, chunk):
+    rng = np.random.default_rng(1)
+    names = [f"s{index}" for index in range(4)]
+    if step is None:
+        t = 1000.0 + np.cumsum(rng.integers(1, 4, 400))
+    else:
+        t = 1000.0 + np.arange(400) * step
+    values = rng.normal(100.0, 5.0, (400, 4))
+    expected_t, expected = bank_output(names, t, values, interval, 0.1)
+
+    sensors = ColumnSensors(names, 100.0, 0.01, 0.1, interval)
+    table = np.concatenate([sensors.process(t[index:index + chunk], values[index:index + chunk])
+                            for index in range(0, 400, chunk)])
+    assert np.array_equal(table[:, 0], expected_t)
+    # The statistics of each column are next to each other: mean, minimum and maximum.
+    np.testing.assert_allclose(table[:, 1:], expected.transpose(1, 2, 0).reshape(len(expected_t), -1), rtol=1e-10)
+
+
+def test_run_batch_csv_and_npy(tmp_path):
+    t = np.arange(120.0)
+    values = np.column_stack((t, 120.0 + np.sin(t), 10.0 + np.cos(t)))
+    source = tmp_path / "Input.csv"
+    np.savetxt(source, values, fmt='%.6f', delimiter=',', header='t[s],v,i')
+
+    names, chunks = read_table(str(source), chunk_rows=50)
+    assert names == ['v', 'i']
+    assert [len(chunk) for chunk in chunks] == [50, 50, 20]
+
+    config = {"aggregation-interval": [30, 10], "perunit-drop-rate": 0.0}
+    stats = run_batch(str(source), str(tmp_path / "Output.csv"), config, chunk_rows=50)
+    assert stats.rows == 120
+    with open(tmp_path / "Output.csv") as fp:
+        assert fp.readline().strip() == "t,v_avg,v_min,v_max,i_avg,i_min,i_max"
+    table = np.loadtxt(tmp_path / "Output.csv", delimiter=',', skiprows=1)
+    assert len(table) == stats.written > 0
+    # v reports every 30 s, the rows before its first report hold 0.
+    reported = table[:, 1] != 0.0
+    assert reported.sum() < len(table)
+    assert (np.abs(table[reported, 1:4] - 120.0) < 2.0).all()
+
+    binary = tmp_path / "Output.npy"
+    assert run_batch(str(source), str(binary), config, chunk_rows=50).written == stats.written
+    array = np.load(binary)
+    assert array.shape == table.shape
+    np.testing.assert_allclose(array, table, atol=5e-4)
+    with open(f"{binary}.json") as fp:
+        assert json.load(fp)[1:4] == ['v_avg', 'v_min', 'v_max']
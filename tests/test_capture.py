@@ -0,0 +1,62 @@
+import numpy as np
+
+from sensors import Sensors
+from sensors.capture import CaptureReader, ColumnarCapture
+from sensors.synthetic import SyntheticFeeder
+from test_play_sensor import GridAPPSDMock
+
+
+def _columns(timestamp, rows, values):
+    rows = np.asarray(rows)
+    return {'timestamp': np.full(len(rows), timestamp), 'row': rows, 'magnitude': np.asarray(values, dtype=float),
+            'angle': np.full(len(rows), np.nan), 'value': np.asarray(values, dtype=float) * 2,
+            'dropped': rows % 2 == 1}
+
+
+def test_series_spans_chunks(tmp_path):
+    directory = str(tmp_path / "capture")
+    capture = ColumnarCapture(directory, chunk_rows=5)
+    mrids = ["_a", "_b"]
+    for t in range(6):
+        if t == 3:
+            mrids.append("_c")
+        capture.append(_columns(t, range(len(mrids)), [10 * t + row for row in range(len(mrids))]), mrids)
+    capture.close()
+
+    reader = CaptureReader(directory)
+    assert reader.mrids == ["_a", "_b", "_c"]
+    assert len(reader) == 15
+    series = reader.series("_b")
+    assert series['timestamp'].tolist() == list(range(6))
+    assert series['magnitude'].tolist() == [10 * t + 1 for t in range(6)]
+    assert series['dropped'].all()
+    assert reader.series("_c")['timestamp'].tolist() == [3, 4, 5]
+
+    everything = reader.read()
+    assert everything['timestamp'].tolist() == [0, 0, 1, 1, 2, 2] + [t for t in range(3, 6) for _ in range(3)]
+    assert everything['row'].tolist()[:3] == [0, 1, 0]
+
+
+def test_capture_matches_published_values(tmp_path):
+    feeder = SyntheticFeeder(measurements=30, seed=6)
+    gapps = GridAPPSDMock()
+    sensors = Sensors(gapps, "output", "sensors", {
+        "sensor-rules": [{"all": True}], "default-aggregation-interval": 2, "random-seed": 1,
+        "diagnostics": {"measurement-capture": True, "chunk-rows": 50,
+                        "directory": str(tmp_path / "{simulation_id}")}}, simulation_id="1234")
+    for t in range(10):
+        sensors.on_simulation_message({}, feeder.message(feeder.start + t))
+    sensors.close()
+
+    reader = CaptureReader(str(tmp_path / "1234" / "capture"))
+    mrid = reader.mrids[0]
+    series = reader.series(mrid)
+    assert series['timestamp'].tolist() == [feeder.start + t for t in range(10)]
+    published = {m['message']['timestamp']: m['message']['measurements'].get(mrid) for _, m in gapps.sent_data}
+    assert np.isfinite(series['value']).any()
+    for timestamp, value in zip(series['timestamp'], series['value']):
+        measurement = published.get(timestamp)
+        if measurement is None:
+            assert np.isnan(value)
+        else:
+            assert value == measurement['magnitude']
@@ -0,0 +1,67 @@
+import os
+
+import numpy as np
+
+from sensors import Sensors
+from sensors.checkpoint import read_checkpoint, write_checkpoint
+from sensors.synthetic import SyntheticFeeder
+from test_play_sensor import GridAPPSDMock
+
+
+def run(options, messages):
+    gapps = GridAPPSDMock()
+    sensors = Sensors(gapps, "output", "sensors", options, simulation_id="sim")
+    for message in messages:
+        sensors.on_simulation_message({}, message)
+    return sensors, gapps
+
+
+def test_restore_matches_uninterrupted_run(tmp_path):
+    feeder = SyntheticFeeder(measurements=60, seed=10)
+    options = {"sensor-rules": [{"all": True, "perunit-deadband": 0.001}], "default-aggregation-interval": 4,
+               "default-perunit-drop-rate": 0.1, "default-output-mode": "range", "random-seed": 21,
+               "publishing": {"coalesce-timesteps": 3}}
+    _, expected = run(options, feeder.messages(40))
+    expected = expected.sent_data
+
+    options = dict(options, checkpoint={"directory": str(tmp_path / "{simulation_id}"), "interval": 10})
+    # Crash after 25 messages, the last periodic checkpoint is behind the last message.
+    _, first = run(options, feeder.messages(25))
+    sensors, second = run(options, feeder.messages(40))
+    sensors.close()
+
+    # Everything published after the checkpoint is published again, identically.
+    assert 0 < len(second.sent_data) < len(expected)
+    assert first.sent_data == expected[:len(first.sent_data)]
+    assert second.sent_data == expected[-len(second.sent_data):]
+    assert len(first.sent_data) + len(second.sent_data) > len(expected)
+
+
+def test_checkpoint_keeps_the_restored_checkpoint(tmp_path):
+    feeder = SyntheticFeeder(measurements=20, seed=1)
+    options = {"sensor-rules": [{"all": True}], "checkpoint": {"directory": str(tmp_path)}}
+    sensors, _ = run(options, feeder.messages(3))
+    sensors.checkpoint()
+    restored = sensors.checkpoint()
+    assert sorted(os.listdir(tmp_path)) == ["LATEST", os.path.basename(restored)]
+
+    # The restored bank memory maps the latest checkpoint, which is kept while it does.
+    sensors, _ = run(options, [])
+    sensors.checkpoint()
+    latest = sensors.checkpoint()
+    assert sorted(os.listdir(tmp_path)) == ["LATEST", os.path.basename(restored), os.path.basename(latest)]
+
+
+def test_checkpoint_after_crash_before_latest(tmp_path):
+    write_checkpoint(str(tmp_path), {"a": np.arange(3)}, {"step": 0})
+    # A crash after the checkpoint was renamed into place, before LATEST pointed to it.
+    orphan = tmp_path / "checkpoint-00000001"
+    orphan.mkdir()
+    (orphan / "meta.json").write_text("{}")
+    assert read_checkpoint(str(tmp_path))[1]["step"] == 0
+
+    path = write_checkpoint(str(tmp_path), {"a": np.arange(4)}, {"step": 1})
+    assert os.path.basename(path) == "checkpoint-00000002"
+    arrays, meta = read_checkpoint(str(tmp_path))
+    assert meta["step"] == 1 and len(arrays["a"]) == 4
+    assert sorted(os.listdir(tmp_path)) == ["LATEST", "checkpoint-00000002"]
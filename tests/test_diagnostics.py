@@ -0,0 +1,71 @@
+import json
+import os
+import threading
+
+from sensors import diagnostics
+from sensors.diagnostics import DiagnosticsWriter
+
+
+def test_streams_are_off_by_default(tmp_path):
+    writer = DiagnosticsWriter("1234", {"directory": str(tmp_path / "{simulation_id}")})
+    writer.submit('measurement-in', {"a": 1})
+    writer.close()
+    assert not writer.enabled('measurement-in')
+    assert not os.path.exists(tmp_path / "1234")
+
+
+def test_writes_and_rotates(tmp_path):
+    writer = DiagnosticsWriter("1234", {"directory": str(tmp_path / "{simulation_id}"),
+                                        "measurement-in": True,
+                                        "batch-size": 1,
+                                        "max-bytes": 200,
+                                        "backup-count": 2})
+    for index in range(100):
+        writer.submit('measurement-in', {"index": index})
+    writer.close()
+
+    path = writer.path('measurement-in')
+    assert os.path.dirname(path) == str(tmp_path / "1234")
+    assert os.path.exists(path + ".1")
+    assert os.path.exists(path + ".2")
+    assert not os.path.exists(path + ".3")
+
+    with open(path) as fp:
+        lines = [json.loads(line) for line in fp]
+    assert lines[-1] == {"index": 99}
+    assert writer.discarded == 0
+
+
+def test_write_errors_do_not_stop_the_writer(tmp_path, monkeypatch):
+    writer = DiagnosticsWriter("1234", {"directory": str(tmp_path), "measurement-in": True,
+                                        "measurement-out": True})
+    write = writer._write
+
+    def disk_full_for_measurement_in(stream, text):
+        if stream == 'measurement-in':
+            raise OSError(28, "No space left on device")
+        write(stream, text)
+
+    monkeypatch.setattr(writer, '_write', disk_full_for_measurement_in)
+    for index in range(20):
+        writer.submit('measurement-in', {"index": index})
+        writer.submit('measurement-out', {"index": index})
+    writer.close()
+    assert writer.failed > 0
+    with open(writer.path('measurement-out')) as fp:
+        assert [json.loads(line) for line in fp] == [{"index": index} for index in range(20)]
+
+
+def test_close_does_not_hang_on_a_stuck_writer(tmp_path, monkeypatch):
+    monkeypatch.setattr(diagnostics, 'CLOSE_TIMEOUT', 0.05)
+    writer = DiagnosticsWriter("1234", {"directory": str(tmp_path), "measurement-in": True, "queue-size": 1})
+    disk = threading.Event()
+    monkeypatch.setattr(writer, '_write', lambda stream, text: disk.wait())
+    for index in range(3):
+        writer.submit('measurement-in', {"index": index})
+    writer.close()
+    assert writer._thread.is_alive()
+    disk.set()
+    writer._queue.put(diagnostics._STOP)
+    writer._thread.join(5)
+    assert not writer._thread.is_alive()
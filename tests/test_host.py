@@ -0,0 +1,45 @@
+import threading
+
+from sensors.host import SensorHost
+from sensors.synthetic import SyntheticFeeder
+from test_play_sensor import GridAPPSDMock
+
+
+def test_host_runs_isolated_simulations():
+    gapps = GridAPPSDMock()
+    host = SensorHost(gapps, workers=2)
+    feeders = {}
+    for simulation_id in ("1", "2"):
+        feeders[simulation_id] = SyntheticFeeder(measurements=20, seed=int(simulation_id),
+                                                 simulation_id=simulation_id)
+        host.add_simulation(simulation_id, {"sensor-rules": [{"all": True}], "default-aggregation-interval": 0},
+                            f"output.{simulation_id}", f"sensors.{simulation_id}", log_topic=f"log.{simulation_id}",
+                            command_topic=f"input.{simulation_id}")
+    assert sorted(host.simulations) == ["1", "2"]
+
+    loop = threading.Thread(target=host.main_loop)
+    loop.start()
+    for message in range(3):
+        for simulation_id, feeder in feeders.items():
+            gapps.publish(f"output.{simulation_id}", feeder.message(feeder.start + message))
+
+    gapps.publish("log.1", {"processStatus": "COMPLETE"})
+    for _ in range(500):
+        if host.simulations == ["2"]:
+            break
+        threading.Event().wait(0.01)
+    assert host.simulations == ["2"]
+    assert gapps.subscriptions == ["output.2", "log.2", "input.2"]
+
+    host.stop()
+    loop.join()
+    assert host.simulations == []
+    assert gapps.subscriptions == []
+
+    sent = {}
+    for topic, message in gapps.sent_data:
+        sent.setdefault(topic, []).append(message)
+    assert len(sent["sensors.1"]) == len(sent["sensors.2"]) == 3
+    for simulation_id in ("1", "2"):
+        for message in sent[f"sensors.{simulation_id}"]:
+            assert message['simulation_id'] == simulation_id
@@ -0,0 +1,97 @@
+import io
+import logging
+
+import pytest
+
+from sensors import Sensors
+from sensors.logs import RateLimitedLog, RingBufferHandler, configure_logging
+from sensors.synthetic import SyntheticFeeder
+from test_play_sensor import GridAPPSDMock
+
+
+class _Unformattable(object):
+    def __str__(self):
+        raise AssertionError("formatted a message that is not logged")
+
+
+def test_rate_limited_log(caplog):
+    logger = logging.getLogger("test_rate_limited_log")
+    limit = RateLimitedLog(logger, interval=3600)
+    with caplog.at_level(logging.INFO, logger=logger.name):
+        assert limit.log('a', logging.INFO, "first %s", 1)
+        assert not limit.log('a', logging.INFO, "first %s", _Unformattable())
+        assert limit.log('b', logging.INFO, "other")
+        # Below the level the message is neither logged nor counted.
+        assert not limit.log('a', logging.DEBUG, "%s", _Unformattable())
+    assert [r.getMessage() for r in caplog.records] == ["first 1", "other"]
+
+    limit = RateLimitedLog(logger, interval=0)
+    caplog.clear()
+    with caplog.at_level(logging.INFO, logger=logger.name):
+        for value in range(3):
+            limit.log('a', logging.INFO, "value %s", value)
+    assert [r.getMessage() for r in caplog.records] == ["value 0", "value 1", "value 2"]
+
+    limit = RateLimitedLog(logger, interval=3600)
+    caplog.clear()
+    with caplog.at_level(logging.INFO, logger=logger.name):
+        limit.log('a', logging.INFO, "value")
+        limit.log('a', logging.INFO, "value")
+        limit._next['a'] = 0
+        limit.log('a', logging.INFO, "value")
+    assert [r.getMessage() for r in caplog.records] == ["value", "value (suppressed 1 similar messages)"]
+
+    assert not RateLimitedLog(logger, interval=-1).log('a', logging.ERROR, "never")
+
+
+def test_ring_buffer_dumps_detail_on_error():
+    stream = io.StringIO()
+    target = logging.StreamHandler(stream)
+    target.setLevel(logging.INFO)
+    target.setFormatter(logging.Formatter("%(levelname)s %(message)s"))
+    buffer = RingBufferHandler(2, target, threshold=logging.INFO)
+    logger = logging.getLogger("test_ring_buffer")
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(buffer)
+    logger.addHandler(target)
+    try:
+        for value in range(3):
+            logger.debug("detail %d", value)
+        logger.info("summary")
+        assert len(buffer) == 2
+        assert stream.getvalue() == "INFO summary\n"
+        logger.error("failed")
+    finally:
+        logger.removeHandler(buffer)
+        logger.removeHandler(target)
+    lines = stream.getvalue().splitlines()
+    assert lines[1:5] == ["INFO ---- 2 recent records ----", "DEBUG detail 1", "DEBUG detail 2",
+                          "INFO ---- end of recent records ----"]
+    assert lines[-1] == "ERROR failed" and len(buffer) == 0
+
+
+def test_configure_logging_levels():
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    try:
+        for name, expected in (("debug", logging.DEBUG), ("WARNING", logging.WARNING), (logging.ERROR, logging.ERROR)):
+            configure_logging(io.StringIO(), name)
+            assert root.level == expected
+        with pytest.raises(ValueError):
+            configure_logging(io.StringIO(), "loud")
+    finally:
+        root.handlers[:] = handlers
+        root.setLevel(level)
+
+
+def test_sensor_output_is_rate_limited(caplog):
+    feeder = SyntheticFeeder(measurements=20, seed=2)
+    gapps = GridAPPSDMock()
+    sensors = Sensors(gapps, "output", "sensors", {"sensor-rules": [{"all": True}], "default-aggregation-interval": 0,
+                                                   "default-perunit-drop-rate": 0, "log-interval": 3600})
+    with caplog.at_level(logging.INFO):
+        for t in range(5):
+            sensors.on_simulation_message({}, feeder.message(feeder.start + t))
+    assert len(gapps.sent_data) == 5
+    assert [r.getMessage().startswith("Sensor Measurements") for r in caplog.records].count(True) == 1
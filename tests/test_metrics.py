@@ -0,0 +1,51 @@
+from urllib.request import urlopen
+
+from sensors import Sensors
+from sensors.metrics import LatencyHistogram, start_http_server
+from sensors.synthetic import SyntheticFeeder
+from test_play_sensor import GridAPPSDMock
+
+
+def test_latency_histogram():
+    histogram = LatencyHistogram(bounds=(0.001, 0.01, 0.1))
+    for seconds in (0.0005, 0.005, 0.005, 0.05, 1.0):
+        histogram.observe(seconds)
+    assert histogram.count == 5
+    assert histogram.quantile(0.5) == 0.01
+    assert histogram.quantile(1.0) == float('inf')
+    assert list(histogram.cumulative()) == [(0.001, 1), (0.01, 3), (0.1, 4), (float('inf'), 5)]
+
+
+def test_sensor_metrics_published_and_served():
+    feeder = SyntheticFeeder(measurements=30, seed=5)
+    gapps = GridAPPSDMock()
+    options = {"sensor-rules": [{"all": True}], "default-aggregation-interval": 2,
+               "default-perunit-drop-rate": 0.3, "passthrough-if-not-specified": True,
+               "metrics": {"publish-interval": 0.000001}}
+    sensors = Sensors(gapps, "output", "sensors", options, stats_topic="stats")
+    for message in feeder.messages(10):
+        sensors.on_simulation_message({}, message)
+
+    server = start_http_server(0, '127.0.0.1')
+    text = urlopen(f"http://127.0.0.1:{server.server_address[1]}/metrics").read().decode()
+    assert 'sensor_messages_total{simulation_id="output"} 10' in text
+    assert 'sensor_stage_seconds_count{simulation_id="output",stage="sample"} 10' in text
+    sensors.close()
+
+    stats = [message for topic, message in gapps.sent_data if topic == "stats"]
+    assert len(stats) >= 2
+    counters = stats[-1]['counters']
+    assert counters['messages'] == 10
+    assert counters['emitted'] > 0 and counters['dropped'] > 0
+    assert counters['emitted'] + counters['passthrough'] == 10 * len(feeder)
+
+
+def test_disabled_metrics_are_not_published():
+    gapps = GridAPPSDMock()
+    options = {"sensor-rules": [{"all": True}], "metrics": {"enabled": False, "publish-interval": 0.000001}}
+    sensors = Sensors(gapps, "output", "sensors", options, stats_topic="stats")
+    for message in SyntheticFeeder(measurements=5, seed=5).messages(3):
+        sensors.on_simulation_message({}, message)
+    sensors.close()
+    assert sensors.metrics.snapshot()['counters']['messages'] == 3
+    assert not [message for topic, message in gapps.sent_data if topic == "stats"]
@@ -0,0 +1,40 @@
+from sensors import Sensors
+from sensors.pipeline import BoundedQueue
+from sensors.synthetic import SyntheticFeeder
+from test_play_sensor import GridAPPSDMock
+
+
+def test_backpressure_policies():
+    queue = BoundedQueue(2, 'drop-oldest')
+    for item in range(4):
+        queue.put(item)
+    assert [queue.get(), queue.get()] == [2, 3]
+    assert queue.discarded == 2
+
+    queue = BoundedQueue(2, 'coalesce')
+    for item in range(5):
+        queue.put(item)
+    assert len(queue) == 1 and queue.get() == 4
+    assert queue.discarded == 4
+
+
+def test_pipeline_matches_direct_processing():
+    feeder = SyntheticFeeder(measurements=50, seed=8)
+    options = {"sensor-rules": [{"all": True}], "default-aggregation-interval": 3, "random-seed": 3}
+
+    outputs = []
+    for pipeline in (None, {"queue-size": 4, "policy": "block"}):
+        gapps = GridAPPSDMock()
+        sensors = Sensors(gapps, "output", "sensors", dict(options, pipeline=pipeline))
+        sensors.subscribe()
+        for message in feeder.messages(20):
+            gapps.publish("output", message)
+        sensors.close()
+        outputs.append(gapps.sent_data)
+        if pipeline:
+            statistics = sensors.pipeline.statistics
+            assert statistics['processed'] == 20
+            assert statistics['depth'] == statistics['discarded'] == statistics['lag'] == 0
+
+    assert len(outputs[0]) > 0
+    assert outputs[0] == outputs[1]
@@ -1,9 +1,13 @@
 from typing import List
 
 from sensors import Sensors
+from sensors.synthetic import SyntheticFeeder
 from copy import deepcopy
 import json
+import logging
 import os
+import threading
+import time
 
 data_file = os.path.join(os.path.dirname(__file__), "measurment-13-node-120s.json")
 
@@ -18,7 +22,7 @@ def run_sensors(gapps, user_options):
     """
     sensors = Sensors(gapps, "read", "write", user_options)
     for data in next_line():
-        sensors.on_simulation_message({}, deepcopy(data))
+        sensors.on_simulation_message({}, data)
 
 
 def next_line():
@@ -56,10 +60,31 @@ class GridAPPSDMock:
     def __init__(self):
         self._sent_data = []
         self._logger = None
+        self._subscriptions = {}
 
     def send(self, topic, message):
         self._sent_data.append((topic, message))
 
+    def subscribe(self, topic, callback):
+        conn_id = len(self._subscriptions)
+        self._subscriptions[conn_id] = (topic, callback)
+        return conn_id
+
+    def unsubscribe(self, conn_id):
+        del self._subscriptions[conn_id]
+
+    def publish(self, topic, message):
+        """
+        Deliver a message to the callbacks subscribed to topic.
+        """
+        for subscribed_topic, callback in list(self._subscriptions.values()):
+            if subscribed_topic == topic:
+                callback({}, message)
+
+    @property
+    def subscriptions(self):
+        return [topic for topic, _ in self._subscriptions.values()]
+
     def get_logger(self):
         return self._logger
 
@@ -124,3 +149,150 @@ def test_random_seed():
     user_options['random-seed'] = 300
     run_sensors(gapps3, user_options)
     assert gapps != gapps3
+
+
+def test_main_loop_stops_when_simulation_completes():
+    """
+    Test that the main loop blocks until the simulation log reports completion and then
+    unsubscribes from every topic.
+    """
+    gapps = GridAPPSDMock()
+    sensors = Sensors(gapps, "read", "write", {"sensors-config": {"_m0": {}}}, log_topic="log",
+                      control_topic="control")
+    thread = threading.Thread(target=sensors.main_loop)
+    thread.start()
+    for _ in range(500):
+        if len(gapps.subscriptions) == 3:
+            break
+        time.sleep(0.01)
+    assert sorted(gapps.subscriptions) == ["control", "log", "read"]
+
+    gapps.publish("log", {"processStatus": "RUNNING"})
+    # Other apps log errors on the same topic.
+    gapps.publish("log", {"processStatus": "ERROR", "source": "another-app", "logMessage": "failed"})
+    thread.join(0.1)
+    assert thread.is_alive()
+
+    gapps.publish("log", json.dumps({"processStatus": "COMPLETE"}))
+    thread.join(5)
+    assert not thread.is_alive()
+    assert gapps.subscriptions == []
+
+    # Messages arriving after shutdown are ignored.
+    sensors.on_simulation_message({}, {"message": {"timestamp": 0, "measurements": {}}})
+    assert gapps.sent_data == []
+
+
+def test_passthrough_replaces_only_reported_sensors():
+    """
+    Test that passthrough publishes every inbound measurement, replaces the reporting
+    sensors with new objects and leaves the inbound measurement objects untouched.
+    """
+    feeder = SyntheticFeeder(measurements=50, seed=3)
+    configured = feeder.mrids[:10]
+    gapps = GridAPPSDMock()
+    sensors = Sensors(gapps, "read", "write", {"sensors-config": {mrid: {} for mrid in configured},
+                                               "default-aggregation-interval": 0,
+                                               "default-perunit-drop-rate": 0,
+                                               "passthrough-if-not-specified": True})
+    message = feeder.message(feeder.start)
+    inbound = deepcopy(message['message']['measurements'])
+    originals = dict(message['message']['measurements'])
+
+    sensors.on_simulation_message({}, message)
+
+    _, sent = gapps.get_last_received()
+    measurements = sent['message']['measurements']
+    assert list(measurements) == list(inbound)
+    for mrid, item in measurements.items():
+        assert originals[mrid] == inbound[mrid]
+        if mrid in configured and 'magnitude' in inbound[mrid]:
+            assert item is not originals[mrid]
+            assert item['magnitude'] != inbound[mrid]['magnitude']
+        else:
+            assert item is originals[mrid]
+
+
+def test_measurement_plan_reports_missing_once_and_rebuilds(caplog):
+    feeder = SyntheticFeeder(measurements=20, value_fraction=0, seed=4)
+    configured = feeder.mrids[:5] + ["_not-in-model"]
+    gapps = GridAPPSDMock()
+    sensors = Sensors(gapps, "read", "write", {"sensors-config": {mrid: {} for mrid in configured},
+                                               "default-aggregation-interval": 0,
+                                               "default-perunit-drop-rate": 0})
+    with caplog.at_level(logging.ERROR):
+        for t in range(3):
+            sensors.on_simulation_message({}, feeder.message(feeder.start + t))
+    assert [r.getMessage() for r in caplog.records].count("Invalid sensor mrid configured _not-in-model") == 1
+    plan = sensors._plan
+
+    # A new measurement in the model rebuilds the plan and picks up the sensor.
+    message = feeder.message(feeder.start + 3)
+    message['message']['measurements']["_not-in-model"] = {"measurement_mrid": "_not-in-model", "magnitude": 1.0}
+    sensors.on_simulation_message({}, message)
+    assert sensors._plan is not plan
+    assert sensors._plan.missing == []
+    _, sent = gapps.get_last_received()
+    assert set(sent['message']['measurements']) == set(configured)
+
+    # A measurement that disappears is reported once, through the rate limited log.
+    caplog.clear()
+    with caplog.at_level(logging.ERROR):
+        for t in range(4, 7):
+            message = feeder.message(feeder.start + t)
+            del message['message']['measurements'][configured[0]]
+            sensors.on_simulation_message({}, message)
+    assert [r.getMessage() for r in caplog.records] == [f"Invalid sensor mrid configured {configured[0]}"]
+
+
+def test_measurement_plan_rebuilds_when_the_layout_changes():
+    feeder = SyntheticFeeder(measurements=20, angle_fraction=0.5, value_fraction=0.2, seed=4)
+    gapps = GridAPPSDMock()
+    sensors = Sensors(gapps, "read", "write", {"sensor-rules": [{"all": True}], "default-aggregation-interval": 0,
+                                               "default-perunit-drop-rate": 0})
+    measurements = feeder.message(feeder.start)['message']['measurements']
+    plain = next(mrid for mrid, item in measurements.items() if 'magnitude' in item and 'angle' not in item)
+    discrete = next(mrid for mrid, item in measurements.items() if 'magnitude' not in item)
+    sensors.on_simulation_message({}, feeder.message(feeder.start))
+
+    # The same measurements, one of them gains an angle.
+    message = feeder.message(feeder.start + 1)
+    message['message']['measurements'][plain]['angle'] = 12.0
+    measurements = deepcopy(message['message']['measurements'])
+    sensors.on_simulation_message({}, message)
+    _, angle, _ = sensors._plan.gather(measurements)
+    assert angle[sensors._rows[plain]] == 12.0
+
+    # The same number of measurements, a measurement without a sensor is replaced by a new one.
+    message = feeder.message(feeder.start + 2)
+    measurements = message['message']['measurements']
+    del measurements[discrete]
+    measurements["_replacement"] = {"measurement_mrid": "_replacement", "magnitude": 1.0}
+    sensors.on_simulation_message({}, message)
+    _, sent = gapps.get_last_received()
+    assert "_replacement" in sent['message']['measurements']
+
+
+def test_documented_user_options(tmp_path, caplog):
+    """
+    Test that the user options laid out in the `Sensors` docstring configure the sensors, with
+    sensor-rules read next to sensors-config rather than taken for an mrid.
+    """
+    doc = Sensors.__init__.__doc__
+    start = doc.index('{')
+    options = json.loads(doc[start:doc.index('\n\n', start)])
+    assert "sensor-rules" in options and "sensor-rules" not in options["sensors-config"]
+    options["checkpoint"]["directory"] = str(tmp_path / "checkpoint")
+    options["profiling"]["directory"] = str(tmp_path)
+
+    gapps = GridAPPSDMock()
+    feeder = SyntheticFeeder(measurements=20, seed=2)
+    sensors = Sensors(gapps, "read", "write", options, simulation_id="sim",
+                      measurement_info={feeder.mrids[0]: {"type": "PNV", "phases": "A"}})
+    for message in feeder.messages(3):
+        sensors.on_simulation_message({}, message)
+    sensors.close()
+    assert gapps.sent_data
+    assert len(sensors._mrids) == 20
+    invalid = [record.args[0] for record in caplog.records if record.msg.startswith("Invalid sensor mrid")]
+    assert sorted(invalid) == sorted(options["sensors-config"])
@@ -0,0 +1,77 @@
+import os
+
+import pytest
+
+from sensors import Sensors
+from sensors.player import PlayerFeeder, PlayerPoint, PlayerSignal, read_player
+from test_play_sensor import GridAPPSDMock
+
+PHASE_A = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "phase_A.player")
+
+
+def test_read_player(tmp_path):
+    path = tmp_path / "load.player"
+    path.write_text("# comment\n2013-07-01 00:00:00 PST,10\n+30s,20\n\n+1m,40.5\n2013-07-01 01:00:00,0\n")
+    assert list(read_player(str(path))) == [PlayerPoint(1372636800.0, 10.0), PlayerPoint(1372636830.0, 20.0),
+                                            PlayerPoint(1372636890.0, 40.5), PlayerPoint(1372640400.0, 0.0)]
+
+    points = list(read_player(PHASE_A))
+    assert len(points) == 3001
+    assert points[-1].timestamp - points[0].timestamp == 3000 * 30
+
+
+def test_read_complex_player(tmp_path):
+    path = tmp_path / "voltage.player"
+    path.write_text("2013-07-01 00:00:00,+7200+0j\n+30s,-3600-6235.383i\n+30s,7200+120d\n+30s,7200-1.5708r\n")
+    points = list(read_player(str(path)))
+    assert [point.value for point in points] == pytest.approx([7200.0, 7200.0, 7200.0, 7200.0])
+    assert [point.angle for point in points] == pytest.approx([0.0, -120.0, 120.0, -90.0], abs=1e-3)
+
+    path.write_text("2013-07-01 00:00:00,7200+j\n")
+    with pytest.raises(ValueError, match="invalid value"):
+        list(read_player(str(path)))
+
+
+def test_player_signal_interpolates():
+    points = [PlayerPoint(100.0, 1.0), PlayerPoint(130.0, 4.0), PlayerPoint(160.0, 1.0)]
+    signal = PlayerSignal(points)
+    assert [signal.at(t) for t in (90, 100, 110, 130, 145, 160, 200)] == [1.0, 1.0, 2.0, 4.0, 2.5, 1.0, 1.0]
+    with pytest.raises(ValueError):
+        signal.at(150)
+    assert signal.finished(201)
+
+    signal = PlayerSignal(points, interpolation='hold')
+    assert [signal.at(t) for t in (110, 140)] == [1.0, 4.0]
+
+    # The angle of a complex player turns the short way, through 180 degrees.
+    signal = PlayerSignal([PlayerPoint(100.0, 1.0, 170.0), PlayerPoint(120.0, 1.0, -170.0)])
+    assert [signal.angle(t) for t in (100, 105, 115, 130)] == pytest.approx([170.0, 175.0, -175.0, -170.0])
+    assert PlayerSignal(points).angle(110) is None
+
+
+def test_player_feeder_drives_sensors():
+    feeder = PlayerFeeder([PHASE_A, PHASE_A], measurements=10, scale=0.001, seed=3)
+    again = PlayerFeeder([PHASE_A, PHASE_A], measurements=10, scale=0.001, seed=3)
+    first = feeder.message(feeder.start)
+    assert first == again.message(again.start)
+    assert first['message']['timestamp'] == 1372636800
+    magnitudes = [m['magnitude'] for m in first['message']['measurements'].values()]
+    assert all(110.125 * 0.95 <= value <= 110.125 * 1.05 for value in magnitudes)
+    assert len(set(magnitudes)) == 10
+
+    gapps = GridAPPSDMock()
+    sensors = Sensors(gapps, "output", "sensors", {"sensor-rules": [{"all": True}],
+                                                   "default-aggregation-interval": 60})
+    messages = list(feeder.messages(step=600))
+    assert len(messages) == 151
+    for message in messages:
+        sensors.on_simulation_message({}, message)
+    assert len(gapps.sent_data) > 100
+
+
+def test_player_feeder_uses_complex_angles():
+    points = [PlayerPoint(100.0, 7200.0, -120.0), PlayerPoint(160.0, 7200.0, -120.0)]
+    feeder = PlayerFeeder([points, [PlayerPoint(100.0, 10.0)]], measurements=4, scale_spread=0, angle_fraction=1)
+    measurements = list(feeder.message(130)['message']['measurements'].values())
+    assert [m['magnitude'] for m in measurements] == [7200.0, 10.0, 7200.0, 10.0]
+    assert [m['angle'] for m in measurements] == pytest.approx([-120.0, -120.0, -120.0, -120.0])
@@ -0,0 +1,56 @@
+import os
+import time
+
+from sensors import Sensors
+from sensors.synthetic import SyntheticFeeder
+from test_play_sensor import GridAPPSDMock
+
+
+def test_profile_started_from_command_topic(tmp_path):
+    feeder = SyntheticFeeder(measurements=200, seed=6)
+    options = {"sensor-rules": [{"all": True}],
+               "profiling": {"directory": str(tmp_path / "{simulation_id}")}}
+    sensors = Sensors(GridAPPSDMock(), "output", "sensors", options, simulation_id="sim")
+    messages = feeder.messages(6)
+    sensors.on_simulation_message({}, next(messages))
+    assert not sensors.profiler.active
+
+    # The simulation input topic belongs to the simulator, profile commands there are ignored.
+    sensors.on_simulation_status({}, {"command": "profile", "messages": 2})
+    sensors.on_simulation_message({}, next(messages))
+    assert not sensors.profiler.active
+
+    # The profile is switched on by the thread processing the messages.
+    sensors.on_service_command({}, {"command": "profile", "messages": 2})
+    assert not sensors.profiler.active
+    sensors.on_simulation_message({}, next(messages))
+    assert sensors.profiler.active
+    sensors.on_simulation_message({}, next(messages))
+    assert not sensors.profiler.active
+    profiles = sorted(os.listdir(tmp_path / "sim"))
+    assert [name.rsplit('.', 1)[1] for name in profiles] == ['prof', 'txt']
+    assert '_process_message' in (tmp_path / "sim" / profiles[1]).read_text()
+
+    sensors.on_service_command({}, '{"command": "profile", "mode": "sampling", "interval": 0.0001}')
+    for message in messages:
+        sensors.on_simulation_message({}, message)
+    sensors.close()
+    folded = [name for name in os.listdir(tmp_path / "sim") if name.endswith('.folded')]
+    assert len(folded) == 1
+
+
+def test_idle_profile_written_at_deadline(tmp_path):
+    feeder = SyntheticFeeder(measurements=50, seed=6)
+    options = {"sensor-rules": [{"all": True}],
+               "profiling": {"directory": str(tmp_path), "seconds": 0.05}}
+    sensors = Sensors(GridAPPSDMock(), "output", "sensors", options, simulation_id="sim")
+    sensors.on_simulation_message({}, feeder.message(feeder.start))
+    assert sensors.profiler.active
+
+    # No more messages arrive, the timer writes the profile.
+    for _ in range(200):
+        if len(os.listdir(tmp_path)) == 2:
+            break
+        time.sleep(0.01)
+    assert not sensors.profiler.active
+    assert sorted(name.rsplit('.', 1)[1] for name in os.listdir(tmp_path)) == ['prof', 'txt']
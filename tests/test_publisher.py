@@ -0,0 +1,45 @@
+import json
+
+from sensors.publisher import FrameAssembler, FramePublisher
+from sensors.synthetic import SyntheticFeeder
+
+
+class RecordingSink(object):
+    def __init__(self):
+        self.sent = []
+
+    def send(self, topic, message):
+        self.sent.append(message)
+
+
+def test_frames_reassemble_to_the_messages():
+    feeder = SyntheticFeeder(measurements=300, seed=4)
+    messages = list(feeder.messages(5))
+    sink = RecordingSink()
+    publisher = FramePublisher(sink, "out", "sim", {"max-bytes": 4096, "max-measurements": 280,
+                                                    "coalesce-timesteps": 2})
+    for message in messages:
+        publisher.publish(json.loads(json.dumps(message)))
+    publisher.flush()
+
+    assert publisher.frames == len(sink.sent)
+    assert all(len(frame) <= 4096 for frame in sink.sent)
+    frames = [json.loads(frame) for frame in sink.sent]
+    assert all(sum(len(m['measurements']) for m in frame['messages']) <= 280 for frame in frames)
+    assert sorted({frame['sequence'] for frame in frames}) == [0, 1, 2]
+
+    assembler = FrameAssembler()
+    rebuilt = []
+    for frame in reversed(frames):
+        rebuilt.extend(assembler.add(frame))
+    rebuilt.sort(key=lambda message: message['message']['timestamp'])
+    expected = [{"simulation_id": "sim", "message": message['message']} for message in messages]
+    assert rebuilt == expected
+
+
+def test_unframed_messages_are_sent_as_is():
+    sink = RecordingSink()
+    publisher = FramePublisher(sink, "out", "sim")
+    message = {"message": {"timestamp": 1, "measurements": {}}}
+    publisher.publish(message)
+    assert sink.sent == [message]
@@ -0,0 +1,27 @@
+import numpy as np
+
+from sensors import quantiles
+
+
+def _sketch(data):
+    heights = np.zeros((quantiles.MARKERS, len(data)))
+    positions = np.zeros((quantiles.MARKERS, len(data)))
+    quantiles.reset(heights, data[:, 0])
+    for column in range(1, data.shape[1]):
+        quantiles.insert(heights, positions, data[:, column], np.full(len(data), column + 1))
+    return quantiles.estimate(heights, positions, np.full(len(data), data.shape[1])).T
+
+
+def test_sketch_is_exact_for_few_values():
+    data = np.random.default_rng(0).normal(size=(50, quantiles.MARKERS))
+    for count in range(1, quantiles.MARKERS + 1):
+        expected = np.percentile(data[:, :count], [5, 95], axis=1).T
+        assert np.allclose(_sketch(data[:, :count]), expected)
+
+
+def test_sketch_tracks_percentiles():
+    rng = np.random.default_rng(1)
+    data = rng.normal(size=(200, 1000)) * rng.uniform(1, 5, size=(200, 1)) + rng.uniform(-10, 10, size=(200, 1))
+    error = np.abs(_sketch(data) - np.percentile(data, [5, 95], axis=1).T) / data.std(axis=1)[:, np.newaxis]
+    assert error.mean() < 0.05
+    assert error.max() < 0.5
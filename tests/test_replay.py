@@ -0,0 +1,112 @@
+import io
+import json
+import os
+import socket
+
+import pytest
+
+from sensors.replay import read_lines, read_messages, replay
+from sensors import metrics, sharded
+from sensors.sharded import sharded_replay
+from sensors.sinks import JsonlSink
+from sensors.synthetic import SyntheticFeeder
+
+
+def test_replay_writes_sensor_output(tmp_path):
+    feeder = SyntheticFeeder(measurements=40, seed=1)
+    capture = tmp_path / "measurement.infile.txt.gz"
+    sink = JsonlSink(capture)
+    for message in feeder.messages(45):
+        sink.send("capture", message)
+    sink.close()
+
+    user_options = {"sensors-config": {mrid: {} for mrid in feeder.mrids[:20]},
+                    "default-aggregation-interval": 5,
+                    "random-seed": 7}
+    output = tmp_path / "out.jsonl"
+    sink = JsonlSink(output)
+    stats = replay(read_messages(capture), sink, user_options)
+    sink.close()
+
+    assert stats.messages == 45
+    with open(output) as fp:
+        published = [json.loads(line) for line in fp]
+    assert len(published) == stats.published > 0
+    for message in published:
+        assert set(message['message']['measurements']) <= set(feeder.mrids[:20])
+
+
+def test_sharded_replay_matches_single_process(tmp_path):
+    feeder = SyntheticFeeder(measurements=30, seed=2)
+    capture = tmp_path / "capture.jsonl"
+    sink = JsonlSink(capture)
+    for message in feeder.messages(25):
+        sink.send("capture", message)
+    sink.close()
+
+    user_options = {"sensors-config": {mrid: {} for mrid in feeder.mrids[5:25]},
+                    "default-aggregation-interval": 3,
+                    "default-perunit-drop-rate": 0.2,
+                    "sensor-rules": [{"pattern": "*[02468]", "output-mode": "range"}],
+                    "passthrough-if-not-specified": True,
+                    "random-seed": 11}
+    single = tmp_path / "single.jsonl"
+    sink = JsonlSink(single)
+    expected = replay(read_messages(capture), sink, user_options)
+    sink.close()
+
+    sharded = tmp_path / "sharded.jsonl"
+    with open(sharded, 'w') as fp:
+        stats = sharded_replay(read_lines(capture), fp, user_options, workers=3, rows_per_chunk=7)
+
+    assert stats.messages == expected.messages
+    assert stats.published == expected.published
+    assert sharded.read_text() == single.read_text()
+
+    with pytest.raises(ValueError, match="publishing"):
+        sharded_replay(read_lines(capture), io.StringIO(), dict(user_options, publishing={"max-measurements": 5}))
+
+
+def test_sharded_replay_reports_new_sensors(tmp_path):
+    feeder = SyntheticFeeder(measurements=10, seed=2)
+    lines = [json.dumps(feeder.message(feeder.start + t)) for t in range(3)]
+    message = feeder.message(feeder.start + 3)
+    message['message']['measurements']['_new'] = {"measurement_mrid": "_new", "magnitude": 1.0}
+    lines.append(json.dumps(message))
+    with pytest.raises(ValueError, match="New sensors"):
+        sharded_replay(lines, io.StringIO(), {"sensor-rules": [{"all": True}]}, workers=2)
+
+
+def test_sharded_replay_leaves_out_service_options():
+    feeder = SyntheticFeeder(measurements=10, seed=3)
+    lines = [json.dumps(feeder.message(feeder.start + t)) for t in range(5)]
+    user_options = {"sensor-rules": [{"all": True}], "default-aggregation-interval": 2}
+    expected = io.StringIO()
+    sharded_replay(lines, expected, user_options, workers=2)
+
+    # Every process would serve the metrics on the same port and start its own profiler.
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    output = io.StringIO()
+    sharded_replay(lines, output, dict(user_options, metrics={"enabled": True, "port": port},
+                                       profiling={"messages": 2}), workers=2)
+    assert output.getvalue() == expected.getvalue()
+    assert port not in metrics._servers
+
+
+def test_sharded_replay_reports_worker_start_errors(monkeypatch):
+    coordinator = os.getpid()
+    create_sensors = sharded._create_sensors
+
+    def fail_in_workers(*args):
+        if os.getpid() != coordinator:
+            raise RuntimeError("worker failed")
+        return create_sensors(*args)
+
+    # The workers are forked and inherit the patch.
+    monkeypatch.setattr(sharded, '_create_sensors', fail_in_workers)
+    feeder = SyntheticFeeder(measurements=10, seed=2)
+    lines = [json.dumps(feeder.message(feeder.start + t)) for t in range(3)]
+    with pytest.raises(RuntimeError, match="worker failed"):
+        sharded_replay(lines, io.StringIO(), {"sensor-rules": [{"all": True}]}, workers=2)
@@ -0,0 +1,41 @@
+import pytest
+
+from sensors.rules import SensorRules
+from sensors.sensor import Sensors
+from sensors.sinks import NullSink
+from sensors.synthetic import SyntheticFeeder
+
+
+def test_rule_precedence():
+    rules = SensorRules({"_exact": {"normal-value": 1}}, [
+        {"prefix": "_ex", "normal-value": 2},
+        {"pattern": "_ex*", "exclude": True, "priority": 5},
+        {"all": True, "normal-value": 3},
+        {"measurement-type": "PNV", "phase": ["A", "B"], "normal-value": 4, "priority": 1}
+    ])
+    assert rules.needs_info
+    # Exact entries win over every rule.
+    assert rules.match("_exact") == {"normal-value": 1}
+    # Higher priority wins over list order.
+    assert rules.match("_exclude") is None
+    assert rules.match("_other", {"type": "PNV", "phases": "BC"}) == {"normal-value": 4}
+    assert rules.match("_other", {"type": "PNV", "phases": "C"}) == {"normal-value": 3}
+    assert rules.match("_other") == {"normal-value": 3}
+
+
+def test_rule_without_condition():
+    with pytest.raises(ValueError):
+        SensorRules(rules=[{"normal-value": 1}])
+
+
+def test_rules_create_sensors_lazily():
+    feeder = SyntheticFeeder(measurements=200, seed=3)
+    options = {"sensor-rules": [{"pattern": "_synthetic-000000[0-4]?", "normal-value": 2400}]}
+    sensors = Sensors(NullSink(), "read", "write", options)
+    assert len(sensors.bank) == 0
+
+    message = feeder.message(feeder.start)
+    sensors.gather_measurements(message['message']['measurements'])
+    expected = [mrid for mrid in feeder.mrids[:50] if 'magnitude' in message['message']['measurements'][mrid]]
+    assert list(sensors.mrids) == expected
+    assert len(sensors.bank) == len(expected)
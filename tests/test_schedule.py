@@ -0,0 +1,38 @@
+import numpy as np
+
+from sensors import SensorBank
+from sensors.schedule import TimingWheel
+
+
+def test_wheel_returns_rows_by_slot():
+    wheel = TimingWheel()
+    wheel.schedule(np.array([3, 1, 2]), np.array([10.5, 4.0, 10.0]))
+    wheel.schedule(np.array([7]), 2.0)
+    assert len(wheel) == 4
+    assert wheel.pop_due(1.9).tolist() == []
+    assert wheel.pop_due(5).tolist() == [1, 7]
+    # Rows are returned for their whole slot, the caller checks the exact deadline.
+    assert wheel.pop_due(10).tolist() == [2, 3]
+    assert len(wheel) == 0
+
+
+def test_due_rows_match_a_full_scan():
+    """
+    Test that the rows the timing wheel finds due are the rows whose interval has closed.
+    """
+    rng = np.random.default_rng(11)
+    size = 500
+    bank = SensorBank(normal_value=100, aggregation_interval=rng.choice([0, 1, 2.5, 5, 30, 60], size),
+                      perunit_drop_rate=0.1, perunit_confidence_band=0.01, random_seed=3,
+                      deadband=rng.choice([0, 1], size), range_output=rng.random(size) < 0.5)
+    reference = bank.subset(np.arange(size))
+    for t in range(200):
+        present = rng.random(size) < 0.9
+        values = 100 + rng.normal(size=size)
+        sample = bank.update(t, values, present=present)
+
+        rows = np.flatnonzero(present)
+        reference.add_samples(t, np.column_stack((values[rows], np.full(len(rows), np.nan))), rows)
+        ready = reference.ready_to_sample(t, rows)
+        assert sample.rows.tolist() == ready.tolist()
+        reference.take_inst_samples(t, ready)
@@ -0,0 +1,175 @@
+import numpy as np
+
+from sensors import Sensor, SensorBank
+from sensors.streams import RandomStreams, mrid_keys, philox4x32
+
+
+def test_bank_matches_sensor_statistics():
+    """
+    Test that a bank row aggregates a series exactly the way a `Sensor` does.
+    """
+    intervals = [0, 5, 30]
+    bank = SensorBank(normal_value=100, aggregation_interval=intervals, perunit_drop_rate=0,
+                      perunit_confidence_band=0, random_seed=42)
+    sensors = [Sensor(100, interval, 0, 0) for interval in intervals]
+
+    values = 100 + np.sin(np.arange(200) / 7.0) * 10
+    for step, value in enumerate(values):
+        t = 1000 + step
+        sample = bank.update(t, np.full(len(intervals), value))
+        emitted = dict(zip(sample.rows[sample.emit], sample.magnitude[sample.emit]))
+        for index, sensor in enumerate(sensors):
+            if step == 0:
+                # Use the same staggered start the bank chose.
+                sensor.initialize(t, value)
+                sensor.reset_interval(bank.tstart[index], value)
+            expected = sensor.get_new_value(t, value)
+            if expected is None:
+                assert index not in emitted
+            else:
+                assert np.isclose(emitted[index], expected)
+
+
+def test_bank_drops_and_absent_sensors():
+    bank = SensorBank(normal_value=100, aggregation_interval=0, perunit_drop_rate=[0, 1],
+                      perunit_confidence_band=0.01, random_seed=1)
+    sample = bank.update(0, [100, 100], angle=[10, 10])
+    assert sample.emit.tolist() == [True, False]
+    assert sample.dropped.tolist() == [False, True]
+
+    sample = bank.update(1, [100, 100], present=np.array([False, False]))
+    assert not sample.emit.any()
+    assert not sample.dropped.any()
+
+
+def test_streams_are_order_independent():
+    """
+    Test that a sensor produces the same values no matter which other sensors share its
+    bank, and the same values as a `Sensor` drawing from the same streams.
+    """
+    mrids = [f"_mrid{i}" for i in range(6)]
+    keys = mrid_keys(mrids)
+    values = 100 + np.cos(np.arange(120) / 5.0) * 3
+
+    def run(rows):
+        bank = SensorBank(normal_value=100, aggregation_interval=7, perunit_drop_rate=0.2,
+                          perunit_confidence_band=0.02, random_seed=500, keys=keys[rows])
+        results = {}
+        for step, value in enumerate(values):
+            sample = bank.update(step, np.full(len(rows), value))
+            for row, magnitude in zip(sample.rows[sample.emit], sample.magnitude[sample.emit]):
+                results[(mrids[rows[row]], step)] = magnitude
+        return results
+
+    everything = run(np.arange(6))
+    shards = run(np.array([4, 0, 2]))
+    shards.update(run(np.array([5, 1, 3])))
+    assert everything == shards
+
+    streams = RandomStreams(500)
+    sensor = Sensor(100, 7, 0.2, 0.02, streams=streams, key=keys[3])
+    expected = {}
+    for step, value in enumerate(values):
+        new_value = sensor.get_new_value(step, value)
+        if new_value is not None:
+            expected[(mrids[3], step)] = new_value
+    assert expected == {k: v for k, v in everything.items() if k[0] == mrids[3]}
+
+
+def test_bank_range_matches_sensor():
+    keys = mrid_keys(["_range"])
+    bank = SensorBank(normal_value=100, aggregation_interval=6, perunit_drop_rate=0.1,
+                      perunit_confidence_band=0.02, random_seed=9, keys=keys, range_output=True)
+    sensor = Sensor(100, 6, 0.1, 0.02, streams=RandomStreams(9), key=keys[0])
+    sensor.add_property_sensor('angle', 180, 6, 0.1, 0.02)
+    angle_sensor = sensor.get_property_sensor('angle')
+
+    emitted = 0
+    for step in range(100):
+        value, angle = 100 + np.sin(step / 3.0) * 4, -120 + np.cos(step / 4.0)
+        sample = bank.update(step, [value], [angle])
+        expected = sensor.get_new_range(step, value)
+        expected_angle = angle_sensor.get_new_range(step, angle)
+        if expected is None or expected[0] is None:
+            assert not sample.emit.any()
+            continue
+        emitted += 1
+        assert sample.rows.tolist() == [0] and sample.emit[0]
+        assert np.allclose([sample.magnitude[0], sample.magnitude_min[0], sample.magnitude_max[0]], expected)
+        assert np.allclose([sample.angle[0], sample.angle_min[0], sample.angle_max[0]], expected_angle)
+        assert sample.magnitude_min[0] < sample.magnitude_max[0]
+    assert emitted > 0
+
+
+def test_bank_deadband():
+    bank = SensorBank(normal_value=100, aggregation_interval=0, perunit_drop_rate=0,
+                      perunit_confidence_band=0, deadband=[0, 0.5, 0], perunit_deadband=[0, 0, 0.02],
+                      max_silence_interval=[0, 0, 3])
+    rows = np.arange(3)
+    published = []
+    for t, value in enumerate([100, 100.4, 101, 101, 101, 101, 104]):
+        values = np.column_stack((np.full(3, value), np.full(3, np.nan)))
+        published.append((~bank.apply_deadband(t, values, rows)).tolist())
+
+    assert [row[0] for row in published] == [True] * 7
+    assert [row[1] for row in published] == [True, False, True, False, False, False, True]
+    assert [row[2] for row in published] == [True, False, False, True, False, False, True]
+    assert bank.sent.tolist() == [7, 3, 3]
+    assert bank.suppressed.tolist() == [0, 4, 4]
+
+    sample = bank.update(10, np.full(3, 104.0))
+    assert sample.emit.tolist() == [True, False, True]
+    assert sample.suppressed.tolist() == [False, True, False]
+
+
+def test_bank_interval_statistics():
+    """
+    Test that the variance and percentiles of an interval describe the values the bank received.
+    """
+    bank = SensorBank(normal_value=100, aggregation_interval=1000, perunit_drop_rate=0, perunit_confidence_band=0,
+                      variance_output=[False, True, True], percentile_output=[False, False, True])
+    rows = np.arange(3)
+    series = np.random.default_rng(5).normal(100, 3, size=200)
+    for value in series:
+        bank.add_samples(0, np.column_stack((np.full(3, value), np.full(3, 180.0))), rows)
+    variance = bank.take_variance(rows[1:])
+    percentiles = bank.take_percentiles(rows[2:])
+    assert np.allclose(variance[:, 0], np.var(series, ddof=1))
+    assert np.allclose(variance[:, 1], 0)
+    low, high = np.percentile(series, [5, 95])
+    assert abs(percentiles[0, 0, 0] - low) < 0.5 and abs(percentiles[0, 0, 1] - high) < 0.5
+
+    sample = bank.update(1000, np.full(3, 100.0), np.full(3, 180.0))
+    assert sample.emit.all()
+    assert np.isnan(sample.magnitude_variance[0]) and np.isnan(sample.magnitude_p5[:2]).all()
+    assert (sample.magnitude_variance[1:] > 0).all() and (sample.angle_variance[1:] == 0).all()
+    assert sample.magnitude_p5[2] < 100 < sample.magnitude_p95[2]
+
+
+def test_bank_interval_statistics_exclude_the_carried_mean():
+    """
+    Test that every interval's variance and percentiles describe only the values received
+    during it, not the mean the interval starts with.
+    """
+    bank = SensorBank(normal_value=100, aggregation_interval=5, perunit_drop_rate=0, perunit_confidence_band=0,
+                      variance_output=True, percentile_output=True)
+    series = np.random.default_rng(8).normal(100, 3, size=60)
+    received = []
+    closed = 0
+    for t, value in enumerate(series):
+        if t == 0 or t - bank.tstart[0] <= 5:
+            received.append(value)
+        sample = bank.update(t, np.array([value]), np.array([180.0]))
+        if len(sample.rows):
+            closed += 1
+            assert np.isclose(sample.magnitude_variance[0], np.var(received, ddof=1))
+            low, high = np.percentile(received, [5, 95])
+            assert np.isclose(sample.magnitude_p5[0], low) and np.isclose(sample.magnitude_p95[0], high)
+            received = []
+    assert closed > 5
+
+
+def test_philox_known_answers():
+    assert philox4x32([[0, 0, 0, 0]], [0, 0]).tolist() == [[0x6627e8d5, 0xe169c58d, 0xbc57ac4c, 0x9b00dbd8]]
+    assert philox4x32([[0x243f6a88, 0x85a308d3, 0x13198a2e, 0x03707344]], [0xa4093822, 0x299f31d0]).tolist() == \
+        [[0xd16cfe09, 0x94fdcceb, 0x5001e420, 0x24126ea1]]